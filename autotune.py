@@ -0,0 +1,198 @@
+"""
+Autotunes DC_GAN throughput: train_on_batch and generate_images are briefly
+probed on synthetic data across batch sizes and TensorFlow thread pool
+settings, and the fastest setting within a memory cap is cached per machine
+and model shape so later runs start tuned
+"""
+
+
+import os
+import json
+import time
+import platform
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+DEFAULT_BATCH_SIZES =   (32, 64, 128, 200, 256, 512)
+DEFAULT_CACHE_PATH  =   os.path.join(os.path.expanduser('~'), '.cache',
+                                    'dc_gan', 'autotune.json')
+
+
+def default_thread_configs(coreNum=None):
+    """
+    Returns candidate (intraOp, interOp) thread pool sizes: all, half and a
+    quarter of the cores for intra-op work, each with one or two inter-op
+    threads.
+    """
+    coreNum = coreNum or os.cpu_count() or 1
+    intraOps = sorted({max(1, (coreNum // divisor)) for divisor in (1, 2, 4)},
+                    reverse=True)
+    return [(intraOp, interOp) for intraOp in intraOps for interOp in (1, 2)]
+
+
+def machine_key():
+    """ Returns a string identifying this machine's hardware """
+    return (f'{platform.node()}|{platform.machine()}|' \
+            f'{platform.processor()}|{os.cpu_count()}')
+
+
+def model_key(params, memoryCap=None):
+    """ Returns a string identifying a model shape and memory cap """
+    shapeParams = {name : params[name] for name in sorted(params)
+                    if (name not in ('name', 'imageShape'))}
+    return f'{json.dumps(shapeParams, sort_keys=True)}|cap={memoryCap}'
+
+
+def read_cache(cachePath=DEFAULT_CACHE_PATH):
+    if not os.path.exists(cachePath):
+        return {}
+    with open(cachePath) as cacheFile:
+        return json.load(cacheFile)
+
+
+def write_cache(cache, cachePath=DEFAULT_CACHE_PATH):
+    """ Writes the cache atomically """
+    os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+    with open(f'{cachePath}.tmp', 'w') as cacheFile:
+        json.dump(cache, cacheFile, indent=1, sort_keys=True)
+    os.replace(f'{cachePath}.tmp', cachePath)
+    return cachePath
+
+
+def apply_thread_config(intraOp, interOp):
+    """
+    Sets a new backend session with the given thread pools. Must run before
+    models are built, and before any other session in this process, since
+    TensorFlow sizes its process-wide pools from the first session.
+    """
+    import tensorflow as tf
+    from keras import backend as K
+    K.set_session(tf.Session(config=tf.ConfigProto(
+                                    intra_op_parallelism_threads=intraOp,
+                                    inter_op_parallelism_threads=interOp)))
+    return True
+
+
+def _median_time(func, steps, warmup):
+    for _ in range(warmup):
+        func()
+    stepTimes = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        func()
+        stepTimes.append(time.perf_counter() - start)
+    return float(np.median(stepTimes))
+
+
+def probe_threads(params, intraOp, interOp, batchSizes, memoryCap=None,
+                steps=5, warmup=2):
+    """
+    Probes one thread configuration in a fresh process (thread pools cannot
+    be resized once TensorFlow has created them).
+    Returns:
+        List of dicts of form {'batchSize', 'intraOp', 'interOp',
+        'trainImagesPerSec', 'generateImagesPerSec', 'peakRss', 'skipped'}.
+    """
+    from model import DC_GAN
+    from memory import MemoryMonitor, current_rss, estimate_training_memory
+    apply_thread_config(intraOp, interOp)
+    gan = DC_GAN(params['name'], params['rowNum'], params['columnNum'],
+                params['channelNum'])
+    for key, value in params.items():
+        if key.isupper():
+            setattr(gan, key, value)
+    gan.initialize_models(verbose=False)
+    randomState = np.random.RandomState(0)
+    results = []
+    for batchSize in sorted(batchSizes):
+        result = {'batchSize' : batchSize, 'intraOp' : intraOp,
+                'interOp' : interOp, 'skipped' : False}
+        results.append(result)
+        estimatedBytes = (current_rss() + \
+                        estimate_training_memory(gan, batchSize)['total'])
+        if memoryCap and (estimatedBytes > memoryCap):
+            # larger batches only need more
+            result['skipped'] = True
+            break
+        features = randomState.uniform(0.0, 1.0, size=(((2 * batchSize),) + \
+                                    gan.imageShape)).astype('float32')
+        disTargets = np.concatenate([np.ones(batchSize), np.zeros(batchSize)])
+        noise = randomState.uniform(-1.0, 1.0, size=(batchSize,
+                                    gan.LATENT_DIMS)).astype('float32')
+        advTargets = np.ones(batchSize)
+
+        def train_step():
+            gan.discriminatorCompiled.train_on_batch(x=features, y=disTargets)
+            gan.adversarialCompiled.train_on_batch(x=noise, y=advTargets)
+
+        monitor = MemoryMonitor()
+        trainTime = _median_time(train_step, steps, warmup)
+        generateTime = _median_time(lambda : gan.generate_images(batchSize,
+                                    noiseVector=noise, batchSize=batchSize),
+                                    steps, warmup)
+        monitor.close()
+        result.update({'trainImagesPerSec' : (batchSize / trainTime),
+                        'generateImagesPerSec' : (batchSize / generateTime),
+                        'peakRss' : monitor.peakRss})
+        if memoryCap and (monitor.peakRss > memoryCap):
+            result['skipped'] = True
+            break
+    return results
+
+
+def autotune(params, batchSizes=DEFAULT_BATCH_SIZES, threadConfigs=None,
+            memoryCap=None, cachePath=DEFAULT_CACHE_PATH, force=False,
+            verbose=True):
+    """
+    Finds the batch size and thread pools with the best train_on_batch
+    images/sec within memoryCap, probing each thread configuration in turn
+    in its own process. Results are cached per machine and model.
+    Args:
+        params:             Params of the DC_GAN, from get_params().
+        batchSizes (Opt):   Candidate batch sizes.
+        threadConfigs (Opt): Candidate (intraOp, interOp) pairs. Defaults to
+                                default_thread_configs().
+        memoryCap (Opt):    Max resident bytes of a probe. Defaults to None.
+        cachePath (Opt):    JSON cache of tuned configs. None disables.
+        force (Opt):        Whether to probe even if cached. Defaults to False.
+        verbose (Opt):      Whether to print probe results.
+    Returns:
+        Dict of form {'batchSize', 'intraOp', 'interOp',
+        'trainImagesPerSec', 'generateImagesPerSec', 'peakRss'}.
+    """
+    cacheKey = f'{machine_key()}|{model_key(params, memoryCap)}'
+    cache = read_cache(cachePath) if cachePath else {}
+    if (cacheKey in cache) and not force:
+        if verbose:
+            print(f'Autotune: using cached config {cache[cacheKey]}')
+        return cache[cacheKey]
+    threadConfigs = threadConfigs or default_thread_configs()
+    context = multiprocessing.get_context('spawn')
+    candidates = []
+    for intraOp, interOp in threadConfigs:
+        # probes run one at a time so they do not compete for cores
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results = executor.submit(probe_threads, params, intraOp, interOp,
+                                    batchSizes, memoryCap).result()
+        for result in results:
+            if verbose:
+                status = ('over memory cap' if result['skipped'] else
+                        f'train {round(result["trainImagesPerSec"], 1)} ' \
+                        f'generate {round(result["generateImagesPerSec"], 1)}' \
+                        f' images/sec')
+                print(f'Autotune: batch {result["batchSize"]:>4} threads ' \
+                    f'{intraOp}/{interOp}: {status}')
+            if not result['skipped']:
+                candidates.append(result)
+    assert candidates, 'No configuration fits within the memory cap.'
+    best = max(candidates, key=(lambda result : result['trainImagesPerSec']))
+    best = {name : value for name, value in best.items() if (name != 'skipped')}
+    if cachePath:
+        cache = read_cache(cachePath)
+        cache[cacheKey] = best
+        write_cache(cache, cachePath)
+    if verbose:
+        print(f'Autotune: chose {best}')
+    return best
@@ -0,0 +1,483 @@
+"""
+CPU-only benchmark suite for DC_GAN model building, generation and training
+hot paths on synthetic data shaped like the MNIST configuration of
+run_mnist.py. Results are saved as a JSON baseline which later runs can be
+compared against to flag regressions:
+
+    python benchmark.py run --out benchmark_baseline.json
+    python benchmark.py compare --baseline benchmark_baseline.json
+"""
+
+
+import os
+# benchmarks are CPU-only; must be set before the backend is imported
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+from keras import backend as K
+from model import DC_GAN
+from pipeline import BatchBuffers
+from datasets import MappedDataset
+from memory import current_rss
+
+
+# mirrors run_mnist.py
+MNIST_SHAPE     =   (28, 28, 1)
+MNIST_BATCH     =   200
+MNIST_LR        =   {'disLr' : 0.0002, 'advLr' : 0.00009}
+
+
+def synthetic_dataset(exampleNum, imageShape, seed=0):
+    """
+    Builds random dataset of exampleNum images in [0, 1] with one-hot labels
+    Returns:
+        Tuple of form (features, labels).
+    """
+    randomState = np.random.RandomState(seed)
+    features = randomState.uniform(size=((exampleNum,) + tuple(imageShape)))
+    features = features.astype('float32')
+    labels = np.eye(10, dtype='float32')[randomState.randint(0, 10,
+                                                        size=exampleNum)]
+    return features, labels
+
+
+def build_gan(imageShape=MNIST_SHAPE, name='bench_gan', **modelParams):
+    """ Builds and compiles a quiet DC_GAN for benchmarking in a new graph """
+    K.clear_session()
+    gan = DC_GAN(name=name, rowNum=imageShape[0], columnNum=imageShape[1],
+                channelNum=imageShape[2])
+    for param, value in modelParams.items():
+        setattr(gan, param, value)
+    gan.initialize_models(verbose=False, **MNIST_LR)
+    return gan
+
+
+def time_training(gan, xTrain, yTrain, steps, batchSize=MNIST_BATCH,
+                warmupSteps=3, **trainParams):
+    """
+    Times train_models over steps steps after warmupSteps of graph building
+    and compilation.
+    Returns:
+        Steps per second.
+    """
+    evalData = {'snapshotDir' : None}
+    gan.train_models(xTrain, yTrain, trainSteps=warmupSteps, preSteps=None,
+                    batchSize=batchSize, saveInterval=(warmupSteps + 1),
+                    **evalData, **trainParams)
+    start = time.perf_counter()
+    gan.train_models(xTrain, yTrain, trainSteps=steps, preSteps=None,
+                    batchSize=batchSize, saveInterval=(steps + 1),
+                    **evalData, **trainParams)
+    return (steps / (time.perf_counter() - start))
+
+
+def compare_train_modes(modes, steps=50, exampleNum=10000,
+                        imageShape=MNIST_SHAPE, batchSize=MNIST_BATCH):
+    """
+    Compares steps/sec of train_models under each named set of train_models
+    keyword arguments in modes. Every mode trains a freshly built model.
+    Args:
+        modes:              Dict mapping mode name to train_models kwargs.
+    Returns:
+        Dict mapping mode name to steps per second.
+    """
+    xTrain, yTrain = synthetic_dataset(exampleNum, imageShape)
+    results = {}
+    for modeName, trainParams in modes.items():
+        gan = build_gan(imageShape, name=f'bench_{modeName}')
+        results[modeName] = time_training(gan, xTrain, yTrain, steps,
+                                        batchSize=batchSize, **trainParams)
+    baseline = list(results.values())[0]
+    for modeName, stepsPerSec in results.items():
+        print(f'{modeName}: {round(stepsPerSec, 2)} steps/sec ' \
+            f'({round(stepsPerSec / baseline, 2)}x)')
+    return results
+
+
+def check_loss_equivalence(stepsPerCall=4, blockNum=5, batchSize=32,
+                        tolerance=1e-3, imageShape=MNIST_SHAPE):
+    """
+    Checks that multi-step compiled training reproduces the loss curve of the
+    train_on_batch loop. Two models start from identical weights with dropout
+    disabled and are fed identical batches.
+    Returns:
+        Max absolute difference between per-step [disLoss, disAcc, advLoss,
+        advAcc] of the two paths.
+    """
+    stepNum = stepsPerCall * blockNum
+    xTrain, _ = synthetic_dataset((stepNum * batchSize), imageShape)
+    validBlock = xTrain.reshape(((stepNum, batchSize) + tuple(imageShape)))
+    # reference: train_on_batch loop
+    referenceGan = build_gan(imageShape, name='reference_gan', DROPOUT=0.0)
+    randomState = np.random.RandomState(1)
+    noiseShape = (stepNum, batchSize, referenceGan.LATENT_DIMS)
+    disNoiseBlock, advNoiseBlock = [randomState.uniform(-1.0, 1.0,
+                                    size=noiseShape).astype('float32')
+                                    for _ in range(2)]
+    initialWeights = [referenceGan.generatorStructure.get_weights(),
+                    referenceGan.discriminatorStructure.get_weights()]
+    referenceData = []
+    for step in range(stepNum):
+        invalidExamples = referenceGan.generate_images(batchSize,
+                                            noiseVector=disNoiseBlock[step])
+        disFeatures = np.concatenate([validBlock[step], invalidExamples])
+        disTargets = np.concatenate([np.ones(batchSize), np.zeros(batchSize)])
+        disData = referenceGan.discriminatorCompiled.train_on_batch(
+                                                x=disFeatures, y=disTargets)
+        advData = referenceGan.adversarialCompiled.train_on_batch(
+                                x=advNoiseBlock[step], y=np.ones(batchSize))
+        referenceData.append(list(disData) + list(advData))
+    # multi-step compiled path from the same starting weights
+    fusedGan = build_gan(imageShape, name='fused_gan', DROPOUT=0.0)
+    fusedGan.generatorStructure.set_weights(initialWeights[0])
+    fusedGan.discriminatorStructure.set_weights(initialWeights[1])
+    multiStep = fusedGan.compile_fused_step(stepsPerCall)
+    fusedData = []
+    for block in range(blockNum):
+        blockSlice = slice((block * stepsPerCall), ((block + 1) * stepsPerCall))
+        _, _, stepData = multiStep(validBlock[blockSlice],
+                                    disNoiseBlock[blockSlice],
+                                    advNoiseBlock[blockSlice])
+        fusedData.append(stepData)
+    maxDiff = np.max(np.abs(np.array(referenceData) - np.concatenate(fusedData)))
+    print(f'Loss curve max abs diff over {stepNum} steps: {maxDiff} ' \
+        f'({"OK" if (maxDiff <= tolerance) else "EXCEEDS"} tolerance ' \
+        f'{tolerance})')
+    return maxDiff
+
+
+def measure_batch_allocations(steps=200, batchSize=MNIST_BATCH,
+                            imageShape=MNIST_SHAPE, latentDims=100):
+    """
+    Measures bytes allocated per step by batch assembly, comparing the
+    allocating train_models path with BatchBuffers. Generator output is a
+    fixed stand-in array, since predict() allocates its result either way.
+    Returns:
+        Dict mapping path name to mean peak bytes allocated per step.
+    """
+    xTrain, _ = synthetic_dataset(10000, imageShape)
+    invalidExamples = np.zeros(((batchSize,) + tuple(imageShape)),
+                                dtype='float32')
+
+    def allocating_step():
+        selectionIndex = np.random.randint(0, xTrain.shape[0], size=batchSize)
+        validExamples = xTrain[selectionIndex, :, :, :]
+        disNoise = np.random.uniform(-1.0, 1.0, size=(batchSize, latentDims))
+        features = np.concatenate([validExamples, invalidExamples])
+        targets = np.concatenate([np.ones(shape=(batchSize,)),
+                                np.zeros(shape=(batchSize,))])
+        advNoise = np.random.uniform(-1.0, 1.0, size=(batchSize, latentDims))
+        advTargets = np.ones(shape=(batchSize,))
+        return (features, targets, disNoise, advNoise, advTargets)
+
+    buffers = BatchBuffers(batchSize, imageShape, latentDims, seed=0)
+
+    def buffered_step():
+        validExamples, disNoise, advNoise = buffers.sample(xTrain)
+        features, targets = buffers.assemble_discriminator(validExamples,
+                                                            invalidExamples)
+        return (features, targets, disNoise, advNoise, buffers.advTargets)
+
+    results = {}
+    for pathName, step_func in [('allocating', allocating_step),
+                                ('buffered', buffered_step)]:
+        step_func()
+        tracemalloc.start()
+        stepPeaks = []
+        for _ in range(steps):
+            baseline, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            step_func()
+            stepPeaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+        results[pathName] = float(np.mean(stepPeaks))
+        print(f'{pathName}: {round(results[pathName] / 1024, 1)} KiB ' \
+            f'allocated per step')
+    return results
+
+
+def measure_mapped_rss(exampleNums=(20000, 80000, 320000), shardSize=20000,
+                    batchNum=500, batchSize=MNIST_BATCH,
+                    imageShape=MNIST_SHAPE):
+    """
+    Samples batchNum random batches from sharded MappedDatasets of growing
+    size and records the peak resident memory growth while sampling.
+    Returns:
+        Dict mapping example number to peak RSS growth in bytes.
+    """
+    results = {}
+    for exampleNum in exampleNums:
+        with tempfile.TemporaryDirectory() as shardDir:
+            for shardId, start in enumerate(range(0, exampleNum, shardSize)):
+                shardNum = min(shardSize, (exampleNum - start))
+                shard, _ = synthetic_dataset(shardNum, imageShape, seed=shardId)
+                np.save(os.path.join(shardDir, f'shard_{shardId:05d}.npy'),
+                        shard)
+                del shard
+            dataset = MappedDataset(shardDir)
+            out = np.empty(((batchSize,) + tuple(imageShape)), dtype='float32')
+            startRss = peakRss = current_rss()
+            for _ in range(batchNum):
+                dataset.take(np.random.randint(0, exampleNum, size=batchSize),
+                            out=out)
+                peakRss = max(peakRss, current_rss())
+            results[exampleNum] = (peakRss - startRss)
+            del dataset
+        print(f'{exampleNum} examples: peak RSS growth ' \
+            f'{round(results[exampleNum] / (1024 ** 2), 1)} MiB')
+    return results
+
+
+def measure_parallel_scaling(workerCounts=(1, 2, 4), steps=20,
+                            exampleNum=5000):
+    """
+    Reports data-parallel training steps/sec and speedup over one worker for
+    each worker count at the MNIST batch size.
+    """
+    xTrain, _ = synthetic_dataset(exampleNum, MNIST_SHAPE)
+    results = {}
+    for workerNum in workerCounts:
+        if (MNIST_BATCH % workerNum):
+            print(f'Skipping {workerNum} workers: batch size {MNIST_BATCH} ' \
+                'does not split evenly.')
+            continue
+        summary = build_gan().train_parallel(xTrain, trainSteps=steps,
+                                            batchSize=MNIST_BATCH,
+                                            workerNum=workerNum, seed=0,
+                                            verbose=False)
+        results[workerNum] = summary['stepsPerSec']
+    baseRate = results.get(min(results)) if results else None
+    for workerNum, stepsPerSec in results.items():
+        print(f'{workerNum:>3} workers: {stepsPerSec:8.2f} steps/sec ' \
+            f'({(stepsPerSec / baseRate):.2f}x over {min(results)})')
+    return results
+
+
+def measure_save_formats(repeats=3):
+    """
+    Compares file size and load time of the three-file .h5 save() against
+    save_compact() in float32 and float16.
+    """
+    from keras.models import load_model
+    from modelfile import model_file_size
+    gan = build_gan()
+    with tempfile.TemporaryDirectory() as tempDir:
+        gan.save(tempDir)
+
+        def load_h5():
+            K.clear_session()
+            for fileName in ('generator', 'discriminator', 'adversarial'):
+                load_model(os.path.join(tempDir, f'{fileName}.h5'))
+
+        h5Size = model_file_size(tempDir)
+        h5Time = time_call(load_h5, repeats=repeats, warmup=0)
+        print(f'{"h5 (3 files)":<16} {h5Size / 2**20:8.2f}MB ' \
+            f'load {1000 * h5Time:8.1f}ms')
+        for dtype in ('float32', 'float16'):
+            compactPath = os.path.join(tempDir, f'gan_{dtype}.dcgan')
+            gan.save_compact(compactPath, dtype=dtype)
+
+            def load_compact():
+                K.clear_session()
+                DC_GAN.load(compactPath)
+
+            compactTime = time_call(load_compact, repeats=repeats, warmup=0)
+            print(f'{"compact " + dtype:<16} ' \
+                f'{model_file_size(compactPath) / 2**20:8.2f}MB ' \
+                f'load {1000 * compactTime:8.1f}ms')
+    return True
+
+
+def time_call(func, repeats=10, warmup=2):
+    """ Returns median wall time in seconds of func() over repeats calls """
+    for _ in range(warmup):
+        func()
+    callTimes = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        callTimes.append(time.perf_counter() - start)
+    return float(np.median(callTimes))
+
+
+def _result(value, unit, higherIsBetter):
+    return {'value' : float(value), 'unit' : unit,
+            'higherIsBetter' : higherIsBetter}
+
+
+def bench_build(imageShapes=(MNIST_SHAPE,), repeats=3):
+    """ Latency of building and compiling each model in a fresh graph """
+    results = {}
+    for imageShape in imageShapes:
+        shapeName = 'x'.join(str(dim) for dim in imageShape)
+
+        def new_gan():
+            K.clear_session()
+            return DC_GAN(name='bench_build', rowNum=imageShape[0],
+                        columnNum=imageShape[1], channelNum=imageShape[2])
+
+        results[f'build_discriminator/{shapeName}'] = _result(time_call(
+            lambda : new_gan().build_discriminator(verbose=False),
+            repeats=repeats, warmup=1), 's', False)
+        results[f'build_generator/{shapeName}'] = _result(time_call(
+            lambda : new_gan().build_generator(verbose=False),
+            repeats=repeats, warmup=1), 's', False)
+        results[f'initialize_models/{shapeName}'] = _result(time_call(
+            lambda : new_gan().initialize_models(verbose=False, **MNIST_LR),
+            repeats=repeats, warmup=1), 's', False)
+    return results
+
+
+def bench_generate(batchSizes=(1, 16, 64, 256), repeats=10):
+    """ generate_images throughput across batch sizes """
+    gan = build_gan()
+    results = {}
+    for batchSize in batchSizes:
+        callTime = time_call(lambda : gan.generate_images(batchSize),
+                            repeats=repeats)
+        results[f'generate_images/batch_{batchSize}'] = _result(
+                                (batchSize / callTime), 'images/sec', True)
+    return results
+
+
+def bench_train_on_batch(batchSizes=(32, 64, 200),
+                        imageShapes=(MNIST_SHAPE, (56, 56, 1), (32, 32, 3)),
+                        repeats=10):
+    """
+    Discriminator and adversarial train_on_batch step time across batch sizes
+    and image shapes. The adversarial model is skipped for shapes the
+    generator does not produce.
+    """
+    results = {}
+    for imageShape in imageShapes:
+        shapeName = 'x'.join(str(dim) for dim in imageShape)
+        gan = build_gan(imageShape)
+        generatesShape = (tuple(gan.generatorStructure.output_shape[1:]) == \
+                            tuple(imageShape))
+        for batchSize in batchSizes:
+            features, _ = synthetic_dataset((2 * batchSize), imageShape)
+            targets = np.concatenate([np.ones(batchSize), np.zeros(batchSize)])
+            results[f'dis_train_on_batch/{shapeName}/batch_{batchSize}'] = \
+                _result(time_call(lambda : gan.discriminatorCompiled.\
+                                train_on_batch(x=features, y=targets),
+                                repeats=repeats), 's', False)
+            if not generatesShape:
+                continue
+            noise = np.random.uniform(-1.0, 1.0,
+                                    size=(batchSize, gan.LATENT_DIMS))
+            results[f'adv_train_on_batch/{shapeName}/batch_{batchSize}'] = \
+                _result(time_call(lambda : gan.adversarialCompiled.\
+                                train_on_batch(x=noise,
+                                                y=np.ones(batchSize)),
+                                repeats=repeats), 's', False)
+    return results
+
+
+def bench_train_models(steps=30, exampleNum=5000):
+    """ End-to-end train_models steps/sec on synthetic data """
+    xTrain, yTrain = synthetic_dataset(exampleNum, MNIST_SHAPE)
+    return {'train_models/mnist' : _result(time_training(build_gan(), xTrain,
+                                            yTrain, steps), 'steps/sec', True)}
+
+
+SUITE = {'build' : bench_build, 'generate' : bench_generate,
+        'train_on_batch' : bench_train_on_batch,
+        'train_models' : bench_train_models}
+
+
+def run_suite(benchNames=None):
+    """
+    Runs the named benchmarks of SUITE (all by default).
+    Returns:
+        Dict of form {'machine' : dict, 'results' : dict of name to result}.
+    """
+    results = {}
+    for benchName in (benchNames or SUITE):
+        print(f'Running {benchName} benchmarks...')
+        results.update(SUITE[benchName]())
+    machine = {'platform' : platform.platform(),
+                'processor' : platform.processor(),
+                'cpuCount' : os.cpu_count(),
+                'python' : platform.python_version()}
+    return {'machine' : machine, 'results' : results}
+
+
+def compare_results(baseline, current, threshold=0.1):
+    """
+    Compares current results against baseline, flagging any benchmark that
+    got worse by more than threshold (relative).
+    Returns:
+        List of names of regressed benchmarks.
+    """
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        baseResult = baseline['results'].get(name)
+        if baseResult is None:
+            print(f'  NEW        {name}: {result["value"]:.6g} ' \
+                f'{result["unit"]}')
+            continue
+        ratio = result['value'] / baseResult['value']
+        change = (ratio - 1.0) if result['higherIsBetter'] else (1.0 - ratio)
+        regressed = (change < -threshold)
+        if regressed:
+            regressions.append(name)
+        print(f'  {"REGRESSED" if regressed else "ok":<10} {name}: ' \
+            f'{baseResult["value"]:.6g} -> {result["value"]:.6g} ' \
+            f'{result["unit"]} ({100 * change:+.1f}%)')
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=('DC_GAN CPU benchmark ' \
+                                                    'suite'))
+    parser.add_argument('mode', choices=['run', 'compare', 'extras'],
+                        help=('run: save results; compare: run and flag ' \
+                            'regressions against a baseline; extras: run ' \
+                            'the training-mode, allocation, RSS and ' \
+                            'data-parallel scaling and save format ' \
+                            'checks'))
+    parser.add_argument('--out', default='benchmark_baseline.json',
+                        help='Path to write results to in run mode.')
+    parser.add_argument('--baseline', default='benchmark_baseline.json',
+                        help='Baseline to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative slowdown flagged as a regression.')
+    parser.add_argument('--only', nargs='+', choices=list(SUITE),
+                        help='Benchmarks to run. Defaults to all.')
+    args = parser.parse_args(args)
+    if (args.mode == 'extras'):
+        compare_train_modes({'train_on_batch' : {}, 'fused' : {'fused' : True},
+                            'multi_step_8' : {'stepsPerCall' : 8},
+                            'replay' : {'replaySize' : (10 * MNIST_BATCH),
+                                        'replayRatio' : 0.5,
+                                        'replayInterval' : 2}})
+        check_loss_equivalence()
+        measure_batch_allocations()
+        measure_mapped_rss()
+        measure_parallel_scaling()
+        measure_save_formats()
+        return 0
+    current = run_suite(args.only)
+    if (args.mode == 'run'):
+        with open(args.out, 'w') as outFile:
+            json.dump(current, outFile, indent=2, sort_keys=True)
+        print(f'Saved {len(current["results"])} results to {args.out}')
+        return 0
+    with open(args.baseline) as baselineFile:
+        baseline = json.load(baselineFile)
+    if (baseline['machine'] != current['machine']):
+        print('Warning: baseline was recorded on a different machine.')
+    regressions = compare_results(baseline, current, args.threshold)
+    print(f'{len(regressions)} regression(s) over ' \
+        f'{round(100 * args.threshold)}%.')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
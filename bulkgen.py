@@ -0,0 +1,198 @@
+"""
+Bulk offline sample generation: the generator runs in large batches on seed-
+addressed latents, and finished shards are handed to a pool of writer
+processes emitting .npy arrays or zip archives of PNGs. A manifest records
+every completed shard, so a killed job resumes after the last one written.
+Only numpy and the standard library are imported at module level, keeping
+spawned writers light.
+
+    python bulkgen.py MODEL_FILE OUT_DIR -n 1000000 --shard-size 10000
+"""
+
+
+import os
+import sys
+import json
+import time
+import zipfile
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from snapshot import encode_png
+
+
+MANIFEST_NAME   =   'manifest.json'
+SHARD_FORMATS   =   ('npy', 'png')
+
+
+def shard_name(shardIndex, shardFormat):
+    """ Returns file name of a shard """
+    extension = 'npy' if (shardFormat == 'npy') else 'zip'
+    return f'shard_{shardIndex:06d}.{extension}'
+
+
+def write_shard(images, outDir, shardIndex, seedStart, shardFormat):
+    """
+    Writes one shard atomically through a temporary file. Runs in writer
+    processes.
+    Args:
+        images:             float32 array of shape (n, rows, cols, channels).
+        outDir:             Directory to write under.
+        shardIndex:         Index of the shard.
+        seedStart:          Seed of the first image; image i has seed
+                                seedStart + i.
+        shardFormat:        'npy' for one array, or 'png' for a zip archive
+                                of {seed}.png files.
+    Returns:
+        Manifest record of the shard.
+    """
+    fileName = shard_name(shardIndex, shardFormat)
+    outPath = os.path.join(outDir, fileName)
+    tempPath = f'{outPath}.tmp'
+    if (shardFormat == 'npy'):
+        with open(tempPath, 'wb') as shardFile:
+            np.save(shardFile, images)
+    else:
+        # PNGs are already deflated, so are stored without recompression
+        with zipfile.ZipFile(tempPath, 'w', zipfile.ZIP_STORED) as archive:
+            for i, image in enumerate(images):
+                archive.writestr(f'{seedStart + i}.png', encode_png(image))
+    os.replace(tempPath, outPath)
+    return {'shard' : shardIndex, 'file' : fileName,
+            'seeds' : [seedStart, (seedStart + len(images))],
+            'bytes' : os.path.getsize(outPath)}
+
+
+def read_manifest(outDir):
+    """ Returns the manifest under outDir, or None if there is none """
+    manifestPath = os.path.join(outDir, MANIFEST_NAME)
+    if not os.path.exists(manifestPath):
+        return None
+    with open(manifestPath) as manifestFile:
+        return json.load(manifestFile)
+
+
+def write_manifest(outDir, manifest):
+    """ Writes the manifest atomically """
+    manifestPath = os.path.join(outDir, MANIFEST_NAME)
+    with open(f'{manifestPath}.tmp', 'w') as manifestFile:
+        json.dump(manifest, manifestFile, indent=1)
+    os.replace(f'{manifestPath}.tmp', manifestPath)
+    return manifestPath
+
+
+def generate_bulk(gan, outDir, n, shardSize=10000, batchSize=1024,
+                seedStart=0, shardFormat='npy', workerNum=2, modelPath=None):
+    """
+    Generates images for seeds seedStart through seedStart + n - 1 into
+    shards under outDir, resuming after any shards an earlier run with the
+    same settings recorded in the manifest.
+    Args:
+        gan:                DC_GAN whose generator to sample.
+        outDir:             Directory of shards and manifest.
+        n:                  Number of images.
+        shardSize (Opt):    Images per shard. Defaults to 10000.
+        batchSize (Opt):    Images per generator call. Defaults to 1024.
+        seedStart (Opt):    Seed of the first image. Defaults to 0.
+        shardFormat (Opt):  'npy' or 'png'. Defaults to 'npy'.
+        workerNum (Opt):    Number of writer processes. Defaults to 2.
+        modelPath (Opt):    Model path recorded in the manifest.
+    Returns:
+        The final manifest.
+    """
+    from latent import seeded_latents
+    assert (shardFormat in SHARD_FORMATS), (f'shardFormat expected one of ' \
+                                    f'{SHARD_FORMATS}, but found {shardFormat}.')
+    assert ((n > 0) and (shardSize > 0) and (batchSize > 0)), ('n, ' \
+                                'shardSize and batchSize must be positive.')
+    os.makedirs(outDir, exist_ok=True)
+    settings = {'model' : modelPath, 'n' : n, 'shardSize' : shardSize,
+                'seedStart' : seedStart, 'format' : shardFormat,
+                'imageShape' : list(gan.imageShape)}
+    manifest = read_manifest(outDir)
+    if manifest:
+        assert (manifest['settings'] == settings), ('Existing manifest in ' \
+                f'{outDir} was written with settings {manifest["settings"]}.')
+    else:
+        manifest = {'settings' : settings, 'shards' : {}}
+    done = {int(index) for index, record in manifest['shards'].items()
+            if os.path.exists(os.path.join(outDir, record['file']))}
+    shardNum = -(-n // shardSize)
+    pending = [index for index in range(shardNum) if (index not in done)]
+    print(f'{len(done)} of {shardNum} shards already written; generating ' \
+        f'{len(pending)}.')
+    executor = ProcessPoolExecutor(max_workers=workerNum,
+                            mp_context=multiprocessing.get_context('spawn'))
+    # bounded so at most a few shards are held in memory at once
+    maxPending = (2 * workerNum)
+    futures = set()
+    start = time.perf_counter()
+    imageNum = 0
+
+    def collect(returnWhen):
+        nonlocal futures
+        finished, futures = wait(futures, return_when=returnWhen)
+        for future in finished:
+            record = future.result()
+            manifest['shards'][str(record['shard'])] = record
+        if finished:
+            write_manifest(outDir, manifest)
+
+    try:
+        for shardIndex in pending:
+            shardStart = seedStart + (shardIndex * shardSize)
+            shardStop = seedStart + min(((shardIndex + 1) * shardSize), n)
+            images = np.empty((((shardStop - shardStart),) + gan.imageShape),
+                                dtype='float32')
+            for batchStart in range(shardStart, shardStop, batchSize):
+                batchStop = min((batchStart + batchSize), shardStop)
+                latents = seeded_latents(np.arange(batchStart, batchStop),
+                                        gan.LATENT_DIMS)
+                images[(batchStart - shardStart):(batchStop - shardStart)] = \
+                    gan.generate_images((batchStop - batchStart),
+                                        noiseVector=latents,
+                                        batchSize=batchSize)
+            while (len(futures) >= maxPending):
+                collect(FIRST_COMPLETED)
+            futures.add(executor.submit(write_shard, images, outDir,
+                                        shardIndex, shardStart, shardFormat))
+            imageNum += len(images)
+            elapsed = time.perf_counter() - start
+            print(f'Shard {shardIndex + 1}/{shardNum} generated | ' \
+                f'{round(imageNum / elapsed, 1)} images/sec')
+        while futures:
+            collect(FIRST_COMPLETED)
+    finally:
+        # shards generated but not yet recorded are redone on resume
+        executor.shutdown(wait=True)
+    print(f'Wrote {imageNum} images in {round(time.perf_counter() - start, 2)}' \
+        f's to {outDir}.')
+    return manifest
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=('Generate sharded DC_GAN ' \
+                                                'samples in bulk'))
+    parser.add_argument('model', help='Model file written by save_compact().')
+    parser.add_argument('out', help='Output directory of shards and manifest.')
+    parser.add_argument('-n', type=int, required=True,
+                        help='Number of images.')
+    parser.add_argument('--shard-size', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--seed-start', type=int, default=0)
+    parser.add_argument('--format', choices=SHARD_FORMATS, default='npy')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Number of writer processes.')
+    args = parser.parse_args(args)
+    from model import DC_GAN
+    gan = DC_GAN.load(args.model, compile=False)
+    generate_bulk(gan, args.out, args.n, shardSize=args.shard_size,
+                batchSize=args.batch_size, seedStart=args.seed_start,
+                shardFormat=args.format, workerNum=args.workers,
+                modelPath=os.path.abspath(args.model))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Implements a bounded cache of generated images addressed by latent seed
+"""
+
+
+from collections import OrderedDict
+
+
+class LatentImageCache(object):
+    """
+    LRU cache of rendered images keyed by (weight version, seed), where the
+    version is any hashable identifying the weights, such as
+    DC_GAN.weight_fingerprint(). Entries of any other weight version are
+    dropped as soon as a lookup is made with a new version, so the cache
+    never serves images from stale weights.
+    Args:
+        maxSize (Opt):      Max number of cached images. Defaults to 1024.
+    """
+
+    def __init__(self, maxSize=1024):
+        assert (isinstance(maxSize, int) and (maxSize >= 0)), ('maxSize must ' \
+                                                    'be a non-negative int.')
+        self.maxSize    =   maxSize
+        self.version    =   None
+        self.hits       =   0
+        self.misses     =   0
+        self._images    =   OrderedDict()
+
+    def __str__(self):
+        return (f'< LatentImageCache SIZE={len(self)}/{self.maxSize} ' \
+                f'VERSION={self.version} | HITS={self.hits} ' \
+                f'MISSES={self.misses} >')
+
+    def __len__(self):
+        return len(self._images)
+
+    def hit_rate(self):
+        """ Fraction of lookups served from the cache """
+        lookupNum = self.hits + self.misses
+        return (self.hits / lookupNum) if lookupNum else 0.0
+
+    def _check_version(self, version):
+        """ Clears the cache if weights have changed since last access """
+        if (version != self.version):
+            self._images.clear()
+            self.version = version
+
+    def get(self, version, seed):
+        """ Returns the cached image for seed or None, counting hit/miss """
+        self._check_version(version)
+        image = self._images.get(seed)
+        if image is None:
+            self.misses += 1
+            return None
+        self._images.move_to_end(seed)
+        self.hits += 1
+        return image
+
+    def put(self, version, seed, image):
+        """ Caches a read-only copy of image, evicting least recently used """
+        if (self.maxSize == 0):
+            return False
+        self._check_version(version)
+        image = image.copy()
+        image.setflags(write=False)
+        self._images[seed] = image
+        self._images.move_to_end(seed)
+        while (len(self._images) > self.maxSize):
+            self._images.popitem(last=False)
+        return True
+
+    def clear(self):
+        """ Drops all images and resets counters """
+        self._images.clear()
+        self.hits = 0
+        self.misses = 0
+        return True
@@ -0,0 +1,232 @@
+"""
+Implements training checkpoints for DC_GAN: in-memory snapshots of training
+state, a background writer persisting them, and restore. Restore is exact
+for the train_on_batch and fused loops, with or without batch buffers,
+replay and validation; prefetch worker RNGs and stream positions are not
+captured
+"""
+
+
+import os
+import json
+import queue
+import threading
+import numpy as np
+from keras import backend as K
+
+
+CHECKPOINT_PREFIX = 'checkpoint_'
+
+
+def _optimizer_weights(compiledModel):
+    """ Returns optimizer state of a compiled model (empty if never trained) """
+    return K.batch_get_value(compiledModel.optimizer.weights)
+
+
+def _set_optimizer_weights(compiledModel, values):
+    """ Restores optimizer state, building the training function if needed """
+    if not values:
+        return False
+    if not compiledModel.optimizer.weights:
+        compiledModel._make_train_function()
+    compiledModel.optimizer.set_weights(values)
+    return True
+
+
+def snapshot_state(gan, step, buffers=None, replay=None, validator=None):
+    """
+    Copies everything needed to resume training of gan after step into
+    host memory: generator and discriminator weights, compiled optimizer
+    states, the global numpy RNG state and that of any batch buffers, the
+    contents, cursor and RNG of any replay buffer, and the rotation cursor
+    and schedule of any validator. Fused optimizer state must be synced to
+    the compiled optimizers beforehand.
+    Args:
+        gan:                DC_GAN being trained.
+        step:               Last completed training step.
+        buffers (Opt):      BatchBuffers whose noise generator to include.
+        replay (Opt):       ReplayBuffer to include.
+        validator (Opt):    RotatingValidator whose position to include.
+    Returns:
+        Dict of form {'meta' : dict, 'arrays' : dict of name to array}.
+    """
+    arrays = {}
+
+    def add_group(groupName, values):
+        for i, value in enumerate(values):
+            arrays[f'{groupName}/{i:04d}'] = np.asarray(value)
+        return len(values)
+
+    groupSizes = {
+        'generator' : add_group('generator',
+                                gan.generatorStructure.get_weights()),
+        'discriminator' : add_group('discriminator',
+                                gan.discriminatorStructure.get_weights()),
+        'disOptimizer' : add_group('disOptimizer',
+                                _optimizer_weights(gan.discriminatorCompiled)),
+        'advOptimizer' : add_group('advOptimizer',
+                                _optimizer_weights(gan.adversarialCompiled))}
+    rngName, rngKeys, rngPos, rngHasGauss, rngGauss = np.random.get_state()
+    arrays['rng/keys'] = rngKeys
+    meta = {'step' : int(step), 'weightVersion' : int(gan.weightVersion),
+            'params' : gan.get_params(), 'groupSizes' : groupSizes,
+            'rng' : [rngName, int(rngPos), int(rngHasGauss), float(rngGauss)],
+            'bufferRng' : (buffers._generator.bit_generator.state
+                            if buffers else None)}
+    if replay:
+        arrays['replay/images'] = replay.images[:replay.size].copy()
+        meta['replay'] = {'size' : replay.size, 'cursor' : replay.cursor,
+                        'stepNum' : replay.stepNum,
+                        'rng' : replay._generator.bit_generator.state}
+    if validator:
+        meta['validator'] = {'cursor' : validator.cursor,
+                            'nextStep' : validator._nextStep}
+    return {'meta' : meta, 'arrays' : arrays}
+
+
+def restore_state(gan, state, buffers=None, replay=None, validator=None,
+                restoreRng=True):
+    """
+    Restores a snapshot from snapshot_state() or load_checkpoint() into gan,
+    whose models must already be built and compiled with the same params,
+    and into any batch buffers, replay buffer and validator given. Unless
+    restoreRng is False, the global np.random state is restored too.
+    Returns:
+        Last completed step of the snapshot.
+    """
+    meta, arrays = state['meta'], state['arrays']
+
+    def get_group(groupName):
+        return [arrays[f'{groupName}/{i:04d}']
+                for i in range(meta['groupSizes'].get(groupName, 0))]
+
+    gan.generatorStructure.set_weights(get_group('generator'))
+    gan.discriminatorStructure.set_weights(get_group('discriminator'))
+    _set_optimizer_weights(gan.discriminatorCompiled, get_group('disOptimizer'))
+    _set_optimizer_weights(gan.adversarialCompiled, get_group('advOptimizer'))
+    if restoreRng:
+        rngName, rngPos, rngHasGauss, rngGauss = meta['rng']
+        np.random.set_state((rngName, arrays['rng/keys'], rngPos,
+                            rngHasGauss, rngGauss))
+    if buffers and meta['bufferRng']:
+        buffers._generator.bit_generator.state = meta['bufferRng']
+    if replay and meta.get('replay'):
+        replayMeta = meta['replay']
+        replay.images[:replayMeta['size']] = arrays['replay/images']
+        replay.size = replayMeta['size']
+        replay.cursor = replayMeta['cursor']
+        replay.stepNum = replayMeta['stepNum']
+        replay._generator.bit_generator.state = replayMeta['rng']
+    if validator and meta.get('validator'):
+        validator.cursor = meta['validator']['cursor']
+        validator._nextStep = meta['validator']['nextStep']
+    gan.weightVersion = meta['weightVersion']
+    return meta['step']
+
+
+def checkpoint_path(directory, step):
+    """ Returns path of the checkpoint for step under directory """
+    return os.path.join(directory, f'{CHECKPOINT_PREFIX}{step:09d}.npz')
+
+
+def list_checkpoints(directory):
+    """ Returns checkpoint paths under directory from oldest to newest """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, fileName)
+            for fileName in sorted(os.listdir(directory))
+            if (fileName.startswith(CHECKPOINT_PREFIX) and
+                fileName.endswith('.npz'))]
+
+
+def latest_checkpoint(directory):
+    """ Returns path of the newest checkpoint under directory or None """
+    checkpoints = list_checkpoints(directory)
+    return checkpoints[-1] if checkpoints else None
+
+
+def write_checkpoint(state, path):
+    """ Writes a snapshot to path atomically through a temporary file """
+    tempPath = f'{path}.tmp'
+    with open(tempPath, 'wb') as checkpointFile:
+        np.savez(checkpointFile, __meta__=np.array(json.dumps(state['meta'])),
+                **state['arrays'])
+    os.replace(tempPath, path)
+    return path
+
+
+def load_checkpoint(path):
+    """ Reads a snapshot written by write_checkpoint() """
+    with np.load(path, allow_pickle=False) as checkpointFile:
+        arrays = {name : checkpointFile[name]
+                for name in checkpointFile.files if (name != '__meta__')}
+        meta = json.loads(str(checkpointFile['__meta__']))
+    return {'meta' : meta, 'arrays' : arrays}
+
+
+class CheckpointWriter(object):
+    """
+    Persists snapshots on a background thread so training only pays for the
+    in-memory copy, keeping the newest keep checkpoints on disk. At most
+    maxPending snapshots wait to be written; submit() blocks beyond that so
+    memory stays bounded if the disk falls behind.
+    Args:
+        directory:          Directory to write checkpoints under.
+        keep (Opt):         Number of newest checkpoints to keep. Defaults
+                                to 3.
+        maxPending (Opt):   Max snapshots queued for writing. Defaults to 1.
+    """
+
+    def __init__(self, directory, keep=3, maxPending=1):
+        assert (isinstance(keep, int) and (keep > 0)), ('keep must be a ' \
+                                                        'positive int.')
+        os.makedirs(directory, exist_ok=True)
+        self.directory      =   directory
+        self.keep           =   keep
+        self.writtenNum     =   0
+        self._queue         =   queue.Queue(maxsize=maxPending)
+        self._error         =   None
+        self._thread        =   threading.Thread(target=self._work,
+                                                name='checkpoint_writer',
+                                                daemon=True)
+        self._thread.start()
+
+    def __str__(self):
+        return (f'< CheckpointWriter DIR={self.directory} KEEP={self.keep} ' \
+                f'| WRITTEN={self.writtenNum} >')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _work(self):
+        """ Writes queued snapshots until a None sentinel arrives """
+        while True:
+            state = self._queue.get()
+            if state is None:
+                return
+            try:
+                write_checkpoint(state, checkpoint_path(self.directory,
+                                                        state['meta']['step']))
+                self.writtenNum += 1
+                for stalePath in list_checkpoints(self.directory)[:-self.keep]:
+                    os.remove(stalePath)
+            except Exception as error:
+                self._error = error
+
+    def submit(self, state):
+        """ Queues a snapshot for writing """
+        if self._error is not None:
+            raise self._error
+        self._queue.put(state)
+        return True
+
+    def close(self):
+        """ Writes any pending snapshot and stops the writer """
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return True
@@ -0,0 +1,424 @@
+"""
+Implements dataset wrappers that DC_GAN.train_models can sample batches from
+without holding the full dataset in memory
+"""
+
+
+import os
+import mmap
+import threading
+import numpy as np
+
+
+class IndexedDataset(object):
+    """
+    Base class for dataset wrappers. Subclasses must set self.shape and
+    define take(index, out=None), returning the images at index (written to
+    out if given); numpy-style indexing on the first axis is built on top of
+    take().
+    """
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        """
+        Supports integer, slice, and index-array lookup on the first axis, as
+        well as tuples whose trailing elements index each image.
+        """
+        imageKey = None
+        if isinstance(key, tuple):
+            key, imageKey = key[0], key[1:]
+        if isinstance(key, (int, np.integer)):
+            index = np.array([key])
+        elif isinstance(key, slice):
+            index = np.arange(*key.indices(len(self)))
+        else:
+            index = np.asarray(key)
+            if (index.dtype == bool):
+                index = np.flatnonzero(index)
+        examples = self.take(index)
+        if imageKey:
+            examples = examples[(slice(None),) + tuple(imageKey)]
+        if isinstance(key, (int, np.integer)):
+            return examples[0]
+        return examples
+
+
+class MappedDataset(IndexedDataset):
+    """
+    Read-only dataset of images backed by one or more memory-mapped shards.
+    Shards may be .npy files or raw arrays of a known dtype and image shape.
+    Random batches are gathered shard by shard in sorted index order so that
+    reads move forward through each file, and mapped pages can periodically
+    be released so resident memory stays flat as the dataset grows.
+    Args:
+        path:               Path to a .npy file, raw shard, or a directory of
+                                shards (read in sorted filename order).
+        imageShape (Opt):   Shape of a single image. Required for raw shards.
+        dtype (Opt):        Dtype of raw shards. Defaults to 'float32'.
+        releaseInterval (Opt): Number of gathers after which mapped pages are
+                                dropped from resident memory. Defaults to 100;
+                                None never releases.
+    """
+
+    SHARD_EXTENSIONS = ('.npy', '.raw', '.bin')
+
+    def __init__(self, path, imageShape=None, dtype='float32',
+                releaseInterval=100):
+        assert os.path.exists(path), f'No dataset found at {path}.'
+        if os.path.isdir(path):
+            shardPaths = [os.path.join(path, fileName)
+                        for fileName in sorted(os.listdir(path))
+                        if fileName.endswith(self.SHARD_EXTENSIONS)]
+        else:
+            shardPaths = [path]
+        assert shardPaths, f'No shards with extension ' \
+                            f'{self.SHARD_EXTENSIONS} found under {path}.'
+        self.path               =   path
+        self.releaseInterval    =   releaseInterval
+        self.shards             =   [self._map_shard(shardPath, imageShape,
+                                                    dtype)
+                                    for shardPath in shardPaths]
+        imageShapes = set(shard.shape[1:] for shard in self.shards)
+        dtypes = set(shard.dtype for shard in self.shards)
+        assert (len(imageShapes) == 1), ('All shards must share an image ' \
+                                        f'shape, but found {imageShapes}.')
+        assert (len(dtypes) == 1), ('All shards must share a dtype, but ' \
+                                    f'found {dtypes}.')
+        self.imageShape     =   imageShapes.pop()
+        self.dtype          =   dtypes.pop()
+        # offsets[i] is the global index of the first example of shard i
+        self.offsets        =   np.cumsum([0] + [len(shard)
+                                                for shard in self.shards])
+        self.shape          =   ((int(self.offsets[-1]),) + self.imageShape)
+        self._gatherNum     =   0
+
+    def __str__(self):
+        return (f'< MappedDataset PATH={self.path} SHAPE={self.shape} ' \
+                f'DTYPE={self.dtype} SHARDS={len(self.shards)} >')
+
+    def __getstate__(self):
+        # pickles by path, so worker processes map the shards themselves
+        return {'path' : self.path, 'imageShape' : self.imageShape,
+                'dtype' : self.dtype.str,
+                'releaseInterval' : self.releaseInterval}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @staticmethod
+    def _map_shard(shardPath, imageShape, dtype):
+        """ Memory-maps a single shard read-only """
+        if shardPath.endswith('.npy'):
+            return np.load(shardPath, mmap_mode='r')
+        assert (imageShape is not None), ('imageShape is required to map raw ' \
+                                        f'shard {shardPath}.')
+        imageSize = int(np.prod(imageShape)) * np.dtype(dtype).itemsize
+        exampleNum = os.path.getsize(shardPath) // imageSize
+        return np.memmap(shardPath, dtype=dtype, mode='r',
+                        shape=((exampleNum,) + tuple(imageShape)))
+
+    def release_pages(self):
+        """ Drops mapped pages of every shard from resident memory """
+        for shard in self.shards:
+            shardMap = getattr(shard, '_mmap', None)
+            if (shardMap is not None) and hasattr(shardMap, 'madvise'):
+                shardMap.madvise(mmap.MADV_DONTNEED)
+        return True
+
+    def take(self, index, out=None):
+        """
+        Gathers the examples at global index into out in the given order.
+        Reads are made per shard in ascending index order.
+        Args:
+            index:          1d array of global example indices.
+            out (Opt):      Array of shape (len(index),) + imageShape to
+                                write into. Defaults to None (allocated).
+        Returns:
+            Array of gathered examples.
+        """
+        index = np.asarray(index)
+        if out is None:
+            out = np.empty(((len(index),) + self.imageShape), dtype=self.dtype)
+        order = np.argsort(index, kind='stable')
+        sortedIndex = index[order]
+        shardIds = np.searchsorted(self.offsets, sortedIndex, side='right') - 1
+        shardBounds = np.searchsorted(shardIds, np.arange(len(self.shards) + 1))
+        for shardId, shard in enumerate(self.shards):
+            start, end = shardBounds[shardId], shardBounds[shardId + 1]
+            if (start == end):
+                continue
+            localIndex = sortedIndex[start:end] - self.offsets[shardId]
+            out[order[start:end]] = shard[localIndex]
+        self._gatherNum += 1
+        if self.releaseInterval and \
+            ((self._gatherNum % self.releaseInterval) == 0):
+            self.release_pages()
+        return out
+
+
+class CompactDataset(IndexedDataset):
+    """
+    Dataset of images in [0, 1] stored as uint8, or as packed bits for binary
+    images, cutting resident memory by 4x (32x for bits) against float32.
+    Only sampled batches are expanded to float32, with the compact gather
+    done into a reused per-thread scratch buffer.
+    Args:
+        storage:            uint8 array of shape (exampleNum,) + imageShape,
+                                or of packed rows when binary. May also be
+                                a dataset object with a take() method, such
+                                as a uint8 MappedDataset.
+        imageShape (Opt):   Shape of a single image. Required when binary.
+        binary (Opt):       Whether storage holds np.packbits rows of each
+                                flattened image. Defaults to False.
+    """
+
+    SCALE = 1.0 / 255.0
+
+    def __init__(self, storage, imageShape=None, binary=False):
+        if binary:
+            assert (imageShape is not None), ('Binary storage requires ' \
+                                            'imageShape.')
+        else:
+            assert (storage.dtype == np.uint8), ('storage expected dtype ' \
+                                        f'uint8, but found {storage.dtype}.')
+            imageShape = tuple(storage.shape[1:])
+        self.storage        =   storage
+        self.binary         =   binary
+        self.imageShape     =   tuple(imageShape)
+        self.pixelNum       =   int(np.prod(self.imageShape))
+        self.shape          =   ((storage.shape[0],) + self.imageShape)
+        self.dtype          =   np.dtype('float32')
+        self._local         =   threading.local()
+
+    def __str__(self):
+        return (f'< CompactDataset SHAPE={self.shape} BINARY={self.binary} ' \
+                f'NBYTES={self.nbytes} >')
+
+    def __getstate__(self):
+        # scratch buffers are per thread and rebuilt on demand
+        state = dict(self.__dict__)
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def nbytes(self):
+        """ Bytes held by the compact storage """
+        return int(np.prod(self.storage.shape)) * self.storage.dtype.itemsize
+
+    @classmethod
+    def from_float(cls, images, binary=False, chunkSize=4096):
+        """
+        Quantizes float images in [0, 1] to compact storage chunk by chunk,
+        so no full-size float temporary is made.
+        Args:
+            images:             Float array of shape (exampleNum,) + imageShape.
+            binary (Opt):       Whether to threshold at 0.5 and pack bits.
+                                    Defaults to False.
+            chunkSize (Opt):    Examples converted at a time. Defaults to 4096.
+        Returns:
+            CompactDataset of images.
+        """
+        exampleNum, imageShape = images.shape[0], tuple(images.shape[1:])
+        pixelNum = int(np.prod(imageShape))
+        if binary:
+            storage = np.empty((exampleNum, ((pixelNum + 7) // 8)),
+                                dtype=np.uint8)
+        else:
+            storage = np.empty(images.shape, dtype=np.uint8)
+        for start in range(0, exampleNum, chunkSize):
+            chunk = np.asarray(images[start:(start + chunkSize)])
+            if binary:
+                flatChunk = chunk.reshape(chunk.shape[0], pixelNum)
+                storage[start:(start + chunkSize)] = np.packbits(
+                                                    (flatChunk >= 0.5), axis=1)
+            else:
+                storage[start:(start + chunkSize)] = np.rint(
+                                    np.clip(chunk, 0.0, 1.0) * 255.0)
+        return cls(storage, imageShape=imageShape, binary=binary)
+
+    def _scratch(self, batchSize):
+        """ Returns this thread's compact gather buffer for batchSize rows """
+        scratch = getattr(self._local, 'scratch', None)
+        rowShape = self.storage.shape[1:]
+        if (scratch is None) or (scratch.shape[0] < batchSize):
+            scratch = np.empty(((batchSize,) + tuple(rowShape)),
+                                dtype=np.uint8)
+            self._local.scratch = scratch
+        return scratch[:batchSize]
+
+    def take(self, index, out=None):
+        """
+        Gathers the examples at index and expands them to float32 in [0, 1].
+        Args:
+            index:          1d array of example indices.
+            out (Opt):      float32 array of shape (len(index),) + imageShape
+                                to write into. Defaults to None (allocated).
+        Returns:
+            Array of gathered examples.
+        """
+        index = np.asarray(index)
+        if out is None:
+            out = np.empty(((len(index),) + self.imageShape), dtype='float32')
+        scratch = self._scratch(len(index))
+        if isinstance(self.storage, np.ndarray):
+            np.take(self.storage, index, axis=0, out=scratch)
+        else:
+            self.storage.take(index, out=scratch)
+        if self.binary:
+            pixels = np.unpackbits(scratch, axis=1, count=self.pixelNum)
+            np.copyto(out.reshape(len(index), self.pixelNum), pixels)
+        else:
+            np.multiply(scratch, np.float32(self.SCALE), out=out)
+        return out
+
+
+class StreamExhausted(Exception):
+    """ Raised when a StreamDataset without a shuffle buffer runs dry """
+    pass
+
+
+class StreamDataset(object):
+    """
+    Training images read from a stream instead of an indexable array: an
+    iterable of batches (or of single images) such as a generator decoding
+    files, or a callable returning the next batch and None (or raising
+    StopIteration) when done. Nothing is read until the first sample, and
+    only the first batch is checked against imageShape. Without a shuffle
+    buffer, images are used in arrival order. With one, arriving images fill
+    a buffer of bufferSize images (at least a batch) that batches are drawn
+    from at random without replacement, each drawn slot being refilled by
+    the next arrival; once the source is exhausted, the buffer drains. Either
+    way every image is used exactly once, and StreamExhausted is raised once
+    fewer than a batch remain. Memory is bounded by the buffer plus one
+    source batch. Sampling is serialized by a lock so prefetch workers can
+    share the stream.
+    Args:
+        source:             Iterable or callable yielding arrays of shape
+                                (n,) + imageShape or imageShape.
+        imageShape:         Shape of a single image.
+        bufferSize (Opt):   Images held in the shuffle buffer. Defaults to
+                                None (no shuffling).
+        seed (Opt):         Seed of buffer draws. Defaults to None.
+    """
+
+    def __init__(self, source, imageShape, bufferSize=None, seed=None):
+        assert (callable(source) or hasattr(source, '__iter__')), ('source ' \
+                f'expected an iterable or callable, but found {type(source)}.')
+        assert ((bufferSize is None) or (bufferSize > 0)), ('bufferSize ' \
+                                                    'must be positive.')
+        self.source         =   source
+        self.imageShape     =   tuple(imageShape)
+        self.bufferSize     =   bufferSize
+        self.exhausted      =   False
+        self.batchesRead    =   0
+        self.imagesRead     =   0
+        self.imagesDrawn    =   0
+        self.bufferFill     =   0
+        self.buffer         =   (np.empty(((bufferSize,) + self.imageShape),
+                                        dtype='float32')
+                                if bufferSize else None)
+        self._iterator      =   (None if callable(source) else iter(source))
+        self._pending       =   np.empty(((0,) + self.imageShape),
+                                        dtype='float32')
+        self._generator     =   np.random.default_rng(seed)
+        self._lock          =   threading.Lock()
+
+    def __str__(self):
+        return (f'< StreamDataset BUFFER={self.bufferFill}/{self.bufferSize} ' \
+                f'| READ={self.imagesRead} DRAWN={self.imagesDrawn} ' \
+                f'EXHAUSTED={self.exhausted} >')
+
+    def _next_source_batch(self):
+        """ Returns the next source batch as float32, or None when done """
+        try:
+            batch = (self.source() if (self._iterator is None) else
+                    next(self._iterator))
+        except StopIteration:
+            batch = None
+        if batch is None:
+            self.exhausted = True
+            return None
+        # copied, since sources may reuse the arrays they yield while
+        # images of the last one are still pending
+        batch = np.array(batch, dtype='float32')
+        if (batch.shape == self.imageShape):
+            batch = batch[np.newaxis]
+        if not self.batchesRead:
+            assert (batch.shape[1:] == self.imageShape), ('Stream expected ' \
+                f'batches of images of shape {self.imageShape}, but found ' \
+                f'shape {batch.shape}.')
+        self.batchesRead += 1
+        self.imagesRead += len(batch)
+        return batch
+
+    def _read(self, n):
+        """ Returns the next n images of the source, fewer only when done """
+        parts, count = [], 0
+        while (count < n):
+            if not len(self._pending):
+                batch = None if self.exhausted else self._next_source_batch()
+                if batch is None:
+                    break
+                self._pending = batch
+            part = self._pending[:(n - count)]
+            self._pending = self._pending[len(part):]
+            parts.append(part)
+            count += len(part)
+        if (len(parts) == 1):
+            return parts[0]
+        return (np.concatenate(parts) if parts else self._pending[:0])
+
+    def sample(self, batchSize, out=None):
+        """
+        Returns the next batch of batchSize images.
+        Args:
+            batchSize:      Number of images.
+            out (Opt):      float32 array of shape (batchSize,) + imageShape
+                                to write into. Defaults to None (allocated).
+        Returns:
+            Array of images.
+        """
+        assert ((self.buffer is None) or (batchSize <= self.bufferSize)), \
+            (f'bufferSize {self.bufferSize} is smaller than batch {batchSize}.')
+        with self._lock:
+            if self.buffer is None:
+                incoming = self._read(batchSize)
+                if (len(incoming) < batchSize):
+                    raise StreamExhausted(f'Stream ran out after ' \
+                                        f'{self.imagesRead} images.')
+                batch = incoming
+            else:
+                # arrivals fill free slots first, then replace drawn ones
+                freeNum = self.bufferSize - self.bufferFill
+                incoming = self._read(freeNum + batchSize)
+                freeNum = min(len(incoming), freeNum)
+                self.buffer[self.bufferFill:(self.bufferFill + freeNum)] = \
+                                                        incoming[:freeNum]
+                self.bufferFill += freeNum
+                incoming = incoming[freeNum:]
+                if (self.bufferFill < batchSize):
+                    raise StreamExhausted(f'Stream ran out after ' \
+                                        f'{self.imagesRead} images.')
+                drawIndex = self._generator.choice(self.bufferFill,
+                                                size=batchSize, replace=False)
+                batch = self.buffer[drawIndex]
+                self.buffer[drawIndex[:len(incoming)]] = incoming
+                emptied = drawIndex[len(incoming):]
+                if len(emptied):
+                    # source is done: close drawn slots so none is reused
+                    kept = np.ones(self.bufferFill, dtype=bool)
+                    kept[emptied] = False
+                    kept = np.flatnonzero(kept)
+                    self.buffer[:len(kept)] = self.buffer[kept]
+                    self.bufferFill = len(kept)
+            self.imagesDrawn += batchSize
+        if out is None:
+            return batch
+        np.copyto(out, batch)
+        return out
@@ -0,0 +1,298 @@
+"""
+Implements inference-only export of DC_GAN generators: batch normalization is
+folded into the preceding dense and transpose convolution weights, dropout is
+stripped, and activations are fused into the layers they follow. Weights can
+optionally be stored quantized to float16 or per-channel int8.
+
+    python export.py GENERATOR_H5 OUT_NPZ [--quantize float16|int8] [--check]
+"""
+
+
+import json
+import time
+import argparse
+import numpy as np
+
+
+EXPORT_FORMAT   =   1
+QUANTIZE_MODES  =   (None, 'float16', 'int8')
+# max abs difference from generatorStructure.predict allowed per mode
+TOLERANCES      =   {None : 1e-4, 'float16' : 1e-2, 'int8' : 5e-2}
+FOLDABLE        =   ('Dense', 'Conv2DTranspose')
+
+
+def fold_batch_norm(kernel, bias, normWeights, epsilon, outAxis):
+    """
+    Folds inference-mode batch normalization into the kernel and bias of the
+    layer it follows.
+    Args:
+        kernel:             Kernel of the layer.
+        bias:               Bias of the layer, or None.
+        normWeights:        [gamma, beta, movingMean, movingVariance].
+        epsilon:            Epsilon of the batch normalization layer.
+        outAxis:            Axis of kernel indexing output channels.
+    Returns:
+        Tuple of form (kernel, bias) computing both layers in one.
+    """
+    gamma, beta, movingMean, movingVariance = normWeights
+    scale = gamma / np.sqrt(movingVariance + epsilon)
+    scaleShape = [1] * kernel.ndim
+    scaleShape[outAxis] = -1
+    bias = np.zeros_like(movingMean) if (bias is None) else bias
+    return ((kernel * scale.reshape(scaleShape)).astype('float32'),
+            (((bias - movingMean) * scale) + beta).astype('float32'))
+
+
+def _norm_weights(normLayer):
+    """ Returns [gamma, beta, mean, variance], filling disabled terms """
+    config = normLayer.get_config()
+    weights = list(normLayer.get_weights())
+    channelNum = weights[-1].shape[0]
+    gamma = weights.pop(0) if config['scale'] else np.ones(channelNum)
+    beta = weights.pop(0) if config['center'] else np.zeros(channelNum)
+    return [gamma, beta] + weights
+
+
+def _fusible_activation(layer):
+    """ Returns activation name that layer applies, if it can be fused """
+    config = layer.get_config()
+    className = layer.__class__.__name__
+    if (className == 'Activation'):
+        return config['activation']
+    if (className == 'ReLU') and not config.get('max_value') and \
+        not config.get('negative_slope') and not config.get('threshold'):
+        return 'relu'
+    return None
+
+
+def fold_generator(generator):
+    """
+    Walks the layers of a chain generator, producing the specs and weights of
+    its inference-only equivalent.
+    Args:
+        generator:          Generator structure (keras Model).
+    Returns:
+        Tuple of form (layerSpecs, layerWeights): specs are dicts of form
+        {'className', 'config'} accepted by keras.layers.deserialize() and
+        layerWeights the list of weights of each.
+    """
+    layers = [layer for layer in generator.layers
+                if (layer.__class__.__name__ != 'InputLayer')]
+    layerSpecs, layerWeights = [], []
+    i = 0
+    while (i < len(layers)):
+        layer = layers[i]
+        className = layer.__class__.__name__
+        config = layer.get_config()
+        # inputs come from the preceding layer of the exported chain
+        config.pop('batch_input_shape', None)
+        config.pop('input_dim', None)
+        weights = layer.get_weights()
+        i += 1
+        if (className == 'Dropout'):
+            continue
+        if (className in FOLDABLE) and (config['activation'] == 'linear'):
+            nextLayer = layers[i] if (i < len(layers)) else None
+            if (nextLayer is not None) and \
+                (nextLayer.__class__.__name__ == 'BatchNormalization') and \
+                (nextLayer.get_config()['axis'] in (-1, [-1],
+                                                len(layer.output_shape) - 1,
+                                                [len(layer.output_shape) - 1])):
+                kernel = weights[0]
+                bias = weights[1] if config['use_bias'] else None
+                # transpose convolution kernels are (h, w, out, in)
+                outAxis = -1 if (className == 'Dense') else -2
+                weights = list(fold_batch_norm(kernel, bias,
+                                            _norm_weights(nextLayer),
+                                            nextLayer.get_config()['epsilon'],
+                                            outAxis))
+                config['use_bias'] = True
+                i += 1
+            # skip past dropout to fuse the activation that follows
+            while (i < len(layers)) and \
+                (layers[i].__class__.__name__ == 'Dropout'):
+                i += 1
+            if (i < len(layers)):
+                activation = _fusible_activation(layers[i])
+                if activation:
+                    config['activation'] = activation
+                    i += 1
+        layerSpecs.append({'className' : className, 'config' : config})
+        layerWeights.append([np.asarray(weight) for weight in weights])
+    return layerSpecs, layerWeights
+
+
+def quantize_weight(weight, mode, outAxis=-1):
+    """
+    Quantizes one weight array.
+    Args:
+        weight:             float32 array.
+        mode:               None, 'float16' or 'int8' (symmetric, with one
+                                scale per slice along outAxis).
+        outAxis (Opt):      Axis of output channels. Defaults to -1.
+    Returns:
+        List of arrays to store: [weight] or, for int8, [values, scales].
+    """
+    if (mode is None):
+        return [weight.astype('float32')]
+    if (mode == 'float16'):
+        return [weight.astype('float16')]
+    reduceAxes = tuple(axis for axis in range(weight.ndim)
+                        if (axis != (outAxis % weight.ndim)))
+    scales = (np.max(np.abs(weight), axis=reduceAxes, keepdims=True) / 127.0)
+    scales = np.where((scales > 0), scales, 1.0).astype('float32')
+    values = np.clip(np.rint(weight / scales), -127, 127).astype('int8')
+    return [values, scales]
+
+
+def dequantize_weight(parts):
+    """ Inverse of quantize_weight(), returning a float32 array """
+    if (len(parts) == 2):
+        return (parts[0].astype('float32') * parts[1])
+    return parts[0].astype('float32')
+
+
+def export_generator(generator, outPath, quantize=None):
+    """
+    Folds generator and writes it to outPath as an .npz file.
+    Only kernels are quantized; biases stay float32.
+    Args:
+        generator:          Generator structure (keras Model).
+        outPath:            Path of .npz file to write.
+        quantize (Opt):     None, 'float16' or 'int8'. Defaults to None.
+    Returns:
+        outPath.
+    """
+    assert (quantize in QUANTIZE_MODES), (f'quantize expected one of ' \
+                                    f'{QUANTIZE_MODES}, but found {quantize}.')
+    layerSpecs, layerWeights = fold_generator(generator)
+    arrays = {}
+    for i, (spec, weights) in enumerate(zip(layerSpecs, layerWeights)):
+        outAxis = -2 if (spec['className'] == 'Conv2DTranspose') else -1
+        spec['weightParts'] = []
+        for j, weight in enumerate(weights):
+            # only kernels (first weight of a layer) are quantized
+            parts = quantize_weight(weight, (quantize if (j == 0) and \
+                                    (weight.ndim > 1) else None), outAxis)
+            for k, part in enumerate(parts):
+                arrays[f'{i:04d}/{j}/{k}'] = part
+            spec['weightParts'].append(len(parts))
+    meta = {'format' : EXPORT_FORMAT, 'quantize' : quantize,
+            'inputShape' : list(generator.input_shape[1:]),
+            'outputShape' : list(generator.output_shape[1:]),
+            'layers' : layerSpecs}
+    with open(outPath, 'wb') as exportFile:
+        np.savez(exportFile, __meta__=np.array(json.dumps(meta)), **arrays)
+    return outPath
+
+
+def read_export(path):
+    """
+    Reads a file written by export_generator().
+    Returns:
+        Tuple of form (meta, layerWeights) with float32 weights.
+    """
+    with np.load(path, allow_pickle=False) as exportFile:
+        meta = json.loads(str(exportFile['__meta__']))
+        assert (meta['format'] == EXPORT_FORMAT), ('Unsupported export ' \
+                                                f'format {meta["format"]}.')
+        layerWeights = [[dequantize_weight([exportFile[f'{i:04d}/{j}/{k}']
+                                            for k in range(partNum)])
+                        for j, partNum in enumerate(spec['weightParts'])]
+                        for i, spec in enumerate(meta['layers'])]
+    return meta, layerWeights
+
+
+def build_inference_generator(meta, layerWeights):
+    """ Builds a keras Sequential generator from read_export() output """
+    from keras.models import Sequential
+    from keras.layers import InputLayer, deserialize
+    model = Sequential()
+    model.add(InputLayer(input_shape=tuple(meta['inputShape'])))
+    for spec, weights in zip(meta['layers'], layerWeights):
+        layer = deserialize({'class_name' : spec['className'],
+                            'config' : spec['config']})
+        model.add(layer)
+        if weights:
+            layer.set_weights(weights)
+    return model
+
+
+def load_inference_generator(path):
+    """ Loads an exported generator as a keras model """
+    return build_inference_generator(*read_export(path))
+
+
+def check_equivalence(generator, inferenceGenerator, n=256, tolerance=1e-4,
+                    seed=0):
+    """
+    Compares outputs of generator and its export on n uniform latent vectors.
+    Returns:
+        Tuple of form (maxAbsError, passed).
+    """
+    noise = np.random.RandomState(seed).uniform(-1.0, 1.0,
+                                    size=((n,) + generator.input_shape[1:]))
+    reference = generator.predict(noise)
+    exported = inferenceGenerator.predict(noise)
+    maxError = float(np.max(np.abs(reference - exported)))
+    return maxError, (maxError <= tolerance)
+
+
+def compare_latency(generator, inferenceGenerator, batchSizes=(1, 64, 256),
+                    repeats=20):
+    """
+    Times predict() of generator and its export at each batch size.
+    Returns:
+        Dict of batch size to (originalSeconds, exportedSeconds) medians.
+    """
+    results = {}
+    for batchSize in batchSizes:
+        noise = np.random.uniform(-1.0, 1.0,
+                            size=((batchSize,) + generator.input_shape[1:]))
+        modelTimes = []
+        for model in (generator, inferenceGenerator):
+            model.predict(noise)
+            callTimes = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                model.predict(noise)
+                callTimes.append(time.perf_counter() - start)
+            modelTimes.append(float(np.median(callTimes)))
+        results[batchSize] = tuple(modelTimes)
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=('Export an inference-only ' \
+                                                    'DC_GAN generator'))
+    parser.add_argument('generator', help='Generator .h5 saved by DC_GAN.')
+    parser.add_argument('out', help='Path of .npz file to write.')
+    parser.add_argument('--quantize', choices=['float16', 'int8'],
+                        help='Store kernels quantized.')
+    parser.add_argument('--check', action='store_true',
+                        help='Check equivalence and compare latency.')
+    args = parser.parse_args(args)
+    from keras.models import load_model
+    generator = load_model(args.generator, compile=False)
+    export_generator(generator, args.out, quantize=args.quantize)
+    print(f'Exported {args.generator} to {args.out}.')
+    if args.check:
+        inferenceGenerator = load_inference_generator(args.out)
+        tolerance = TOLERANCES[args.quantize]
+        maxError, passed = check_equivalence(generator, inferenceGenerator,
+                                            tolerance=tolerance)
+        print(f'Max abs error: {maxError:.3g} ' \
+            f'({"ok" if passed else "FAILED"} at tolerance {tolerance})')
+        for batchSize, (originalTime, exportedTime) in \
+            compare_latency(generator, inferenceGenerator).items():
+            print(f'batch {batchSize:>4}: predict {1000 * originalTime:.2f}ms' \
+                f' -> export {1000 * exportedTime:.2f}ms ' \
+                f'({(originalTime / exportedTime):.2f}x)')
+        if not passed:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""
+Implements fused training steps for DC_GAN: the discriminator and adversarial
+updates are built into a single graph so that generated images never leave
+the backend and each step is one dispatch from Python.
+"""
+
+
+from inspect import signature
+from contextlib import contextmanager
+import numpy as np
+import tensorflow as tf
+from keras import backend as K
+from keras.layers import InputLayer
+
+
+class FusedRMSprop(object):
+    """
+    Graph-level RMSprop with its own slot variables, mirroring the update rule
+    of keras.optimizers.RMSprop. Used in place of optimizer.get_updates() so
+    that a single set of accumulators can be shared by several chained steps
+    in one graph.
+    Args:
+        optimizer:          Compiled keras RMSprop whose config to copy.
+        params:             List of weight variables to update.
+        name:               Prefix for slot variable names.
+    """
+
+    def __init__(self, optimizer, params, name):
+        config = optimizer.get_config()
+        learningRate = config.get('lr', config.get('learning_rate'))
+        self.name           =   name
+        self.params         =   params
+        self.rho            =   config['rho']
+        self.epsilon        =   config['epsilon'] or K.epsilon()
+        self.learningRate   =   K.variable(learningRate, name=f'{name}_lr')
+        self.decay          =   K.variable(config.get('decay', 0.),
+                                            name=f'{name}_decay')
+        self.initialDecay   =   config.get('decay', 0.)
+        self.iterations     =   K.variable(0, dtype='int64',
+                                            name=f'{name}_iterations')
+        self.accumulators   =   [K.zeros(K.int_shape(p), dtype=K.dtype(p),
+                                        name=f'{name}_accumulator_{i}')
+                                for i, p in enumerate(params)]
+
+    @property
+    def weights(self):
+        """ Optimizer state in the order used by get_weights/set_weights """
+        return [self.iterations] + self.accumulators
+
+    def get_weights(self):
+        return K.batch_get_value(self.weights)
+
+    def set_weights(self, values):
+        K.batch_set_value(list(zip(self.weights, values)))
+
+    def sync_from(self, optimizer):
+        """
+        Copies iteration count and accumulators from a compiled keras RMSprop
+        whose training function has been built; otherwise does nothing.
+        """
+        if (len(optimizer.weights) < len(self.params)) or not self.params:
+            return False
+        accumulators = optimizer.weights[-len(self.params):]
+        K.set_value(self.iterations, K.get_value(optimizer.iterations))
+        K.batch_set_value(list(zip(self.accumulators,
+                                    K.batch_get_value(accumulators))))
+        return True
+
+    def sync_to(self, optimizer):
+        """ Copies iteration count and accumulators to a keras RMSprop """
+        if (len(optimizer.weights) < len(self.params)) or not self.params:
+            return False
+        accumulators = optimizer.weights[-len(self.params):]
+        K.set_value(optimizer.iterations, K.get_value(self.iterations))
+        K.batch_set_value(list(zip(accumulators,
+                                    K.batch_get_value(self.accumulators))))
+        return True
+
+    def get_updates(self, loss):
+        """ Returns list of update ops applying one RMSprop step on loss """
+        return self.apply_gradients(K.gradients(loss, self.params))
+
+    def apply_gradients(self, grads):
+        """
+        Returns list of update ops applying one RMSprop step with grads, a
+        list of tensors matching self.params.
+        """
+        # state is read with read_value() so that reads take the control
+        # dependencies active where the updates are built, and params are
+        # stepped with assign_sub so they are never read here at all
+        learningRate = self.learningRate
+        if self.initialDecay > 0:
+            learningRate = learningRate * (1. / (1. + self.decay * \
+                            K.cast(self.iterations.read_value(),
+                                    K.dtype(self.decay))))
+        updates = [K.update_add(self.iterations, 1)]
+        for param, grad, accumulator in zip(self.params, grads,
+                                            self.accumulators):
+            newAccumulator = ((self.rho * accumulator.read_value()) + \
+                                ((1. - self.rho) * K.square(grad)))
+            updates.append(K.update(accumulator, newAccumulator))
+            updates.append(K.update_sub(param, (learningRate * grad / \
+                                (K.sqrt(newAccumulator) + self.epsilon))))
+        return updates
+
+
+def binary_metrics(preds, targets):
+    """ Returns mean binary crossentropy and accuracy of preds vs targets """
+    loss = K.mean(K.binary_crossentropy(targets, preds))
+    acc = K.mean(K.cast(K.equal(targets, K.round(preds)), K.floatx()))
+    return loss, acc
+
+
+def call_in_phase(model, inputs, training):
+    """
+    Calls a single-input, single-output chain model layer by layer, forcing
+    the training flag of every layer that accepts one (dropout, batch norm).
+    Lets one graph mix inference-mode and training-mode passes of the same
+    weights, which the global learning phase cannot.
+    """
+    outputs = inputs
+    for layer in model.layers:
+        if isinstance(layer, InputLayer):
+            continue
+        if 'training' in signature(layer.call).parameters:
+            outputs = layer(outputs, training=training)
+        else:
+            outputs = layer(outputs)
+    return outputs
+
+
+def _flat_layers(model):
+    """ Yields layers of model, descending into nested models """
+    for layer in model.layers:
+        if hasattr(layer, 'layers'):
+            yield from _flat_layers(layer)
+        else:
+            yield layer
+
+
+@contextmanager
+def reading_weights(models, skipStats=False):
+    """
+    Within the block, layers of models read their weights through
+    read_value() ops created on entry, so every read carries the control
+    dependencies active there. Layers otherwise read the snapshot a TF1
+    variable makes when it is created, which may be scheduled before or after
+    updates the step should follow.
+    Args:
+        models:             Models whose layer weights to read.
+        skipStats (Opt):    Whether to leave batch norm moving statistics as
+                                variables, as training passes assign to them.
+                                Defaults to False.
+    Yields:
+        Dict mapping id() of each variable to its read tensor.
+    """
+    reads, swapped = {}, []
+    for model in models:
+        for layer in _flat_layers(model):
+            for attr, value in list(vars(layer).items()):
+                if not isinstance(value, tf.Variable):
+                    continue
+                if skipStats and (attr in ('moving_mean', 'moving_variance')):
+                    continue
+                if id(value) not in reads:
+                    reads[id(value)] = value.read_value()
+                swapped.append((layer, attr, value))
+                setattr(layer, attr, reads[id(value)])
+    try:
+        yield reads
+    finally:
+        for layer, attr, value in swapped:
+            setattr(layer, attr, value)
+
+
+def build_step_graph(generator, discriminator, disOptimizer, advOptimizer,
+                    validExamples, disNoise, advNoise, dependencies=None):
+    """
+    Builds the ops of one fused training step on the given input tensors.
+    The discriminator is updated on validExamples and generator images of
+    disNoise; the adversarial update on advNoise is sequenced after the
+    discriminator update, matching the order of the train_on_batch loop. Each
+    pass reads weights through reading_weights() under control dependencies
+    on the updates it follows, and gradients are taken against those reads.
+    As with generate_images(), fakes for the discriminator update come from
+    the generator in inference mode.
+    Args:
+        generator:          Generator structure.
+        discriminator:      Discriminator structure.
+        disOptimizer:       FusedRMSprop over discriminator weights.
+        advOptimizer:       FusedRMSprop over adversarial weights.
+        validExamples:      Tensor of real images.
+        disNoise:           Tensor of noise for discriminator fakes.
+        advNoise:           Tensor of noise for the adversarial update.
+        dependencies (Opt): Ops that must run before this step, used to chain
+                                steps. Defaults to None.
+    Returns:
+        Tuple of form (metrics, updates) where metrics is the list
+        [disLoss, disAcc, advLoss, advAcc] and updates all ops of the step.
+    """
+    def read_grads(loss, optimizer, reads):
+        return K.gradients(loss, [reads.get(id(param), param)
+                                    for param in optimizer.params])
+
+    # discriminator update reads weights after any previous step's updates;
+    # fake images stay in graph
+    with tf.control_dependencies(dependencies or []):
+        with reading_weights([generator]):
+            invalidExamples = K.stop_gradient(call_in_phase(generator,
+                                                disNoise, training=False))
+        with reading_weights([discriminator], skipStats=True) as disReads:
+            disFeatures = K.concatenate([validExamples, invalidExamples],
+                                        axis=0)
+            disPreds = discriminator(disFeatures)
+        validNum = K.shape(validExamples)[0]
+        disTargets = K.concatenate([tf.ones_like(disPreds[:validNum]),
+                                    tf.zeros_like(disPreds[validNum:])],
+                                    axis=0)
+        disLoss, disAcc = binary_metrics(disPreds, disTargets)
+        disUpdates = disOptimizer.apply_gradients(read_grads(disLoss,
+                                                disOptimizer, disReads))
+    # adversarial update only reads weights once discriminator has stepped
+    with tf.control_dependencies(disUpdates):
+        with reading_weights([generator, discriminator],
+                            skipStats=True) as advReads:
+            advPreds = discriminator(generator(advNoise))
+        advLoss, advAcc = binary_metrics(advPreds, tf.ones_like(advPreds))
+        advUpdates = advOptimizer.apply_gradients(read_grads(advLoss,
+                                                advOptimizer, advReads))
+    # batch norm moving statistics of the adversarial generator pass
+    normUpdates = generator.get_updates_for(advNoise)
+    return ([disLoss, disAcc, advLoss, advAcc],
+            (disUpdates + advUpdates + normUpdates))
+
+
+def build_fused_step(generator, discriminator, disOptimizer, advOptimizer,
+                    imageShape, latentDims):
+    """
+    Compiles a single-dispatch training step.
+    Args:
+        generator:          Generator structure.
+        discriminator:      Discriminator structure.
+        disOptimizer:       FusedRMSprop over discriminator weights.
+        advOptimizer:       FusedRMSprop over adversarial weights.
+        imageShape:         Shape of a single image.
+        latentDims:         Dimensions of generator latent space.
+    Returns:
+        Function of (validExamples, disNoise, advNoise) returning tuple of
+        form (disData, advData), each a [loss, acc] list as returned by
+        train_on_batch.
+    """
+    validInput = K.placeholder(shape=((None,) + tuple(imageShape)),
+                                name='fused_valid_examples')
+    disNoiseInput = K.placeholder(shape=(None, latentDims),
+                                name='fused_dis_noise')
+    advNoiseInput = K.placeholder(shape=(None, latentDims),
+                                name='fused_adv_noise')
+    metrics, updates = build_step_graph(generator, discriminator,
+                                        disOptimizer, advOptimizer,
+                                        validInput, disNoiseInput,
+                                        advNoiseInput)
+    stepFunction = K.function([validInput, disNoiseInput, advNoiseInput,
+                                K.learning_phase()], metrics, updates=updates)
+
+    def fused_step(validExamples, disNoise, advNoise):
+        """ Runs one fused discriminator and adversarial training step """
+        disLoss, disAcc, advLoss, advAcc = stepFunction([validExamples,
+                                                        disNoise, advNoise, 1])
+        return [disLoss, disAcc], [advLoss, advAcc]
+
+    return fused_step
+
+
+def build_multi_step(generator, discriminator, disOptimizer, advOptimizer,
+                    imageShape, latentDims, stepsPerCall):
+    """
+    Compiles stepsPerCall chained training steps into a single dispatch.
+    Steps are unrolled in the graph and each reads weights (and optimizer
+    state) only after all of the previous step's updates, batch norm
+    statistics included; metrics are averaged in graph.
+    Args:
+        generator:          Generator structure.
+        discriminator:      Discriminator structure.
+        disOptimizer:       FusedRMSprop over discriminator weights.
+        advOptimizer:       FusedRMSprop over adversarial weights.
+        imageShape:         Shape of a single image.
+        latentDims:         Dimensions of generator latent space.
+        stepsPerCall:       Number of steps run per call.
+    Returns:
+        Function of (validBlock, disNoiseBlock, advNoiseBlock), each stacking
+        stepsPerCall batches along a new first axis, returning tuple of form
+        (disData, advData, stepData) where disData and advData are [loss, acc]
+        means across the steps and stepData is an array of shape
+        (stepsPerCall, 4) of per-step [disLoss, disAcc, advLoss, advAcc].
+    """
+    validInput = K.placeholder(shape=((stepsPerCall, None) + \
+                                tuple(imageShape)), name='multi_valid_block')
+    disNoiseInput = K.placeholder(shape=(stepsPerCall, None, latentDims),
+                                name='multi_dis_noise_block')
+    advNoiseInput = K.placeholder(shape=(stepsPerCall, None, latentDims),
+                                name='multi_adv_noise_block')
+    stepMetrics, allUpdates, dependencies = [], [], None
+    for step in range(stepsPerCall):
+        metrics, updates = build_step_graph(generator, discriminator,
+                                            disOptimizer, advOptimizer,
+                                            validInput[step],
+                                            disNoiseInput[step],
+                                            advNoiseInput[step],
+                                            dependencies=dependencies)
+        stepMetrics.append(K.stack(metrics))
+        allUpdates += updates
+        dependencies = updates
+    stepMetrics = K.stack(stepMetrics)
+    meanMetrics = K.mean(stepMetrics, axis=0)
+    stepFunction = K.function([validInput, disNoiseInput, advNoiseInput,
+                                K.learning_phase()],
+                                [meanMetrics, stepMetrics],
+                                updates=allUpdates)
+
+    def multi_step(validBlock, disNoiseBlock, advNoiseBlock):
+        """ Runs stepsPerCall fused training steps """
+        meanData, stepData = stepFunction([validBlock, disNoiseBlock,
+                                            advNoiseBlock, 1])
+        return (list(meanData[:2]), list(meanData[2:]), np.asarray(stepData))
+
+    return multi_step
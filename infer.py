@@ -0,0 +1,227 @@
+"""
+Slim, fast-starting generator inference. Only numpy and the standard library
+are imported up front; generators exported by export.py run on a pure numpy
+forward pass without importing the backend at all, while Keras .h5
+generators import it lazily on load. Reports startup time broken down by
+import, model load and first inference.
+
+    python infer.py MODEL (.npz or .h5) -n 16 --out samples.png --timing
+"""
+
+
+import time
+_IMPORT_START = time.perf_counter()
+import sys
+import argparse
+import numpy as np
+from latent import seeded_latents
+_IMPORT_TIME = time.perf_counter() - _IMPORT_START
+
+
+def _sigmoid(x):
+    return (1.0 / (1.0 + np.exp(-x)))
+
+
+ACTIVATIONS = {'linear' : (lambda x : x),
+                'relu' : (lambda x : np.maximum(x, 0.0)),
+                'sigmoid' : _sigmoid,
+                'tanh' : np.tanh}
+
+
+def conv2d_transpose_same(x, kernel, bias=None):
+    """
+    Stride 1, 'same' padded transpose convolution of x by a keras
+    Conv2DTranspose kernel of shape (rows, cols, outChannels, inChannels),
+    accumulated as one matrix product per kernel offset.
+    """
+    kernelRows, kernelCols, outChannels, _ = kernel.shape
+    imageNum, rowNum, columnNum, channelNum = x.shape
+    padRows, padCols = (kernelRows - 1 - ((kernelRows - 1) // 2),
+                        kernelCols - 1 - ((kernelCols - 1) // 2))
+    padded = np.zeros((imageNum, (rowNum + kernelRows - 1),
+                        (columnNum + kernelCols - 1), channelNum),
+                        dtype='float32')
+    padded[:, padRows:(padRows + rowNum), padCols:(padCols + columnNum)] = x
+    out = np.zeros((imageNum, rowNum, columnNum, outChannels), dtype='float32')
+    for row in range(kernelRows):
+        rowStart = kernelRows - 1 - row
+        for col in range(kernelCols):
+            colStart = kernelCols - 1 - col
+            window = padded[:, rowStart:(rowStart + rowNum),
+                            colStart:(colStart + columnNum)]
+            out += np.dot(window, kernel[row, col].T)
+    if bias is not None:
+        out += bias
+    return out
+
+
+def relu(x, maxValue=None, negativeSlope=0.0, threshold=0.0):
+    """
+    Keras ReLU layer: x from threshold up to maxValue, clipped at maxValue
+    and negativeSlope * (x - threshold) below threshold.
+    """
+    out = np.where((x >= threshold), x, (negativeSlope * (x - threshold)))
+    if maxValue is not None:
+        out = np.minimum(out, maxValue)
+    return out
+
+
+class NumpyGenerator(object):
+    """
+    Runs a generator exported by export.py with numpy alone. Supports the
+    layers export leaves in the DC_GAN generator: Dense, stride 1 'same'
+    Conv2DTranspose, Reshape, UpSampling2D, unfolded BatchNormalization and
+    activations.
+    Args:
+        meta:               Export metadata from export.read_export().
+        layerWeights:       float32 weights of each exported layer.
+    """
+
+    def __init__(self, meta, layerWeights):
+        self.inputShape     =   tuple(meta['inputShape'])
+        self.outputShape    =   tuple(meta['outputShape'])
+        self.layers         =   []
+        for spec, weights in zip(meta['layers'], layerWeights):
+            self.layers.append(self._build_layer(spec['className'],
+                                                spec['config'], weights))
+
+    def __str__(self):
+        return (f'< NumpyGenerator INPUT={self.inputShape} ' \
+                f'OUTPUT={self.outputShape} LAYERS={len(self.layers)} >')
+
+    @staticmethod
+    def _build_layer(className, config, weights):
+        """ Returns a function applying one layer to a batch """
+        activation = ACTIVATIONS[config.get('activation', 'linear')]
+        if (className == 'Dense'):
+            kernel = weights[0]
+            bias = weights[1] if config['use_bias'] else 0.0
+            return lambda x : activation(np.dot(x, kernel) + bias)
+        if (className == 'Conv2DTranspose'):
+            assert (tuple(config['strides']) == (1, 1)) and \
+                (config['padding'] == 'same'), ('NumpyGenerator supports ' \
+                'only stride 1, same padded transpose convolutions.')
+            kernel = weights[0]
+            bias = weights[1] if config['use_bias'] else None
+            return lambda x : activation(conv2d_transpose_same(x, kernel,
+                                                                bias))
+        if (className == 'Reshape'):
+            targetShape = tuple(config['target_shape'])
+            return lambda x : x.reshape(((len(x),) + targetShape))
+        if (className == 'UpSampling2D'):
+            assert (config.get('interpolation', 'nearest') == 'nearest'), \
+                'NumpyGenerator supports only nearest upsampling.'
+            rowSize, colSize = config['size']
+            return lambda x : np.repeat(np.repeat(x, rowSize, axis=1),
+                                        colSize, axis=2)
+        if (className == 'BatchNormalization'):
+            assert (len(weights) == 4), ('NumpyGenerator expected batch ' \
+                                'normalization with center and scale.')
+            gamma, beta, movingMean, movingVariance = weights
+            scale = gamma / np.sqrt(movingVariance + config['epsilon'])
+            shift = beta - (movingMean * scale)
+            return lambda x : ((x * scale) + shift)
+        if (className == 'ReLU'):
+            maxValue = config.get('max_value')
+            negativeSlope = float(config.get('negative_slope', 0.0))
+            threshold = float(config.get('threshold', 0.0))
+            if (maxValue is None) and not (negativeSlope or threshold):
+                return ACTIVATIONS['relu']
+            return lambda x : relu(x, maxValue, negativeSlope, threshold)
+        if (className == 'Activation'):
+            return activation
+        if (className == 'Dropout'):
+            return lambda x : x
+        raise ValueError(f'NumpyGenerator does not support {className}.')
+
+    def predict(self, latents, batch_size=64):
+        """ Returns float32 images generated from latents in batches """
+        latents = np.asarray(latents, dtype='float32')
+        images = np.empty(((len(latents),) + self.outputShape),
+                            dtype='float32')
+        for start in range(0, len(latents), batch_size):
+            outputs = latents[start:(start + batch_size)]
+            for layer in self.layers:
+                outputs = layer(outputs)
+            images[start:(start + batch_size)] = outputs
+        return images
+
+
+def load_generator(path, timings=None):
+    """
+    Loads a generator for inference: .npz files written by export.py run on
+    NumpyGenerator, anything else is loaded as a Keras model.
+    Args:
+        path:               Path of exported .npz or generator .h5.
+        timings (Opt):      Dict to which 'import' and 'load' seconds are
+                                added. Defaults to None.
+    Returns:
+        Object with a predict(latents) method.
+    """
+    timings = {} if (timings is None) else timings
+    start = time.perf_counter()
+    if path.endswith('.npz'):
+        from export import read_export
+        timings['import'] = timings.get('import', 0.0) + \
+                            (time.perf_counter() - start)
+        start = time.perf_counter()
+        generator = NumpyGenerator(*read_export(path))
+    else:
+        from keras.models import load_model
+        timings['import'] = timings.get('import', 0.0) + \
+                            (time.perf_counter() - start)
+        start = time.perf_counter()
+        generator = load_model(path, compile=False)
+    timings['load'] = timings.get('load', 0.0) + (time.perf_counter() - start)
+    return generator
+
+
+def latent_dims(generator):
+    """ Returns latent dimensions of a loaded generator """
+    inputShape = getattr(generator, 'inputShape', None)
+    if inputShape is None:
+        inputShape = generator.input_shape[1:]
+    return int(inputShape[-1])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=('Generate images from a ' \
+                                                'saved DC_GAN generator'))
+    parser.add_argument('model', help='Exported .npz or generator .h5.')
+    parser.add_argument('-n', type=int, default=16,
+                        help='Number of images. Defaults to 16.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='First latent seed; image i uses seed + i.')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--out', default='samples.png',
+                        help='Output .png mosaic or .npy array.')
+    parser.add_argument('--timing', action='store_true',
+                        help='Report startup time breakdown.')
+    args = parser.parse_args(args)
+    timings = {'import' : _IMPORT_TIME}
+    generator = load_generator(args.model, timings=timings)
+    seeds = np.arange(args.seed, (args.seed + args.n))
+    latents = seeded_latents(seeds, latent_dims(generator))
+    start = time.perf_counter()
+    firstImages = generator.predict(latents[:1])
+    timings['firstInference'] = time.perf_counter() - start
+    images = (np.concatenate([firstImages,
+                            generator.predict(latents[1:],
+                                            batch_size=args.batch_size)])
+            if (args.n > 1) else firstImages)
+    if args.out.endswith('.npy'):
+        np.save(args.out, images)
+    else:
+        from snapshot import write_snapshot
+        write_snapshot(images, args.out, invert=(images.shape[-1] == 1))
+    print(f'Wrote {len(images)} images to {args.out}.')
+    if args.timing:
+        startupTime = sum(timings.values())
+        print(f'Startup: {1000 * startupTime:.1f}ms | ' + ' '.join(
+            f'{name}={1000 * seconds:.1f}ms' for name, seconds in
+            timings.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Implements lightweight per-phase timing of DC_GAN training steps, with
+throughput and step-time percentiles, optional per-phase resident memory
+deltas, user callbacks, and JSON lines or CSV export
+"""
+
+
+import csv
+import json
+import time
+from contextlib import contextmanager
+import numpy as np
+from memory import current_rss, format_bytes
+
+
+class StepRecorder(object):
+    """
+    Writes step records to a JSON lines (.jsonl/.json) or CSV (.csv) file.
+    Missing or non-finite metrics (such as 'fid' before it is first scored)
+    are written as null in JSON and left empty in CSV. When a record brings
+    columns the CSV header lacks, such as a phase that first runs at a save
+    step, the file is rewritten once with the extended header.
+    Args:
+        path:               Path of the file to write.
+    """
+
+    def __init__(self, path):
+        self.path       =   path
+        self.isCsv      =   path.endswith('.csv')
+        self.fields     =   []
+        self._file      =   open(path, 'w', newline='')
+        self._writer    =   None
+
+    @staticmethod
+    def _clean(record):
+        """ Returns record with NaN and infinite floats replaced by None """
+        return {name : (None if (isinstance(value, float) and
+                                not np.isfinite(value)) else value)
+                for name, value in record.items()}
+
+    def _extend_header(self, newFields):
+        """ Rewrites the CSV written so far under a header with newFields """
+        self._file.close()
+        with open(self.path, newline='') as csvFile:
+            rows = list(csv.DictReader(csvFile))
+        self.fields += newFields
+        self._file = open(self.path, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fields)
+        self._writer.writeheader()
+        self._writer.writerows(rows)
+
+    def write(self, record):
+        """ Appends one record """
+        record = self._clean(record)
+        if self.isCsv:
+            newFields = [name for name in record if (name not in self.fields)]
+            if newFields:
+                self._extend_header(newFields)
+            self._writer.writerow(record)
+        else:
+            self._file.write(json.dumps(record, allow_nan=False) + '\n')
+
+    def close(self):
+        self._file.close()
+        return True
+
+
+class PhaseTimer(object):
+    """
+    Accumulates wall time of named phases within each training step. At the
+    end of every step a flat record of form {'step', 'stepTime',
+    'imagesPerSec', 'time_<phase>'..., plus any metrics} is kept, passed to
+    each callback and exported if a path was given.
+    Args:
+        outPath (Opt):      Path of .jsonl or .csv file to export records
+                                to. Defaults to None (no export).
+        callbacks (Opt):    List of functions called with each record.
+                                Defaults to None.
+        trackMemory (Opt):  Whether to also record resident memory at the
+                                end of each step ('rss') and its change over
+                                each phase ('rssDelta_<phase>'). Defaults to
+                                False.
+    """
+
+    def __init__(self, outPath=None, callbacks=None, trackMemory=False):
+        self.callbacks      =   list(callbacks or [])
+        self.recorder       =   StepRecorder(outPath) if outPath else None
+        self.stepTimes      =   []
+        self.imageNum       =   0
+        self.phaseTotals    =   {}
+        self._stepPhases    =   {}
+        self._stepStart     =   time.perf_counter()
+        self.trackMemory    =   trackMemory
+        self.memoryTotals   =   {}
+        self.peakRss        =   current_rss() if trackMemory else 0
+        self._stepMemory    =   {}
+
+    def __str__(self):
+        return f'< PhaseTimer STEPS={len(self.stepTimes)} >'
+
+    @contextmanager
+    def phase(self, name):
+        """ Context manager adding the wall time of its body to phase name """
+        start = time.perf_counter()
+        startRss = current_rss() if self.trackMemory else 0
+        try:
+            yield
+        finally:
+            self._stepPhases[name] = (self._stepPhases.get(name, 0.0) + \
+                                    (time.perf_counter() - start))
+            if self.trackMemory:
+                self._stepMemory[name] = (self._stepMemory.get(name, 0) + \
+                                        (current_rss() - startRss))
+
+    def elapsed(self):
+        """ Returns seconds since the current step started """
+        return (time.perf_counter() - self._stepStart)
+
+    def start_step(self):
+        """ Marks the start of a step, discarding time outside steps """
+        self._stepPhases = {}
+        self._stepMemory = {}
+        self._stepStart = time.perf_counter()
+
+    def end_step(self, step, imageNum, **metrics):
+        """
+        Closes the current step.
+        Args:
+            step:           Step label (int or str for blocks of steps).
+            imageNum:       Real training images consumed during the step.
+            **metrics:      Extra values, such as losses, to record.
+        Returns:
+            Record of the step.
+        """
+        stepTime = time.perf_counter() - self._stepStart
+        self.stepTimes.append(stepTime)
+        self.imageNum += imageNum
+        record = {'step' : step, 'stepTime' : stepTime,
+                'imagesPerSec' : (imageNum / stepTime) if stepTime else 0.0}
+        for name, phaseTime in self._stepPhases.items():
+            record[f'time_{name}'] = phaseTime
+            self.phaseTotals[name] = self.phaseTotals.get(name, 0.0) + phaseTime
+        if self.trackMemory:
+            record['rss'] = current_rss()
+            self.peakRss = max(self.peakRss, record['rss'])
+            for name, rssDelta in self._stepMemory.items():
+                record[f'rssDelta_{name}'] = rssDelta
+                self.memoryTotals[name] = (self.memoryTotals.get(name, 0) + \
+                                            rssDelta)
+        record.update({name : float(value) for name, value in metrics.items()})
+        for callback in self.callbacks:
+            callback(record)
+        if self.recorder:
+            self.recorder.write(record)
+        self.start_step()
+        return record
+
+    def summary(self):
+        """
+        Returns dict of step-time percentiles, overall images/sec and the
+        fraction of step time spent in each phase.
+        """
+        if not self.stepTimes:
+            return {}
+        stepTimes = np.array(self.stepTimes)
+        totalTime = stepTimes.sum()
+        summary = {'steps' : len(stepTimes),
+                    'imagesPerSec' : (self.imageNum / totalTime),
+                    'stepTimeP50' : float(np.percentile(stepTimes, 50)),
+                    'stepTimeP90' : float(np.percentile(stepTimes, 90)),
+                    'stepTimeP99' : float(np.percentile(stepTimes, 99))}
+        for name, phaseTime in self.phaseTotals.items():
+            summary[f'fraction_{name}'] = phaseTime / totalTime
+        if self.trackMemory:
+            summary['peakRss'] = self.peakRss
+            for name, rssDelta in self.memoryTotals.items():
+                summary[f'rssDelta_{name}'] = rssDelta
+        return summary
+
+    def summary_report(self):
+        """ Returns a one-line summary of step timing """
+        summary = self.summary()
+        if not summary:
+            return 'no steps recorded'
+        phases = ' '.join((f'{name}=' \
+                        f'{round(100 * summary[f"fraction_{name}"], 1)}%')
+                        for name in self.phaseTotals)
+        report = (f'{round(summary["imagesPerSec"], 1)} images/sec | step ' \
+                f'p50 {round(1000 * summary["stepTimeP50"], 2)}ms p90 ' \
+                f'{round(1000 * summary["stepTimeP90"], 2)}ms p99 ' \
+                f'{round(1000 * summary["stepTimeP99"], 2)}ms | {phases}')
+        if self.trackMemory:
+            report += (f' | peak rss {format_bytes(self.peakRss)} growth ' + \
+                        ' '.join(f'{name}={format_bytes(rssDelta)}' for
+                                name, rssDelta in self.memoryTotals.items()))
+        return report
+
+    def close(self):
+        if self.recorder:
+            self.recorder.close()
+        return True
@@ -0,0 +1,109 @@
+"""
+Implements construction of generator latent vectors
+"""
+
+
+import numpy as np
+
+
+def interpolation_params(n, waypointNum, start=0, stop=None):
+    """
+    Maps frames start through stop of an n-frame path evenly spaced across
+    waypointNum waypoints to the segment each frame lies on and its fraction
+    along that segment.
+    Returns:
+        Tuple of form (segmentIndex, fraction), both of length stop - start.
+    """
+    stop = n if (stop is None) else stop
+    frameIndex = np.arange(start, stop, dtype='float64')
+    pathPosition = frameIndex * ((waypointNum - 1) / max((n - 1), 1))
+    segmentIndex = np.minimum(np.floor(pathPosition).astype('int64'),
+                            (waypointNum - 2))
+    fraction = pathPosition - segmentIndex
+    return segmentIndex, fraction
+
+
+def lerp(startVecs, endVecs, fraction):
+    """ Row-wise linear interpolation between startVecs and endVecs """
+    fraction = fraction[:, None]
+    return (startVecs + (fraction * (endVecs - startVecs)))
+
+
+def slerp(startVecs, endVecs, fraction, epsilon=1e-7):
+    """
+    Row-wise spherical interpolation between startVecs and endVecs, falling
+    back to linear interpolation for (anti)parallel rows.
+    """
+    startNorm = startVecs / np.maximum(np.linalg.norm(startVecs, axis=1,
+                                                    keepdims=True), epsilon)
+    endNorm = endVecs / np.maximum(np.linalg.norm(endVecs, axis=1,
+                                                keepdims=True), epsilon)
+    omega = np.arccos(np.clip(np.sum(startNorm * endNorm, axis=1), -1.0, 1.0))
+    sinOmega = np.sin(omega)
+    parallel = (np.abs(sinOmega) < epsilon)
+    safeSin = np.where(parallel, 1.0, sinOmega)
+    startWeight = np.where(parallel, (1.0 - fraction),
+                            (np.sin((1.0 - fraction) * omega) / safeSin))
+    endWeight = np.where(parallel, fraction,
+                        (np.sin(fraction * omega) / safeSin))
+    return ((startWeight[:, None] * startVecs) + (endWeight[:, None] * endVecs))
+
+
+INTERPOLATORS = {'linear' : lerp, 'slerp' : slerp}
+
+
+def interpolation_latents(waypoints, n, method='linear', start=0, stop=None):
+    """
+    Builds latent vectors for frames start through stop of an n-frame path
+    through waypoints in one vectorized operation.
+    Args:
+        waypoints:          Array of shape (waypointNum, latentDims), with at
+                                least two waypoints.
+        n:                  Total number of frames on the path.
+        method (Opt):       'linear' or 'slerp'. Defaults to 'linear'.
+        start (Opt):        First frame to build. Defaults to 0.
+        stop (Opt):         Frame after the last to build. Defaults to n.
+    Returns:
+        float32 array of shape (stop - start, latentDims).
+    """
+    assert (method in INTERPOLATORS), (f'method expected one of ' \
+                    f'{list(INTERPOLATORS)}, but found {method}.')
+    waypoints = np.asarray(waypoints, dtype='float64')
+    assert ((waypoints.ndim == 2) and (waypoints.shape[0] >= 2)), ('waypoints ' \
+            f'expected shape (>=2, latentDims), but found {waypoints.shape}.')
+    segmentIndex, fraction = interpolation_params(n, waypoints.shape[0],
+                                                start, stop)
+    latents = INTERPOLATORS[method](waypoints[segmentIndex],
+                                    waypoints[segmentIndex + 1], fraction)
+    return latents.astype('float32')
+
+
+def _splitmix64(counters):
+    """ SplitMix64 finalizer applied elementwise to uint64 counters """
+    mixed = counters + np.uint64(0x9E3779B97F4A7C15)
+    mixed = (mixed ^ (mixed >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    mixed = (mixed ^ (mixed >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return (mixed ^ (mixed >> np.uint64(31)))
+
+
+def seeded_latents(seeds, latentDims, low=-1.0, high=1.0):
+    """
+    Builds one uniform latent vector per seed with a counter-based generator:
+    element j of the vector for seed s is a hash of counter (s, j), so any
+    seed's latent is reproduced exactly without generating the others.
+    Args:
+        seeds:              1d array of non-negative integer seeds.
+        latentDims:         Dimensions of each latent vector.
+        low (Opt):          Lower bound of uniform range. Defaults to -1.0.
+        high (Opt):         Upper bound of uniform range. Defaults to 1.0.
+    Returns:
+        float32 array of shape (len(seeds), latentDims).
+    """
+    seeds = np.asarray(seeds, dtype='uint64').reshape(-1, 1)
+    with np.errstate(over='ignore'):
+        counters = ((seeds * np.uint64(latentDims)) + \
+                    np.arange(latentDims, dtype='uint64'))
+        bits = _splitmix64(counters)
+    # top 53 bits give a uniform double in [0, 1)
+    unitUniform = (bits >> np.uint64(11)).astype('float64') * (2.0 ** -53)
+    return (low + ((high - low) * unitUniform)).astype('float32')
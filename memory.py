@@ -0,0 +1,236 @@
+"""
+Implements memory accounting for DC_GAN: parameter and optimizer-state sizes
+of each model, per-layer activation estimates for a batch size, a training
+footprint estimate checked against a budget, and a background sampler of
+resident memory during training
+
+    python memory.py --batch-size 200 --gen-depth 256 --budget 4
+"""
+
+
+import os
+import sys
+import argparse
+import threading
+import warnings
+import numpy as np
+
+
+class MemoryBudgetWarning(UserWarning):
+    """ Warning that a configuration is estimated to exceed its budget """
+    pass
+
+
+def current_rss():
+    """ Returns resident set size of this process in bytes (Linux only) """
+    with open('/proc/self/statm') as statmFile:
+        residentPages = int(statmFile.read().split()[1])
+    return (residentPages * os.sysconf('SC_PAGE_SIZE'))
+
+
+def format_bytes(byteNum):
+    """ Returns byteNum in human readable units """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if (abs(byteNum) < 1024) or (unit == 'GB'):
+            return f'{byteNum:.1f}{unit}' if (unit != 'B') else f'{byteNum}B'
+        byteNum /= 1024
+
+
+def weights_bytes(weights):
+    """ Returns total bytes of a list of backend variables """
+    from keras import backend as K
+    return int(sum((K.count_params(weight) * \
+                    np.dtype(K.dtype(weight)).itemsize) for weight in weights))
+
+
+def model_memory(gan):
+    """
+    Returns parameter and optimizer-state bytes of each model. The
+    adversarial model stacks the generator and discriminator, so its weights
+    are shared and only its optimizer state is counted separately. RMSprop
+    keeps one accumulator per trainable weight, estimated from the weights
+    when the optimizer has not built its slots yet.
+    Returns:
+        Dict of form {modelName : {'params', 'trainable', 'optimizer'}} plus
+        'total' bytes.
+    """
+    def optimizer_bytes(compiledModel, trainableBytes):
+        if compiledModel is None:
+            return 0
+        if compiledModel.optimizer.weights:
+            return weights_bytes(compiledModel.optimizer.weights)
+        return trainableBytes
+
+    report = {}
+    for modelName, structure, compiledModel in (
+            ('discriminator', gan.discriminatorStructure,
+                gan.discriminatorCompiled),
+            ('generator', gan.generatorStructure, None),
+            ('adversarial', gan.adversarialCompiled, gan.adversarialCompiled)):
+        if structure is None:
+            continue
+        trainableBytes = weights_bytes(structure.trainable_weights)
+        report[modelName] = {'params' : weights_bytes(structure.weights),
+                            'trainable' : trainableBytes,
+                            'optimizer' : optimizer_bytes(compiledModel,
+                                                            trainableBytes)}
+    report['total'] = sum((report[name]['params'] if (name != 'adversarial')
+                            else 0) + report[name]['optimizer']
+                            for name in report)
+    return report
+
+
+def _flat_layers(model):
+    """ Yields layers of model, descending into nested models """
+    for layer in model.layers:
+        if hasattr(layer, 'layers'):
+            yield from _flat_layers(layer)
+        elif (layer.__class__.__name__ != 'InputLayer'):
+            yield layer
+
+
+def activation_memory(model, batchSize, bytesPerValue=4):
+    """
+    Estimates the output memory of every layer of model for batchSize
+    examples; in training all of these are kept for the backward pass.
+    Returns:
+        List of tuples of form (layerName, outputShape, bytes).
+    """
+    layerMemory = []
+    for layer in _flat_layers(model):
+        outputShape = layer.output_shape[1:]
+        layerMemory.append((layer.name, outputShape,
+                            int(batchSize * np.prod(outputShape) * \
+                                bytesPerValue)))
+    return layerMemory
+
+
+def estimate_training_memory(gan, batchSize):
+    """
+    Estimates memory added by training gan at batchSize: parameters and
+    optimizer state, one gradient per trainable weight, and the activations
+    of the larger of the discriminator step (2 * batchSize examples) and the
+    adversarial step (batchSize examples through both models), doubled for
+    their gradients.
+    Returns:
+        Dict of component bytes with 'total'.
+    """
+    models = model_memory(gan)
+    disActivations = sum(layerBytes for _, _, layerBytes in
+                        activation_memory(gan.discriminatorStructure,
+                                        (2 * batchSize)))
+    advActivations = sum(layerBytes for _, _, layerBytes in
+                        activation_memory(gan.adversarialCompiled, batchSize))
+    estimate = {'weightsAndOptimizer' : models['total'],
+                'gradients' : models['adversarial']['trainable'],
+                'activations' : (2 * max(disActivations, advActivations)),
+                'batches' : int(4 * batchSize * (2 * np.prod(gan.imageShape) + \
+                                                (2 * gan.LATENT_DIMS)))}
+    estimate['total'] = sum(estimate.values())
+    return estimate
+
+
+def check_budget(gan, batchSize, budgetBytes, baseBytes=None):
+    """
+    Warns with MemoryBudgetWarning if current RSS plus the training estimate
+    exceeds budgetBytes.
+    Returns:
+        Tuple of form (estimatedBytes, withinBudget).
+    """
+    baseBytes = current_rss() if (baseBytes is None) else baseBytes
+    estimatedBytes = baseBytes + estimate_training_memory(gan,
+                                                        batchSize)['total']
+    withinBudget = (estimatedBytes <= budgetBytes)
+    if not withinBudget:
+        warnings.warn((f'Training {gan.name} at batch size {batchSize} is ' \
+                    f'estimated to need {format_bytes(estimatedBytes)}, over ' \
+                    f'the budget of {format_bytes(budgetBytes)}.'),
+                    MemoryBudgetWarning)
+    return estimatedBytes, withinBudget
+
+
+def memory_report(gan, batchSize, topLayers=5):
+    """ Returns a multi-line report of model and activation memory """
+    lines = []
+    for modelName, sizes in model_memory(gan).items():
+        if (modelName == 'total'):
+            continue
+        lines.append(f'{modelName:<14} params {format_bytes(sizes["params"])}' \
+                    f' | optimizer {format_bytes(sizes["optimizer"])}')
+    layerMemory = activation_memory(gan.adversarialCompiled, batchSize)
+    layerMemory += activation_memory(gan.discriminatorStructure,
+                                    (2 * batchSize))
+    lines.append(f'Largest activations at batch size {batchSize}:')
+    for layerName, outputShape, layerBytes in sorted(layerMemory,
+                                    key=(lambda item : -item[2]))[:topLayers]:
+        lines.append(f'  {layerName:<18} {str(outputShape):<16} ' \
+                    f'{format_bytes(layerBytes)}')
+    estimate = estimate_training_memory(gan, batchSize)
+    lines.append('Training estimate: ' + ' '.join(f'{name}=' \
+                f'{format_bytes(value)}' for name, value in estimate.items()))
+    return '\n'.join(lines)
+
+
+class MemoryMonitor(object):
+    """
+    Samples resident memory on a background thread, tracking the peak.
+    Args:
+        interval (Opt):     Seconds between samples. Defaults to 0.05.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval   =   interval
+        self.startRss   =   current_rss()
+        self.peakRss    =   self.startRss
+        self.sampleNum  =   0
+        self._stop      =   threading.Event()
+        self._thread    =   threading.Thread(target=self._work,
+                                            name='memory_monitor', daemon=True)
+        self._thread.start()
+
+    def __str__(self):
+        return (f'< MemoryMonitor START={format_bytes(self.startRss)} ' \
+                f'PEAK={format_bytes(self.peakRss)} >')
+
+    def _work(self):
+        while not self._stop.wait(self.interval):
+            self.peakRss = max(self.peakRss, current_rss())
+            self.sampleNum += 1
+
+    def close(self):
+        """ Stops sampling and takes a final sample """
+        self._stop.set()
+        self._thread.join()
+        self.peakRss = max(self.peakRss, current_rss())
+        return True
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=('Report DC_GAN memory ' \
+                                                'footprint'))
+    parser.add_argument('--shape', type=int, nargs=3, default=[28, 28, 1])
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--dis-depth', type=int, default=64)
+    parser.add_argument('--gen-depth', type=int, default=None)
+    parser.add_argument('--latent-dims', type=int, default=100)
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Memory budget in GB.')
+    args = parser.parse_args(args)
+    from model import DC_GAN
+    gan = DC_GAN('memory_profile', *args.shape)
+    gan.DIS_DEPTH = args.dis_depth
+    gan.GEN_DEPTH = args.gen_depth or (4 * args.dis_depth)
+    gan.LATENT_DIMS = args.latent_dims
+    gan.initialize_models(verbose=False)
+    print(memory_report(gan, args.batch_size))
+    if args.budget:
+        estimatedBytes, withinBudget = check_budget(gan, args.batch_size,
+                                                    int(args.budget * 2**30))
+        print(f'Estimated {format_bytes(estimatedBytes)} against budget of ' \
+            f'{args.budget}GB: {"ok" if withinBudget else "OVER BUDGET"}')
+        return 0 if withinBudget else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,9 +3,21 @@ Implements base model class for deep convolutional adversarial network
 """
 
 
+from hashlib import sha1
 import numpy as np
-import matplotlib.pyplot as plt
+from numpy.lib.format import open_memmap
 from pickle import dump
+from pipeline import BatchPrefetcher, BatchBuffers, ReplayBuffer
+from datasets import MappedDataset, StreamDataset, StreamExhausted
+from latent import interpolation_latents, seeded_latents
+from cache import LatentImageCache
+from snapshot import SnapshotWriter
+from validation import RotatingValidator, evaluate_dataset
+from quality import QualityMetric
+from instrument import PhaseTimer
+from memory import MemoryMonitor, check_budget, format_bytes
+from checkpoint import (CheckpointWriter, snapshot_state, restore_state,
+                        load_checkpoint, latest_checkpoint)
 from keras.models import Model, Sequential
 from keras.optimizers import RMSprop
 from keras.layers import (Input, Conv2D, Activation, LeakyReLU, Dropout,
@@ -28,6 +40,14 @@ class DC_GAN(object):
         # compiled models
         self.discriminatorCompiled  =   None
         self.adversarialCompiled    =   None
+        # single-graph training steps by steps per call and optimizer state
+        self.fusedSteps             =   {}
+        self.fusedOptimizers        =   None
+        # incremented by training steps and saved with checkpoints
+        self.weightVersion          =   0
+        # seeded images keyed by a fingerprint of generator weights
+        self.imageCache             =   LatentImageCache(maxSize=1024)
+        self._fingerprintFunction   =   None
         ## model building params ##
         # default first-layer filter depth of discriminator
         DIS_DEPTH               =   64
@@ -52,24 +72,88 @@ class DC_GAN(object):
         return (f'< GAN_OBJ={self.name} IMAGE_SHAPE={self.imageShape} | ' \
                 f'BUILT={built} COMPILED={compiled} >')
 
+    def get_params(self):
+        """ Returns dict of the params the DC_GAN object was built with """
+        return {'name':self.name, 'rowNum':self.rowNum,
+                'columnNum':self.columnNum, 'channelNum':self.channelNum,
+                'imageShape':self.imageShape, 'DIS_DEPTH':self.DIS_DEPTH,
+                'GEN_DEPTH':self.GEN_DEPTH, 'DROPOUT':self.DROPOUT,
+                'KERNEL_SIZE':self.KERNEL_SIZE, 'STRIDE':self.STRIDE,
+                'LEAKY_ALPHA':self.LEAKY_ALPHA,
+                'LATENT_DIMS':self.LATENT_DIMS,
+                'NORM_MOMENTUM':self.NORM_MOMENTUM}
+
     def save(self, outFolder):
         """ Saves DC_GAN object under outFolder """
         self.generatorStructure.save(f'{outFolder}/generator.h5')
         self.discriminatorCompiled.save(f'{outFolder}/discriminator.h5')
         self.adversarialCompiled.save(f'{outFolder}/adversarial.h5')
-        paramDict = {'name':self.name, 'rowNum':self.rowNum,
-                    'columnNum':self.columnNum, 'channelNum':self.channelNum,
-                    'imageShape':self.imageShape, 'DIS_DEPTH':self.DIS_DEPTH,
-                    'GEN_DEPTH':self.GEN_DEPTH, 'DROPOUT':self.DROPOUT,
-                    'KERNEL_SIZE':self.KERNEL_SIZE, 'STRIDE':self.STRIDE,
-                    'LEAKY_ALPHA':self.LEAKY_ALPHA,
-                    'LATENT_DIMS':self.LATENT_DIMS,
-                    'NORM_MOMENTUM':self.NORM_MOMENTUM}
-        with open(f'{outFolder}/paramDict.sav', 'w+') as dictFile:
-            dictFile.write(dumps(paramDict))
+        paramDict = self.get_params()
+        with open(f'{outFolder}/paramDict.sav', 'wb') as dictFile:
+            dump(paramDict, dictFile)
         print('Saved')
         return True
 
+    def save_compact(self, path, dtype='float32', includeOptimizer=False):
+        """
+        Saves DC_GAN object to a single file at path, storing generator and
+        discriminator weights once alongside the build params and optimizer
+        settings. Load it with DC_GAN.load().
+        Args:
+            path:                   Path of file to write.
+            dtype (Opt):            Storage dtype of weights, 'float32' or
+                                        'float16'. Defaults to 'float32'.
+            includeOptimizer (Opt): Whether to store optimizer state.
+                                        Defaults to False.
+        Returns:
+            Number of bytes written.
+        """
+        assert (self.discriminatorCompiled and self.adversarialCompiled), \
+            "Models must be compiled. Try running 'self.initialize_models()'."
+        from modelfile import write_model_file
+        return write_model_file(self, path, dtype=dtype,
+                                includeOptimizer=includeOptimizer)
+
+    @classmethod
+    def load(cls, path, compile=True, mmap=True, verbose=False):
+        """
+        Rebuilds a DC_GAN object saved by save_compact().
+        Args:
+            path:               Path of file written by save_compact().
+            compile (Opt):      Whether to compile the discriminator and
+                                    adversarial models with the saved
+                                    optimizer settings. Defaults to True.
+            mmap (Opt):         Whether to read weights memory-mapped.
+                                    Defaults to True.
+            verbose (Opt):      Whether to print model summaries.
+        Returns:
+            DC_GAN object with saved weights (and optimizer state, if
+            stored and compile is set).
+        """
+        from modelfile import read_model_file
+        header, groups = read_model_file(path, mmap=mmap)
+        params = header['params']
+        gan = cls(params['name'], params['rowNum'], params['columnNum'],
+                params['channelNum'])
+        for key, value in params.items():
+            if key.isupper():
+                setattr(gan, key, value)
+        if compile:
+            gan.initialize_models(verbose=verbose, **header['optimizerParams'])
+        else:
+            gan.build_discriminator(verbose=verbose)
+            gan.build_generator(verbose=verbose)
+        gan.generatorStructure.set_weights(groups['generator'])
+        gan.discriminatorStructure.set_weights(groups['discriminator'])
+        if compile and ('disOptimizer' in groups):
+            from checkpoint import _set_optimizer_weights
+            _set_optimizer_weights(gan.discriminatorCompiled,
+                                    groups['disOptimizer'])
+            _set_optimizer_weights(gan.adversarialCompiled,
+                                    groups['advOptimizer'])
+        gan.weightVersion = header['weightVersion']
+        return gan
+
     def dis_get_filter_num(self, LAYER_COUNTER):
         """
         Determines number of filters to use on convolution layer assuming layer
@@ -236,6 +320,7 @@ class DC_GAN(object):
         if verbose:
             print(generatorStructure.summary())
         self.generatorStructure = generatorStructure
+        self._fingerprintFunction = None
         return generatorStructure
 
     def compile_discriminator(self, learningRate, decay, verbose=True):
@@ -306,22 +391,185 @@ class DC_GAN(object):
                                         verbose=verbose)
         return True
 
-    def generate_images(self, n=1):
+    def autotune(self, batchSizes=None, threadConfigs=None,
+                memoryCap=None, force=False, verbose=True):
+        """
+        Picks the batch size and TensorFlow thread pools giving the best
+        training images/sec on this machine within memoryCap, probing
+        train_on_batch and generate_images on synthetic data in separate
+        processes. The choice is cached per machine and model shape, and its
+        thread pools are applied to a new session for this process. Must be
+        called before initialize_models().
+        Args:
+            batchSizes (Opt):       Candidate batch sizes. Defaults to
+                                        autotune.DEFAULT_BATCH_SIZES.
+            threadConfigs (Opt):    Candidate (intraOp, interOp) pairs.
+                                        Defaults to fractions of the cores.
+            memoryCap (Opt):        Max resident bytes. Defaults to None.
+            force (Opt):            Whether to probe even if a cached config
+                                        exists. Defaults to False.
+            verbose (Opt):          Whether to print probe results.
+        Returns:
+            Dict of form {'batchSize', 'intraOp', 'interOp',
+            'trainImagesPerSec', 'generateImagesPerSec', 'peakRss'}.
+        """
+        assert not (self.discriminatorStructure or self.generatorStructure), \
+            'autotune() must run before the models are built.'
+        from autotune import autotune, apply_thread_config, DEFAULT_BATCH_SIZES
+        batchSizes = batchSizes or DEFAULT_BATCH_SIZES
+        tuned = autotune(self.get_params(), batchSizes=batchSizes,
+                        threadConfigs=threadConfigs, memoryCap=memoryCap,
+                        force=force, verbose=verbose)
+        apply_thread_config(tuned['intraOp'], tuned['interOp'])
+        return tuned
+
+    def compile_fused_step(self, stepsPerCall=1):
+        """
+        Compiles a fused training step running the discriminator and
+        adversarial updates in a single graph call, so generated images are
+        never copied back to numpy between updates. The fused step trains the
+        same weights as discriminatorCompiled and adversarialCompiled with
+        RMSprop configured identically; its optimizer slots are kept in
+        self.fusedOptimizers and synced with the compiled optimizers by
+        train_models(). Compiled steps are cached per stepsPerCall.
+        Args:
+            stepsPerCall (Opt):     Number of steps unrolled into one call.
+                                        Defaults to 1.
+        Returns:
+            If stepsPerCall is 1, function of (validExamples, disNoise,
+            advNoise) returning tuple of form (disData, advData). Otherwise
+            function of the same arguments stacked stepsPerCall times along a
+            new first axis returning (disData, advData, stepData), with
+            metrics averaged across the steps.
+        """
+        assert isinstance(stepsPerCall, int), ('stepsPerCall expected type ' \
+                                    f'int, but found type {type(stepsPerCall)}')
+        assert (stepsPerCall > 0), 'stepsPerCall must be positive'
+        if stepsPerCall in self.fusedSteps:
+            return self.fusedSteps[stepsPerCall]
+        assert (self.discriminatorCompiled and self.adversarialCompiled), \
+            "Models must be compiled. Try running 'self.initialize_models()'."
+        from fused import FusedRMSprop, build_fused_step, build_multi_step
+        if not self.fusedOptimizers:
+            disOptimizer = FusedRMSprop(self.discriminatorCompiled.optimizer,
+                    self.discriminatorStructure.trainable_weights, 'fused_dis')
+            advOptimizer = FusedRMSprop(self.adversarialCompiled.optimizer,
+                    self.adversarialCompiled.trainable_weights, 'fused_adv')
+            self.fusedOptimizers = (disOptimizer, advOptimizer)
+        buildArgs = ((self.generatorStructure, self.discriminatorStructure) + \
+                    self.fusedOptimizers + (self.imageShape, self.LATENT_DIMS))
+        if (stepsPerCall == 1):
+            fusedStep = build_fused_step(*buildArgs)
+        else:
+            fusedStep = build_multi_step(*buildArgs, stepsPerCall)
+        self.fusedSteps[stepsPerCall] = fusedStep
+        return fusedStep
+
+    def export_generator(self, outPath, quantize=None):
+        """
+        Writes an inference-only copy of the generator to outPath (.npz) with
+        batch normalization folded into the preceding weights, dropout
+        stripped and activations fused. Load it with
+        export.load_inference_generator().
+        Args:
+            outPath:            Path of .npz file to write.
+            quantize (Opt):     None, 'float16' or 'int8' to store kernels
+                                    quantized. Defaults to None.
+        Returns:
+            outPath.
+        """
+        assert (self.generatorStructure), ("Generator structure has not been " \
+                            "built. Try running 'self.initialize_models()'.")
+        from export import export_generator
+        return export_generator(self.generatorStructure, outPath,
+                                quantize=quantize)
+
+    def generate_images(self, n=1, noiseVector=None, seeds=None,
+                        batchSize=32):
         """
         Generates n images initialized with a random noise vector using
         the current generator.
         Args:
             n (optional):       Int number of images to generate (defaults to 1)
+            noiseVector (Opt):  Precomputed latent noise of shape
+                                    (n, LATENT_DIMS). Defaults to None, in
+                                    which case noise is drawn here.
+            seeds (Opt):        Sequence of non-negative int seeds, one per
+                                    image, overriding n. Each seed addresses a
+                                    fixed latent vector, and images are served
+                                    from self.imageCache while the weights are
+                                    unchanged. Defaults to None.
+            batchSize (Opt):    Images per generator forward pass. Defaults
+                                    to 32.
         Returns:
             imageTensor of shape (n, rowNum, columnNum, channelNum) generated
             by generator given latent dim size noise vector.
         """
-        noiseVector = np.random.uniform(-1.0, 1.0, size=(n, self.LATENT_DIMS))
-        imageTensor = self.generatorStructure.predict(noiseVector)
+        if seeds is not None:
+            return self.generate_seeded_images(seeds)
+        if noiseVector is None:
+            noiseVector = np.random.uniform(-1.0, 1.0,
+                                            size=(n, self.LATENT_DIMS))
+        imageTensor = self.generatorStructure.predict(noiseVector,
+                                                    batch_size=batchSize)
+        return imageTensor
+
+    def weight_fingerprint(self):
+        """
+        Returns a short hex digest summarizing the generator weights and batch norm
+        statistics: the sum, sum of squares and position-weighted sum (sum
+        of the cumulative sum) of each, reduced in graph so only a few floats
+        leave the backend. Unlike weightVersion, it changes however weights
+        are changed (train_on_batch, set_weights, load, train_parallel).
+        """
+        if self._fingerprintFunction is None:
+            from keras import backend as K
+            sums = []
+            for weight in self.generatorStructure.weights:
+                flatWeight = K.flatten(weight)
+                sums += [K.sum(flatWeight), K.sum(K.square(flatWeight)),
+                        K.sum(K.cumsum(flatWeight))]
+            self._fingerprintFunction = K.function([], [K.stack(sums)])
+        sums = self._fingerprintFunction([])[0]
+        return sha1(sums.tobytes()).hexdigest()[:16]
+
+    def generate_seeded_images(self, seeds):
+        """
+        Generates one image per seed from counter-based latents, rendering
+        only seeds missing from self.imageCache for the current generator
+        weights, as identified by weight_fingerprint().
+        Args:
+            seeds:              Sequence of non-negative int seeds.
+        Returns:
+            imageTensor of shape (len(seeds), rowNum, columnNum, channelNum).
+        """
+        seeds = [int(seed) for seed in seeds]
+        imageTensor = np.empty(((len(seeds),) + self.imageShape),
+                                dtype='float32')
+        missingSeeds, missingPositions = [], []
+        fingerprint = self.weight_fingerprint()
+        for position, seed in enumerate(seeds):
+            image = self.imageCache.get(fingerprint, seed)
+            if image is None:
+                missingSeeds.append(seed)
+                missingPositions.append(position)
+            else:
+                imageTensor[position] = image
+        if missingSeeds:
+            uniqueSeeds = sorted(set(missingSeeds))
+            renderedImages = self.generatorStructure.predict(
+                                seeded_latents(uniqueSeeds, self.LATENT_DIMS))
+            renderedBySeed = dict(zip(uniqueSeeds, renderedImages))
+            for seed, image in renderedBySeed.items():
+                self.imageCache.put(fingerprint, seed, image)
+            for position, seed in zip(missingPositions, missingSeeds):
+                imageTensor[position] = renderedBySeed[seed]
         return imageTensor
 
     def plot_image_tensor(self, imageTensor, show=True, outPath=None):
         """ Plots image tensor """
+        # matplotlib is only needed for interactive plotting
+        import matplotlib.pyplot as plt
         grayScale = self.channelNum == 1
         plt.figure(figsize=(10, 10))
         for imageNum, image in enumerate(imageTensor):
@@ -340,38 +588,89 @@ class DC_GAN(object):
             plt.savefig(outPath)
         return True
 
-    def generate_and_plot(self, n, name, show=True, outPath=None):
+    def generate_and_plot(self, n, name, show=True, outPath=None, seeds=None):
         """
-        Generates n image tensors and saves plots to outPath
+        Generates n image tensors and saves plots to outPath. If seeds are
+        given, they replace n and the same latents are plotted every call.
         """
-        imageTensor = self.generate_images(n)
+        imageTensor = self.generate_images(n, seeds=seeds)
         self.plot_image_tensor(imageTensor, show=show, outPath=outPath)
 
-    def interpolate(self, n):
+    def interpolate(self, n, waypoints=None, method='linear', batchSize=256,
+                    out=None, outPath=None, stream=False):
         """
         Creates an interpolation of n steps through the latent dimensional
-        initialization vectors of the generator model.
+        initialization vectors of the generator model. Latents for each batch
+        of frames are built in one vectorized operation and run through the
+        generator batchSize at a time, so long paths are never held in memory
+        unless returned as a single array.
         Args:
-            n:      How many steps across which to generate the interpolation
+            n:                  How many steps across which to generate the
+                                    interpolation
+            waypoints (Opt):    Array of shape (waypointNum, LATENT_DIMS) of
+                                    at least two latent vectors to pass
+                                    through in order. Defaults to the corners
+                                    of the latent space at -1 and 1.
+            method (Opt):       'linear' or 'slerp' (spherical) interpolation.
+                                    Defaults to 'linear'.
+            batchSize (Opt):    Frames per generator call. Defaults to 256.
+            out (Opt):          Array of shape (n, rowNum, columnNum,
+                                    channelNum) to write frames into.
+            outPath (Opt):      Path of a .npy file to memory-map and write
+                                    frames into when out is not given.
+            stream (Opt):       Whether to return a generator yielding tuples
+                                    of form (startFrame, frameBatch) instead
+                                    of writing frames out. Defaults to False.
         Returns:
-            4th order tensor of
+            4th order tensor of shape (n, rowNum, columnNum, channelNum) of
+            interpolation frames (memory-mapped if outPath was given), or a
+            generator of frame batches if stream.
         """
-        MIN_BOUND = -1.0
-        MAX_BOUND = 1.0
-        stepSize = (MAX_BOUND - MIN_BOUND) / float(n)
-        latentVec = np.expand_dims(np.tile([MIN_BOUND], reps=self.LATENT_DIMS),
-                                    axis=0)
+        assert (isinstance(n, int) and (n > 0)), 'n must be a positive int.'
+        if waypoints is None:
+            MIN_BOUND = -1.0
+            MAX_BOUND = 1.0
+            waypoints = np.array([np.full(self.LATENT_DIMS, MIN_BOUND),
+                                np.full(self.LATENT_DIMS, MAX_BOUND)])
+        assert (np.shape(waypoints)[-1] == self.LATENT_DIMS), ('waypoints ' \
+                f'expected {self.LATENT_DIMS} latent dims, but found shape ' \
+                f'{np.shape(waypoints)}.')
 
+        def frame_batches():
+            """ Yields (startFrame, frameBatch) across the path """
+            for start in range(0, n, batchSize):
+                stop = min((start + batchSize), n)
+                latents = interpolation_latents(waypoints, n, method=method,
+                                                start=start, stop=stop)
+                yield start, self.generatorStructure.predict(latents,
+                                                        batch_size=batchSize)
 
-        for step in range(n):
-            imageTensor = self.generatorStructure.predict(latentVec)
-            currentImage = imageTensor[0, :, :, 0]
-            latentVec[:] = (latentVec[0] + stepSize)
-
+        if stream:
+            return frame_batches()
+        if out is None:
+            outShape = ((n,) + self.imageShape)
+            out = (open_memmap(outPath, mode='w+', dtype='float32',
+                                shape=outShape)
+                    if outPath else np.empty(outShape, dtype='float32'))
+        for start, frameBatch in frame_batches():
+            out[start:(start + len(frameBatch))] = frameBatch
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
 
     def train_models(self, xTrain, yTrain, xVal=None, yVal=None, xTest=None,
                     yTest=None, trainSteps=2000, preSteps=5, batchSize=200,
-                    saveInterval=500, outPath=None):
+                    saveInterval=500, outPath=None, prefetch=None,
+                    prefetchWorkers=2, fused=False, stepsPerCall=1,
+                    reuseBuffers=False, checkpointDir=None,
+                    checkpointInterval=None, keepCheckpoints=3,
+                    resumeFrom=None, snapshotDir='training_data3',
+                    snapshotNum=16, valInterval=10, valChunk=None,
+                    valBudget=0.1, metricsPath=None, callbacks=None,
+                    replaySize=None, replayRatio=0.5, replayInterval=1,
+                    qualityInterval=None, qualitySamples=1000,
+                    qualityExtractor=None, memoryBudget=None,
+                    profileMemory=False, shuffleBuffer=None):
         """
         Trains discriminator, generator, and adversarial model on x- and yTrain,
         validation on x- and yVal and evaluating final metrics on x- and yTest.
@@ -380,7 +679,17 @@ class DC_GAN(object):
         Args:
             xTrain:                 Training features for discriminator to
                                         classify and generator to 'replicate'.
-            yTrain:                 Labels for training data.
+                                        Either an array, a dataset from
+                                        datasets.py (MappedDataset,
+                                        CompactDataset), a path to a .npy
+                                        file, raw shard or directory of shards
+                                        to memory-map, or a stream: an
+                                        iterable or callable of image batches
+                                        (or a StreamDataset), shape-checked
+                                        on its first batch. Training on a
+                                        stream ends early if it runs out.
+            yTrain:                 Labels for training data. May be None,
+                                        and is ignored for streams.
             xVal (Optional):        Validation features to analyze training
                                         progress. Defaults to None.
             yVal (Optional):        Validation labels to analyze training
@@ -401,6 +710,96 @@ class DC_GAN(object):
                                         and models. Defaults to 500.
             outPath (Opt):          Path to which to save the DC_GAN object
                                         after training.
+            prefetch (Opt):         Number of batches to prepare ahead of the
+                                        trainer on background threads. Defaults
+                                        to None (batches built inline).
+            prefetchWorkers (Opt):  Number of threads preparing batches when
+                                        prefetch is set. Defaults to 2.
+            fused (Opt):            Whether to run each step as a single fused
+                                        graph call from compile_fused_step().
+                                        Defaults to False.
+            stepsPerCall (Opt):     Number of fused steps to run per graph
+                                        call; metrics are averaged in graph
+                                        and logged once per call. Values above
+                                        1 imply fused. Defaults to 1.
+            reuseBuffers (Opt):     Whether to assemble batches in persistent
+                                        float32 buffers instead of allocating
+                                        new arrays each step. Defaults to
+                                        False.
+            checkpointDir (Opt):    Directory to which full training state is
+                                        checkpointed by a background writer,
+                                        in place of the generator .h5 saves.
+                                        Defaults to None (no checkpoints).
+            checkpointInterval (Opt): Steps between checkpoints. Defaults to
+                                        saveInterval.
+            keepCheckpoints (Opt):  Number of newest checkpoints kept in
+                                        checkpointDir. Defaults to 3.
+            resumeFrom (Opt):       Checkpoint path to resume training from,
+                                        or 'latest' for the newest under
+                                        checkpointDir. Resumed runs skip
+                                        pretraining and continue to
+                                        trainSteps. Resume is exact except
+                                        with prefetch or a streamed xTrain,
+                                        whose worker RNGs, queued batches and
+                                        stream position are not saved; the
+                                        running validation window also
+                                        restarts. Defaults to None.
+            snapshotDir (Opt):      Folder to which a PNG mosaic of generator
+                                        samples is written at saveInterval by
+                                        a background thread. Defaults to
+                                        'training_data3'; None disables.
+            snapshotNum (Opt):      Number of fixed seeds rendered in each
+                                        snapshot. Defaults to 16.
+            valInterval (Opt):      Minimum steps between validations on a
+                                        rotating, stratified chunk of xVal
+                                        mixed with fakes. Defaults to 10.
+            valChunk (Opt):         Validation examples evaluated per chunk.
+                                        Defaults to batchSize.
+            valBudget (Opt):        Max fraction of training time spent
+                                        validating; the interval is stretched
+                                        to stay within it. Defaults to 0.1.
+            metricsPath (Opt):      Path of a .jsonl or .csv file to which
+                                        per-step phase times, images/sec and
+                                        metrics are exported. Defaults to None.
+            callbacks (Opt):        List of functions called with each step
+                                        record from PhaseTimer. Defaults to
+                                        None.
+            replaySize (Opt):       Capacity of a ring buffer of past
+                                        generator outputs from which
+                                        discriminator fakes are partly
+                                        replayed. Not used with fused.
+                                        Defaults to None (every fake fresh).
+            replayRatio (Opt):      Fraction of fakes freshly generated on
+                                        refresh steps. Defaults to 0.5.
+            replayInterval (Opt):   Discriminator steps per generator
+                                        refresh; fakes of the steps between
+                                        are all replayed. Defaults to 1.
+            qualityInterval (Opt):  Steps between FID-style quality scores
+                                        of fixed-seed samples against xVal
+                                        (or xTrain), logged as 'fid'.
+                                        Defaults to None (never scored).
+            qualitySamples (Opt):   Real and generated images per quality
+                                        score. Defaults to 1000.
+            qualityExtractor (Opt): Keras model embedding images for the
+                                        quality score, or path of one saved
+                                        by quality.save_feature_extractor().
+                                        Required with qualityInterval.
+            memoryBudget (Opt):     Bytes training may use; a
+                                        MemoryBudgetWarning is raised before
+                                        training if the estimated footprint
+                                        exceeds it. Defaults to None.
+            profileMemory (Opt):    Whether to sample peak RSS on a
+                                        background thread and record RSS
+                                        growth per phase in step records.
+                                        Defaults to False.
+            shuffleBuffer (Opt):    Images of a streamed xTrain held in
+                                        memory and drawn from at random
+                                        without replacement, each draw
+                                        refilled from the stream. At least
+                                        batchSize. Only for an iterable or
+                                        callable xTrain; a StreamDataset
+                                        sets its own bufferSize. Defaults to
+                                        None (stream order).
         Returns:
             Tuple of form (trainedGenerator, trainedDiscriminator,
             trainedAversarial).
@@ -417,15 +816,38 @@ class DC_GAN(object):
             assert (shape_1==shape_2), (f'{name_1} and {name_2} should have ' \
             f'the same number of examples, but have {shape_1} and {shape_2}')
 
+        # paths are opened as memory-mapped datasets
+        if isinstance(xTrain, str):
+            xTrain = MappedDataset(xTrain, imageShape=self.imageShape)
+        if isinstance(xVal, str):
+            xVal = MappedDataset(xVal, imageShape=self.imageShape)
+        if isinstance(xTest, str):
+            xTest = MappedDataset(xTest, imageShape=self.imageShape)
+        # iterables and callables are read lazily as streams
+        rawStream = ((not isinstance(xTrain, StreamDataset)) and
+                    (callable(xTrain) or not hasattr(xTrain, 'shape')))
+        assert ((shuffleBuffer is None) or rawStream), ('shuffleBuffer ' \
+            'applies only to an iterable or callable xTrain; set bufferSize ' \
+            'on a StreamDataset instead.')
+        if rawStream:
+            xTrain = StreamDataset(xTrain, self.imageShape,
+                                    bufferSize=shuffleBuffer)
+        stream = xTrain if isinstance(xTrain, StreamDataset) else None
+        if stream:
+            # shapes are checked on the first batch, labels are unused
+            yTrain = None
+
         datasetInputs = [('xTrain', xTrain), ('yTrain', yTrain), ('xVal', xVal),
                         ('yVal', yVal), ('xTest', xTest), ('yTest', yTest)]
 
         for i in range(0, len(datasetInputs), 2):
             name_1, dataset_1 = datasetInputs[i]
-            if (dataset_1.all() != None):
+            if (dataset_1 is not None) and (dataset_1 is not stream):
                 name_2, dataset_2 = datasetInputs[i+1]
                 shape_assertion(dataset_1, name_1)
-                length_assertion(dataset_1, dataset_2, name_1, name_2)
+                # labels are optional since they are unused by the gan
+                if (dataset_2 is not None):
+                    length_assertion(dataset_1, dataset_2, name_1, name_2)
 
         assert isinstance(trainSteps, int), ('trainSteps expected type int, ' \
                                             f'but found type ' \
@@ -441,6 +863,11 @@ class DC_GAN(object):
                 f'{type(saveInterval)}')
         assert (isinstance(outPath, str) or (outPath==None)), ('outPath ' \
                         f'expected type str, but found type {type(outPath)}')
+        assert (isinstance(prefetch, int) or (prefetch==None)), ('prefetch ' \
+                f'expected type int or None, but found type {type(prefetch)}')
+        assert isinstance(stepsPerCall, int), ('stepsPerCall expected type ' \
+                                    f'int, but found type {type(stepsPerCall)}')
+        assert (stepsPerCall > 0), 'stepsPerCall must be positive'
         assert (self.discriminatorStructure), ("Disriminator structure has " \
                     "not been built. Try running 'self.initialize_models()'.")
         assert (self.generatorStructure), ("Generator structure has not been " \
@@ -450,12 +877,52 @@ class DC_GAN(object):
         assert (self.adversarialCompiled), ("Adversarial model has not been " \
                         "compiled. Try running 'self.initialize_models()'.")
 
+        # warn before allocating anything if the footprint is over budget
+        if memoryBudget:
+            estimatedBytes, _ = check_budget(self, batchSize, memoryBudget)
+            print(f'Estimated training memory: ' \
+                f'{format_bytes(estimatedBytes)} of ' \
+                f'{format_bytes(memoryBudget)} budget.')
+        memoryMonitor = MemoryMonitor() if profileMemory else None
+
         # get number of examples in each dataset
-        trainExampleNum = xTrain.shape[0]
-        valExampleNum = xVal.shape[0] if (xVal.all() != None) else 0
-        testExampleNum = xTest.shape[0] if (xTest.all() != None) else 0
+        trainExampleNum = xTrain.shape[0] if (not stream) else None
+        valExampleNum = xVal.shape[0] if (xVal is not None) else 0
+        testExampleNum = xTest.shape[0] if (xTest is not None) else 0
+
+        latentDims = self.LATENT_DIMS
+
+        def sample_batch(randomState=np.random):
+            """
+            Samples the random inputs of one training step: batchSize valid
+            examples drawn from xTrain, and noise vectors for the
+            discriminator and adversarial updates. Safe to call from worker
+            threads given a thread-local randomState.
+            Args:
+                randomState (Opt):  RandomState from which to draw. Defaults
+                                        to the global numpy generator.
+            Returns:
+                Tuple of form (validExamples, disNoise, advNoise).
+            """
+            if stream:
+                validExamples = stream.sample(batchSize)
+            else:
+                selectionIndex = randomState.randint(low=0,
+                                                    high=trainExampleNum,
+                                                    size=batchSize)
+                validExamples = xTrain[selectionIndex, :, :, :]
+            disNoise = randomState.uniform(low=-1.0, high=1.0,
+                                            size=(batchSize, latentDims))
+            advNoise = randomState.uniform(low=-1.0, high=1.0,
+                                            size=(batchSize, latentDims))
+            return (validExamples, disNoise, advNoise)
+
+        # targets never change across steps so are only built once
+        validTargets = np.concatenate([np.ones(shape=(batchSize,)),
+                                    np.zeros(shape=(batchSize,))])
+        adversarialTargets = np.ones(shape=(batchSize,))
 
-        def batch_discriminator_data(xTrain=xTrain, batchSize=batchSize):
+        def batch_discriminator_data(validExamples, disNoise):
             """
             Builds batch of data for training discriminator comprised of even
             split down batchSize. Half of output data will be a valid example
@@ -463,28 +930,32 @@ class DC_GAN(object):
             initialized as a random-uniform noise vector of latentDims to be
             passed to generator and discriminated after upsampling.
             Args:
-                xTrain:         Dataset of features for training
-                batchSize:      Batch size for training
+                validExamples:  batchSize examples sampled from xTrain
+                disNoise:       Noise vectors from which to generate invalid
+                                    examples
             Returns:
                 4th order tensor of valid and invalid features of shape
                 ((2 * batchSize), rowNum, columnNum, channelNum) and vector of
                 target labels of length batchSize for discriminator training
                 (0 - invalid, 1 - valid) in tuple of form (features, targets).
             """
-            # select random batchSize examples from xTrain
-            selectionIndex = np.random.randint(low=0, high=trainExampleNum,
-                                                size=batchSize)
-            validExamples = xTrain[selectionIndex, :, :, :]
-            validTargets = np.ones(shape=(batchSize,))
-            # pass noise vector through generator to get noise images
-            invalidExamples = self.generate_images(batchSize)
-            invalidTargets = np.zeros(shape=(batchSize,))
-            # concatenate features and targets and return
+            # pass noise vector through generator to get noise images, or
+            # replay part of them from past outputs
+            with timer.phase('generate'):
+                if replay:
+                    invalidExamples = replay.draw(disNoise,
+                                                self.generate_images)
+                else:
+                    invalidExamples = self.generate_images(batchSize,
+                                                        noiseVector=disNoise)
+            if buffers:
+                return buffers.assemble_discriminator(validExamples,
+                                                        invalidExamples)
+            # concatenate features and return with cached targets
             features = np.concatenate([validExamples, invalidExamples])
-            targets = np.concatenate([validTargets, invalidTargets])
-            return features, targets
+            return features, validTargets
 
-        def batch_adversarial_data(batchSize=batchSize):
+        def batch_adversarial_data(advNoise):
             """
             Generates batch of training data for adversarial network. Here,
             every example is a random vector of length latentDims and every
@@ -493,70 +964,269 @@ class DC_GAN(object):
             score' has minimum binary crossentropy loss with respect to 1.0
             as output by the discriminator within the adversarial model.
             Args:
-                batchSize:      Batch size for training
+                advNoise:       Noise vectors of shape (batchSize, latentDims)
             Returns:
                 2nd order tensor of shape (batchSize, latentDims) containing
                 noise vectors for initializing the generator and vector of
                 target labels (all 1's - valid) in tuple of form (features,
                 targets).
             """
-            noiseLatent = np.random.uniform(low=-1.0, high=1.0,
-                                            size=(batchSize, self.LATENT_DIMS))
-            targets = np.ones(shape=(batchSize,))
-            return (noiseLatent, targets)
+            if buffers:
+                return (advNoise, buffers.advTargets)
+            return (advNoise, adversarialTargets)
+
+        # persistent buffers replace per-step allocations
+        buffers = (BatchBuffers(batchSize, self.imageShape, latentDims)
+                    if reuseBuffers else None)
+
+        fused = (fused or (stepsPerCall > 1))
+        assert not (replaySize and fused), ('replaySize cannot be used with ' \
+                            'fused steps, which generate fakes in graph.')
+        replay = (ReplayBuffer(replaySize, batchSize, self.imageShape,
+                                refreshRatio=replayRatio,
+                                refreshInterval=replayInterval)
+                    if replaySize else None)
+
+        # batches are either prepared ahead on worker threads or inline
+        if prefetch:
+            assert (prefetch > 0), 'prefetch must be a positive int.'
+            prefetcher = BatchPrefetcher(sample_batch, bufferSize=prefetch,
+                                        workerNum=prefetchWorkers)
+            next_batch = prefetcher.get
+        else:
+            prefetcher = None
+            next_batch = ((lambda : buffers.sample(xTrain)) if buffers else
+                            sample_batch)
+
+        # wall time of each phase of every step
+        timer = PhaseTimer(outPath=metricsPath, callbacks=callbacks,
+                            trackMemory=profileMemory)
 
-        print(f'Training for {trainSteps} steps on {trainExampleNum} ' \
+        print(f'Training for {trainSteps} steps on ' \
+            f'{"streamed" if stream else trainExampleNum} ' \
             f'examples with batch size of {batchSize}.\nValidating on ' \
             f'{valExampleNum} examples.')
 
+        # validation runs on rotating chunks within a time budget
+        validator = (RotatingValidator(self, xVal, yVal,
+                                        chunkSize=(valChunk or batchSize),
+                                        interval=valInterval,
+                                        maxFraction=valBudget)
+                    if (valExampleNum > 0) else None)
+
+        # restore training state to resume after a checkpointed step
+        if (resumeFrom == 'latest'):
+            assert checkpointDir, "resumeFrom='latest' requires checkpointDir."
+            resumeFrom = latest_checkpoint(checkpointDir)
+            if not resumeFrom:
+                print(f'No checkpoint found under {checkpointDir}; starting ' \
+                    'from scratch.')
+        if resumeFrom:
+            resumeStep = restore_state(self, load_checkpoint(resumeFrom),
+                                        buffers=buffers, replay=replay,
+                                        validator=validator)
+            print(f'Resumed from {resumeFrom} after step {resumeStep}.')
+            if prefetcher or stream:
+                print('Resume is not exact: ' + \
+                    ('prefetch worker RNGs and queued batches ' if prefetcher
+                    else 'the stream position and shuffle buffer ') + \
+                    'are not checkpointed.')
+        checkpointInterval = (checkpointInterval or saveInterval)
+        checkpointWriter = (CheckpointWriter(checkpointDir,
+                                            keep=keepCheckpoints)
+                            if checkpointDir else None)
+        snapshotWriter = (SnapshotWriter(snapshotDir,
+                                        invert=(self.channelNum == 1))
+                            if snapshotDir else None)
+
+        # sample quality against real statistics computed once up front
+        assert not (qualityInterval and stream and not valExampleNum), \
+            'qualityInterval requires xVal when xTrain is streamed.'
+        assert not (qualityInterval and (qualityExtractor is None)), \
+            'qualityInterval requires a fixed qualityExtractor.'
+        quality = (QualityMetric(self, (xVal if (valExampleNum > 0) else
+                                        xTrain), qualityExtractor,
+                                sampleNum=qualitySamples, batchSize=batchSize)
+                    if qualityInterval else None)
+        fidScore = float('nan')
+
         # pretrain discriminator
-        if preSteps:
+        if preSteps and not resumeFrom:
             assert (preSteps > 0), 'preSteps must be a positive int.'
             for preStep in range(preSteps):
-                preFeatures, preTargets = batch_discriminator_data()
+                try:
+                    validExamples, disNoise, _ = next_batch()
+                except StreamExhausted:
+                    print(f'Training data ran out during pretraining: {stream}')
+                    break
+                preFeatures, preTargets = batch_discriminator_data(validExamples,
+                                                                    disNoise)
                 preData = self.discriminatorCompiled.train_on_batch(x=preFeatures,
                                                                     y=preTargets)
-                valData = [0,0]
+                self.weightVersion += 1
+                valData = validator.result() if validator else [0,0]
                 preLoss, preAcc = round(preData[0], 3), round(preData[1], 3)
                 valLoss, valAcc = round(valData[0], 3), round(valData[1], 3)
                 print(f'Pretraining: {preStep}\n' \
                     f'\tD [train loss: {preLoss} train acc: {preAcc} | ' \
                     f'val loss: {valLoss} val acc: {valAcc}')
 
-        for curStep in range(trainSteps):
-            # train discriminator on valid and invalid images
-            disFeatures, disTargets = batch_discriminator_data()
-            disData = self.discriminatorCompiled.train_on_batch(x=disFeatures,
-                                                                y=disTargets)
-            # train adversarial network
-            advFeatures, advTargets = batch_adversarial_data()
-            advData = self.adversarialCompiled.train_on_batch(x=advFeatures,
-                                                            y=advTargets)
+        if fused:
+            fusedStep = self.compile_fused_step()
+            multiStep = self.compile_fused_step(stepsPerCall)
+            # compiled optimizers hold the state passed to and from fused
+            # training and checkpoints, so must have their slots built
+            self.discriminatorCompiled._make_train_function()
+            self.adversarialCompiled._make_train_function()
+            # carry optimizer state over from any train_on_batch updates
+            disOptimizer, advOptimizer = self.fusedOptimizers
+            disOptimizer.sync_from(self.discriminatorCompiled.optimizer)
+            advOptimizer.sync_from(self.adversarialCompiled.optimizer)
+            noiseBlockShape = (stepsPerCall, batchSize, latentDims)
+            stepBlocks = [np.empty(((stepsPerCall, batchSize) + \
+                                    self.imageShape), dtype='float32'),
+                        np.empty(noiseBlockShape, dtype='float32'),
+                        np.empty(noiseBlockShape, dtype='float32')]
+
+        nextStep = (resumeStep + 1) if resumeFrom else 0
+        curStep = nextStep - 1
+        timer.start_step()
+        while (nextStep < trainSteps):
+            # steps are run in blocks of stepsPerCall, with any remainder
+            # run one at a time
+            blockSize = (stepsPerCall if ((trainSteps - nextStep) >= \
+                                        stepsPerCall) else 1)
+            with timer.phase('sample'):
+                try:
+                    if (blockSize > 1):
+                        # gather stepsPerCall batches into blocks
+                        for blockStep in range(blockSize):
+                            for block, batchPart in zip(stepBlocks,
+                                                        next_batch()):
+                                block[blockStep] = batchPart
+                    else:
+                        validExamples, disNoise, advNoise = next_batch()
+                except StreamExhausted:
+                    print(f'Training data ran out after step {curStep}: ' \
+                        f'{stream}')
+                    break
+            if (blockSize > 1):
+                # train the block of steps in one graph call
+                with timer.phase('fused'):
+                    disData, advData, _ = multiStep(*stepBlocks)
+            elif fused:
+                # train discriminator and adversarial in one graph call
+                with timer.phase('fused'):
+                    disData, advData = fusedStep(validExamples, disNoise,
+                                                advNoise)
+            else:
+                # train discriminator on valid and invalid images
+                disFeatures, disTargets = batch_discriminator_data(
+                                                    validExamples, disNoise)
+                with timer.phase('discriminator'):
+                    disData = self.discriminatorCompiled.train_on_batch(
+                                                x=disFeatures, y=disTargets)
+                # train adversarial network
+                advFeatures, advTargets = batch_adversarial_data(advNoise)
+                with timer.phase('adversarial'):
+                    advData = self.adversarialCompiled.train_on_batch(
+                                                x=advFeatures, y=advTargets)
+            self.weightVersion += 1
+            firstStep, curStep = nextStep, (nextStep + blockSize - 1)
+            nextStep += blockSize
             # validate, format, and log
-            # if (valExampleNum > 0):
-            #     valData = self.discriminatorCompiled.evaluate(x=xVal, y=yVal,
-            #                                                     verbose=False)
-            valData = [0,0]
-            disLoss, disAcc = round(disData[0], 3), round(disData[1], 3)
-            valLoss, valAcc = round(valData[0], 3), round(valData[1], 3)
-            advLoss, advAcc = round(advData[0], 3), round(advData[1], 3)
-            print(f'Step: {curStep}\n' \
-                f'\tD [train loss: {disLoss} train acc: {disAcc} | ' \
-                f'val loss: {valLoss} val acc: {valAcc}]\n' \
-                f'\tA [loss: {advLoss} acc: {advAcc}]')
-            # save at saveInterval benchmarks
-            if (((curStep % saveInterval) == 0) and (curStep != 0)):
-                self.generate_and_plot(n=10, name=curStep, show=False,
-                                        outPath=f'training_data3/{curStep}')
-                plt.close()
-                self.generatorStructure.save('training_data/' \
+            with timer.phase('validate'):
+                valData = (validator.step(curStep, timer.elapsed(),
+                                        stepNum=blockSize)
+                            if validator else [0,0])
+            # score quality at qualityInterval benchmarks crossed in the block
+            scored = (quality and ((curStep // qualityInterval) > \
+                                    ((firstStep - 1) // qualityInterval)))
+            if scored:
+                with timer.phase('quality'):
+                    fidScore = quality.score(curStep)
+            with timer.phase('log'):
+                disLoss, disAcc = round(disData[0], 3), round(disData[1], 3)
+                valLoss, valAcc = round(valData[0], 3), round(valData[1], 3)
+                advLoss, advAcc = round(advData[0], 3), round(advData[1], 3)
+                stepName = (curStep if (blockSize == 1) else \
+                            f'{firstStep}-{curStep}')
+                print(f'Step: {stepName}\n' \
+                    f'\tD [train loss: {disLoss} train acc: {disAcc} | ' \
+                    f'val loss: {valLoss} val acc: {valAcc}]\n' \
+                    f'\tA [loss: {advLoss} acc: {advAcc}]' + \
+                    (f'\n\tQ [fid: {round(fidScore, 3)}]' if scored else ''))
+            # save at saveInterval benchmarks crossed within the block
+            if (((curStep // saveInterval) > ((firstStep - 1) // saveInterval))
+                and (curStep != 0)):
+                with timer.phase('snapshot'):
+                    if snapshotWriter:
+                        # same latent grid every time so snapshots compare
+                        snapshotWriter.submit(self.generate_images(
+                                                seeds=range(snapshotNum)),
+                                            name=f'{curStep}')
+                    if not checkpointWriter:
+                        self.generatorStructure.save('training_data/' \
                                             f'generatorModel_{curStep}.h5')
+            # checkpoint at checkpointInterval benchmarks crossed in the block
+            if checkpointWriter and (curStep != 0) and \
+                ((curStep // checkpointInterval) > \
+                ((firstStep - 1) // checkpointInterval)):
+                with timer.phase('checkpoint'):
+                    if fused:
+                        disOptimizer.sync_to(
+                                        self.discriminatorCompiled.optimizer)
+                        advOptimizer.sync_to(
+                                        self.adversarialCompiled.optimizer)
+                    checkpointWriter.submit(snapshot_state(self, curStep,
+                                                buffers=buffers, replay=replay,
+                                                validator=validator))
+            timer.end_step(stepName, (blockSize * batchSize),
+                            disLoss=disData[0], disAcc=disData[1],
+                            advLoss=advData[0], advAcc=advData[1],
+                            valLoss=valData[0], valAcc=valData[1],
+                            fid=fidScore)
+
+        if fused:
+            # leave compiled optimizers in step with fused training
+            disOptimizer.sync_to(self.discriminatorCompiled.optimizer)
+            advOptimizer.sync_to(self.adversarialCompiled.optimizer)
+
+        if replay:
+            print(f'Replay: ' \
+                f'{replay.report(timer.phaseTotals.get("generate"))}')
+
+        if prefetcher:
+            print(f'Prefetch: {prefetcher.stall_report()}')
+            prefetcher.close()
+
+        if stream:
+            print(f'Stream: {stream}')
+
+        if snapshotWriter:
+            snapshotWriter.close()
+
+        if checkpointWriter:
+            # final state is always checkpointed once any step has run
+            if (curStep >= 0) and (curStep % checkpointInterval):
+                checkpointWriter.submit(snapshot_state(self, curStep,
+                                                buffers=buffers, replay=replay,
+                                                validator=validator))
+            checkpointWriter.close()
+            print(f'Checkpoints: {checkpointWriter}')
 
         # when training is complete, test on witheld data and save
+        print(f'Timing: {timer.summary_report()}')
+        timer.close()
+        if validator:
+            print(f'Validation: {validator}')
+        if quality:
+            print(f'Quality: {quality}')
+        if memoryMonitor:
+            memoryMonitor.close()
+            print(f'Memory: {memoryMonitor}')
         if (testExampleNum > 0):
-            # testData = self.discriminatorCompiled.evaluate(x=xTest, y=yTest,
-            #                                             verbose=False)
-            testData = [0, 0]
+            testData = evaluate_dataset(self, xTest, batchSize=batchSize)
             testLoss, testAcc = round(testData[0], 4), round(testData[1], 4)
             print(f'Training Complete after {curStep} steps.\n' \
                 f'D [test loss: {testLoss} test acc: {testAcc}]')
@@ -568,3 +1238,39 @@ class DC_GAN(object):
 
         return (self.generatorStructure, self.discriminatorCompiled,
                 self.adversarialCompiled)
+
+    def train_parallel(self, xTrain, trainSteps=2000, batchSize=200,
+                        workerNum=2, threadsPerWorker=None, syncInterval=100,
+                        seed=None, verbose=True):
+        """
+        Data-parallel alternative to train_models(): workerNum local processes
+        each compute discriminator and adversarial gradients on an equal
+        shard of every batch and average them over shared memory before
+        applying them, so all workers hold the same weights. Trained weights
+        and optimizer state are loaded back into this object. Pretraining,
+        validation, snapshots and checkpoints are not run.
+        Args:
+            xTrain:                 Training features as an array, a path
+                                        to memory-map in each worker, or a
+                                        dataset with take(index, out).
+            trainSteps (Opt):       Number of steps. Defaults to 2000.
+            batchSize (Opt):        Global batch size, divisible by
+                                        workerNum. Defaults to 200.
+            workerNum (Opt):        Number of worker processes. Defaults to 2.
+            threadsPerWorker (Opt): TF threads per worker. Defaults to an
+                                        even split of the machine's cores.
+            syncInterval (Opt):     Steps between full weight averages.
+                                        Defaults to 100.
+            seed (Opt):             Seed of worker sampling. Defaults to None.
+            verbose (Opt):          Whether to log every step. Defaults to
+                                        True.
+        Returns:
+            Dict of form {'steps', 'workerNum', 'stepsPerSec',
+            'imagesPerSec', 'disData', 'advData'}.
+        """
+        from parallel import train_data_parallel
+        return train_data_parallel(self, xTrain, trainSteps=trainSteps,
+                                    batchSize=batchSize, workerNum=workerNum,
+                                    threadsPerWorker=threadsPerWorker,
+                                    syncInterval=syncInterval, seed=seed,
+                                    verbose=verbose)
@@ -0,0 +1,134 @@
+"""
+Implements a compact single-file format for DC_GAN models: generator and
+discriminator weights are stored once (the adversarial model only stacks
+them), optionally as float16, next to the build params and optimizer
+settings. Arrays are 64-byte aligned after a JSON header so they can be read
+memory-mapped without copying.
+"""
+
+
+import os
+import json
+import struct
+import numpy as np
+
+
+MODEL_MAGIC     =   b'DCGANMF\x01'
+MODEL_FORMAT    =   1
+ALIGNMENT       =   64
+STORE_DTYPES    =   ('float32', 'float16')
+
+
+def _aligned(offset):
+    return (-(-offset // ALIGNMENT) * ALIGNMENT)
+
+
+def _rmsprop_params(compiledModel):
+    """ Returns learning rate and decay of a compiled model's optimizer """
+    config = compiledModel.optimizer.get_config()
+    return (float(config.get('lr', config.get('learning_rate'))),
+            float(config.get('decay', 0.)))
+
+
+def write_model_file(gan, path, dtype='float32', includeOptimizer=False):
+    """
+    Writes gan to path in a single file, atomically through a temporary file.
+    Args:
+        gan:                Built and compiled DC_GAN.
+        path:               Path of file to write.
+        dtype (Opt):        Storage dtype of float weights, 'float32' or
+                                'float16'. Defaults to 'float32'.
+        includeOptimizer (Opt): Whether to store optimizer state so training
+                                can continue. Defaults to False.
+    Returns:
+        Number of bytes written.
+    """
+    assert (dtype in STORE_DTYPES), (f'dtype expected one of ' \
+                                    f'{STORE_DTYPES}, but found {dtype}.')
+    groups = {'generator' : gan.generatorStructure.get_weights(),
+            'discriminator' : gan.discriminatorStructure.get_weights()}
+    if includeOptimizer:
+        from checkpoint import _optimizer_weights
+        groups['disOptimizer'] = _optimizer_weights(gan.discriminatorCompiled)
+        groups['advOptimizer'] = _optimizer_weights(gan.adversarialCompiled)
+    entries, arrays, offset = [], [], 0
+    for groupName, values in groups.items():
+        for i, value in enumerate(values):
+            value = np.asarray(value)
+            # optimizer state and counters keep full precision
+            if (value.dtype == np.float32) and groupName in ('generator',
+                                                            'discriminator'):
+                value = value.astype(dtype)
+            value = np.ascontiguousarray(value)
+            offset = _aligned(offset)
+            entries.append({'name' : f'{groupName}/{i:04d}',
+                            'dtype' : value.dtype.str,
+                            'shape' : list(value.shape), 'offset' : offset})
+            arrays.append(value)
+            offset += value.nbytes
+    disLr, disDecay = _rmsprop_params(gan.discriminatorCompiled)
+    advLr, advDecay = _rmsprop_params(gan.adversarialCompiled)
+    header = {'format' : MODEL_FORMAT, 'params' : gan.get_params(),
+            'optimizerParams' : {'disLr' : disLr, 'disDecay' : disDecay,
+                                'advLr' : advLr, 'advDecay' : advDecay},
+            'weightVersion' : int(gan.weightVersion),
+            'groupSizes' : {groupName : len(values)
+                            for groupName, values in groups.items()},
+            'arrays' : entries}
+    headerBytes = json.dumps(header).encode('utf-8')
+    dataStart = _aligned(len(MODEL_MAGIC) + 8 + len(headerBytes))
+    tempPath = f'{path}.tmp'
+    with open(tempPath, 'wb') as modelFile:
+        modelFile.write(MODEL_MAGIC + struct.pack('<Q', len(headerBytes)))
+        modelFile.write(headerBytes)
+        for entry, value in zip(entries, arrays):
+            modelFile.seek(dataStart + entry['offset'])
+            modelFile.write(value.tobytes())
+        size = modelFile.tell()
+    os.replace(tempPath, path)
+    return size
+
+
+def read_model_file(path, mmap=True):
+    """
+    Reads a file written by write_model_file().
+    Args:
+        path:               Path of model file.
+        mmap (Opt):         Whether to return read-only views of a memory
+                                map instead of reading the file. Defaults to
+                                True.
+    Returns:
+        Tuple of form (header, groups) where groups maps group name to its
+        list of arrays.
+    """
+    with open(path, 'rb') as modelFile:
+        magic = modelFile.read(len(MODEL_MAGIC))
+        assert (magic == MODEL_MAGIC), f'{path} is not a DC_GAN model file.'
+        headerSize, = struct.unpack('<Q', modelFile.read(8))
+        header = json.loads(modelFile.read(headerSize).decode('utf-8'))
+    assert (header['format'] == MODEL_FORMAT), ('Unsupported model format ' \
+                                                f'{header["format"]}.')
+    dataStart = _aligned(len(MODEL_MAGIC) + 8 + headerSize)
+    if mmap:
+        buffer = np.memmap(path, dtype='uint8', mode='r')
+    else:
+        with open(path, 'rb') as modelFile:
+            buffer = modelFile.read()
+    arrays = {}
+    for entry in header['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        arrays[entry['name']] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                    offset=(dataStart + entry['offset'])
+                                    ).reshape(entry['shape'])
+    groups = {groupName : [arrays[f'{groupName}/{i:04d}'] for i in range(size)]
+            for groupName, size in header['groupSizes'].items()}
+    return header, groups
+
+
+def model_file_size(path):
+    """ Returns size of a model file, or the summed size of a save() folder """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, fileName))
+                    for fileName in os.listdir(path))
+    return os.path.getsize(path)
@@ -0,0 +1,419 @@
+"""
+Implements data-parallel DC_GAN training across local worker processes: each
+worker computes discriminator and adversarial gradients on its shard of the
+batch, the gradients are averaged by an allreduce over shared memory, and
+every worker applies the same averaged update so weights stay in sync
+"""
+
+
+import os
+import time
+import queue
+import traceback
+import multiprocessing
+import numpy as np
+
+
+class SharedAllReduce(object):
+    """
+    Averages flat float32 vectors across workerNum processes through one
+    shared memory slot per worker and a barrier. Every worker reduces the
+    slots in the same order, so all receive bitwise identical results.
+    Must be passed to worker processes when they are created.
+    Args:
+        workerNum:          Number of participating processes.
+        size:               Max length of reduced vectors.
+        context (Opt):      multiprocessing context creating the shared
+                                memory. Defaults to the spawn context.
+    """
+
+    def __init__(self, workerNum, size, context=None):
+        context = context or multiprocessing.get_context('spawn')
+        self.workerNum  =   workerNum
+        self.size       =   size
+        self.rank       =   None
+        self._slots     =   context.RawArray('f', (workerNum * size))
+        self._barrier   =   context.Barrier(workerNum)
+
+    def __str__(self):
+        return (f'< SharedAllReduce WORKERS={self.workerNum} ' \
+                f'SIZE={self.size} >')
+
+    def attach(self, rank):
+        """ Sets the rank of the calling process; returns self """
+        assert (0 <= rank < self.workerNum), (f'rank expected to be in ' \
+                                    f'[0, {self.workerNum}), but found {rank}.')
+        self.rank = rank
+        return self
+
+    def mean(self, vector):
+        """ Returns the elementwise mean of vector across all workers """
+        vectorSize = len(vector)
+        assert (vectorSize <= self.size), (f'vector of length {vectorSize} ' \
+                                f'exceeds allreduce size of {self.size}.')
+        slots = np.frombuffer(self._slots, dtype='float32').reshape(
+                                                self.workerNum, self.size)
+        slots[self.rank, :vectorSize] = vector
+        self._barrier.wait()
+        reduced = slots[:, :vectorSize].mean(axis=0)
+        # no worker overwrites its slot until every worker has read
+        self._barrier.wait()
+        return reduced
+
+    def abort(self):
+        """ Breaks the barrier so workers blocked in mean() raise """
+        self._barrier.abort()
+        return True
+
+
+def _flatten(arrays):
+    """ Concatenates arrays into one flat float32 vector """
+    return np.concatenate([np.asarray(array, dtype='float32').ravel()
+                            for array in arrays])
+
+
+def _unflatten(vector, shapes):
+    """ Splits a flat vector into arrays of shapes """
+    sizes = [int(np.prod(shape)) for shape in shapes]
+    return [part.reshape(shape) for part, shape in
+            zip(np.split(vector, np.cumsum(sizes)[:-1]), shapes)]
+
+
+def reduce_size(gan):
+    """
+    Returns the allreduce length needed to train gan: the larger of the
+    discriminator and adversarial gradient vectors, with [loss, acc] and the
+    generator batch norm statistics appended to the latter.
+    """
+    from keras import backend as K
+    disSize = sum(K.count_params(weight) for weight in
+                    gan.discriminatorStructure.trainable_weights)
+    advSize = sum(K.count_params(weight) for weight in
+                    gan.adversarialCompiled.trainable_weights)
+    normSize = sum(K.count_params(weight) for weight in
+                    gan.generatorStructure.non_trainable_weights)
+    return (2 + max(disSize, (advSize + normSize)))
+
+
+class DataParallelStep(object):
+    """
+    One data-parallel training step of gan within a worker process. Mirrors
+    build_step_graph() in fused.py: the discriminator is updated on real
+    examples and inference-mode fakes, then the adversarial model (generator
+    and discriminator weights, as with adversarialCompiled) is updated with
+    the new discriminator. Each update's gradients are averaged across
+    workers before being applied. Generator batch norm normalizes with the
+    statistics of the local shard; its moving statistics are averaged along
+    with the adversarial gradients.
+    Args:
+        gan:                Compiled DC_GAN whose weights to train.
+        allReduce:          SharedAllReduce attached to this worker's rank.
+    """
+
+    def __init__(self, gan, allReduce):
+        import tensorflow as tf
+        from keras import backend as K
+        from fused import FusedRMSprop, binary_metrics, call_in_phase
+        generator = gan.generatorStructure
+        discriminator = gan.discriminatorStructure
+        self.allReduce      =   allReduce
+        self.disOptimizer   =   FusedRMSprop(gan.discriminatorCompiled.optimizer,
+                                            discriminator.trainable_weights,
+                                            'parallel_dis')
+        self.advOptimizer   =   FusedRMSprop(gan.adversarialCompiled.optimizer,
+                                            gan.adversarialCompiled.\
+                                                trainable_weights,
+                                            'parallel_adv')
+        self.normWeights    =   generator.non_trainable_weights
+        self.disShapes      =   [K.int_shape(p) for p in self.disOptimizer.params]
+        self.advShapes      =   [K.int_shape(p) for p in self.advOptimizer.params]
+        self.normShapes     =   [K.int_shape(w) for w in self.normWeights]
+        self.disOptimizer.sync_from(gan.discriminatorCompiled.optimizer)
+        self.advOptimizer.sync_from(gan.adversarialCompiled.optimizer)
+        validInput = K.placeholder(shape=((None,) + tuple(gan.imageShape)),
+                                    name='parallel_valid_examples')
+        disNoiseInput = K.placeholder(shape=(None, gan.LATENT_DIMS),
+                                    name='parallel_dis_noise')
+        advNoiseInput = K.placeholder(shape=(None, gan.LATENT_DIMS),
+                                    name='parallel_adv_noise')
+        # local discriminator loss and gradients
+        invalidExamples = K.stop_gradient(call_in_phase(generator,
+                                                        disNoiseInput,
+                                                        training=False))
+        disPreds = discriminator(K.concatenate([validInput, invalidExamples],
+                                                axis=0))
+        validNum = K.shape(validInput)[0]
+        disTargets = K.concatenate([tf.ones_like(disPreds[:validNum]),
+                                    tf.zeros_like(disPreds[validNum:])], axis=0)
+        disLoss, disAcc = binary_metrics(disPreds, disTargets)
+        self._disGradients = K.function([validInput, disNoiseInput,
+                                        K.learning_phase()],
+                                        ([disLoss, disAcc] + \
+                                        K.gradients(disLoss,
+                                                self.disOptimizer.params)))
+        # local adversarial loss and gradients, updating moving statistics
+        advPreds = discriminator(generator(advNoiseInput))
+        advLoss, advAcc = binary_metrics(advPreds, tf.ones_like(advPreds))
+        self._advGradients = K.function([advNoiseInput, K.learning_phase()],
+                                        ([advLoss, advAcc] + \
+                                        K.gradients(advLoss,
+                                                self.advOptimizer.params)),
+                            updates=generator.get_updates_for(advNoiseInput))
+        self._disApply = self._build_apply(self.disOptimizer)
+        self._advApply = self._build_apply(self.advOptimizer)
+
+    @staticmethod
+    def _build_apply(optimizer):
+        """ Compiles a function applying fed gradients with optimizer """
+        from keras import backend as K
+        gradInputs = [K.placeholder(shape=K.int_shape(p), dtype=K.dtype(p))
+                    for p in optimizer.params]
+        return K.function(gradInputs, [],
+                        updates=optimizer.apply_gradients(gradInputs))
+
+    def __call__(self, validExamples, disNoise, advNoise):
+        """
+        Runs one synchronous step on this worker's shard.
+        Returns:
+            Tuple of form (disData, advData), each [loss, acc] averaged
+            across all workers.
+        """
+        from keras import backend as K
+        disOut = self._disGradients([validExamples, disNoise, 1])
+        reduced = self.allReduce.mean(_flatten([disOut[:2]] + disOut[2:]))
+        self._disApply(_unflatten(reduced[2:], self.disShapes))
+        disData = list(reduced[:2])
+        advOut = self._advGradients([advNoise, 1])
+        reduced = self.allReduce.mean(_flatten([advOut[:2]] + advOut[2:] + \
+                                        K.batch_get_value(self.normWeights)))
+        advParts = _unflatten(reduced[2:],
+                            (self.advShapes + self.normShapes))
+        self._advApply(advParts[:len(self.advShapes)])
+        K.batch_set_value(list(zip(self.normWeights,
+                                    advParts[len(self.advShapes):])))
+        advData = list(reduced[:2])
+        return disData, advData
+
+    def resync(self):
+        """
+        Averages all weights across workers, removing any drift left by
+        non-associative floating point in the local updates.
+        """
+        from keras import backend as K
+        weights = self.advOptimizer.params + self.normWeights
+        reduced = self.allReduce.mean(_flatten(K.batch_get_value(weights)))
+        K.batch_set_value(list(zip(weights, _unflatten(reduced,
+                                    (self.advShapes + self.normShapes)))))
+        return True
+
+    def sync_to(self, gan):
+        """ Copies optimizer state to the compiled optimizers of gan """
+        self.disOptimizer.sync_to(gan.discriminatorCompiled.optimizer)
+        self.advOptimizer.sync_to(gan.adversarialCompiled.optimizer)
+        return True
+
+
+def _open_dataset(dataSpec, imageShape):
+    """ Opens the training data a worker samples from """
+    kind, source = dataSpec
+    if (kind == 'path'):
+        from datasets import MappedDataset
+        return MappedDataset(source, imageShape=imageShape)
+    if (kind == 'dataset'):
+        return source
+    sharedArray, shape = source
+    return np.frombuffer(sharedArray, dtype='float32').reshape(shape)
+
+
+def _train_worker(rank, config, allReduce, resultQueue):
+    """ Entry point of a worker process; see train_data_parallel() """
+    try:
+        # workers are CPU-only and confined to their share of cores
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+        import tensorflow as tf
+        from keras import backend as K
+        from model import DC_GAN
+        from checkpoint import restore_state, snapshot_state
+        threadNum = config['threadsPerWorker']
+        K.set_session(tf.Session(config=tf.ConfigProto(
+                                        intra_op_parallelism_threads=threadNum,
+                                        inter_op_parallelism_threads=1)))
+        params = config['state']['meta']['params']
+        gan = DC_GAN(params['name'], params['rowNum'], params['columnNum'],
+                    params['channelNum'])
+        for key, value in params.items():
+            if key.isupper():
+                setattr(gan, key, value)
+        gan.initialize_models(verbose=False, **config['optimizerParams'])
+        gan.discriminatorCompiled._make_train_function()
+        gan.adversarialCompiled._make_train_function()
+        # every worker starts from the parent's weights and optimizer state
+        restore_state(gan, config['state'])
+        parallelStep = DataParallelStep(gan, allReduce.attach(rank))
+        xTrain = _open_dataset(config['data'], gan.imageShape)
+        trainExampleNum = xTrain.shape[0]
+        shardSize = config['shardSize']
+        validExamples = np.empty(((shardSize,) + gan.imageShape),
+                                dtype='float32')
+        latentDims = gan.LATENT_DIMS
+        seed = config['seed']
+        randomState = np.random.RandomState(None if (seed is None) else
+                                            [seed, rank])
+        resultQueue.put(('ready', rank, None))
+        start = time.perf_counter()
+        for curStep in range(config['trainSteps']):
+            selectionIndex = randomState.randint(low=0, high=trainExampleNum,
+                                                size=shardSize)
+            if isinstance(xTrain, np.ndarray):
+                validExamples = xTrain[selectionIndex]
+            else:
+                # dataset objects gather into the reused batch
+                xTrain.take(selectionIndex, out=validExamples)
+            disNoise = randomState.uniform(low=-1.0, high=1.0,
+                                            size=(shardSize, latentDims))
+            advNoise = randomState.uniform(low=-1.0, high=1.0,
+                                            size=(shardSize, latentDims))
+            disData, advData = parallelStep(validExamples, disNoise, advNoise)
+            gan.weightVersion += 1
+            if config['syncInterval'] and \
+                (((curStep + 1) % config['syncInterval']) == 0):
+                parallelStep.resync()
+            if (rank == 0):
+                resultQueue.put(('step', curStep, (disData, advData)))
+        trainTime = time.perf_counter() - start
+        if (rank == 0):
+            parallelStep.sync_to(gan)
+            resultQueue.put(('done', trainTime,
+                            snapshot_state(gan, (config['trainSteps'] - 1))))
+    except BaseException:
+        resultQueue.put(('error', rank, traceback.format_exc()))
+        allReduce.abort()
+        raise
+
+
+def train_data_parallel(gan, xTrain, trainSteps=2000, batchSize=200,
+                        workerNum=2, threadsPerWorker=None, syncInterval=100,
+                        seed=None, verbose=True):
+    """
+    Trains gan with workerNum local processes, each computing gradients on
+    batchSize // workerNum examples of every batch. Workers start from the
+    current weights and optimizer state of gan, which is updated in place
+    with the trained weights and optimizer state once all steps complete;
+    the global np.random state of this process is left as it was.
+    Args:
+        gan:                Compiled DC_GAN to train.
+        xTrain:             Training features as an array, copied once into
+                                shared memory, a path to memory-map in
+                                each worker, or a dataset object with a
+                                take(index, out) method (MappedDataset,
+                                CompactDataset), pickled to each worker.
+                                Streams cannot be sharded across workers.
+        trainSteps (Opt):   Number of synchronous steps. Defaults to 2000.
+        batchSize (Opt):    Global batch size; must be divisible by
+                                workerNum. Defaults to 200.
+        workerNum (Opt):    Number of worker processes. Defaults to 2.
+        threadsPerWorker (Opt): TF intra-op threads per worker. Defaults to
+                                an even split of the machine's cores.
+        syncInterval (Opt): Steps between full weight averages guarding
+                                against drift. Defaults to 100; None
+                                disables.
+        seed (Opt):         Seed of worker sampling. Defaults to None.
+        verbose (Opt):      Whether to log every step. Defaults to True.
+    Returns:
+        Dict of form {'steps', 'workerNum', 'stepsPerSec', 'imagesPerSec',
+        'disData', 'advData'} with the metrics of the last step.
+    """
+    from checkpoint import snapshot_state, restore_state
+    assert (gan.discriminatorCompiled and gan.adversarialCompiled), \
+        "Models must be compiled. Try running 'self.initialize_models()'."
+    assert (isinstance(workerNum, int) and (workerNum > 0)), ('workerNum ' \
+                                                'must be a positive int.')
+    assert ((batchSize % workerNum) == 0), (f'batchSize of {batchSize} must ' \
+                                    f'be divisible by workerNum {workerNum}.')
+    assert (isinstance(trainSteps, int) and (trainSteps > 0)), \
+        f'trainSteps must be a positive int, but found {trainSteps}.'
+    threadsPerWorker = (threadsPerWorker or
+                        max(1, ((os.cpu_count() or 1) // workerNum)))
+    context = multiprocessing.get_context('spawn')
+    if isinstance(xTrain, str):
+        dataSpec = ('path', xTrain)
+    elif not isinstance(xTrain, np.ndarray):
+        assert (hasattr(xTrain, 'take') and hasattr(xTrain, 'shape')), \
+            ('xTrain expected an array, path or dataset with take(index, ' \
+            f'out), but found type {type(xTrain)}. Streams are only ' \
+            'supported by train_models().')
+        assert (tuple(xTrain.shape[1:]) == gan.imageShape), (f'xTrain ' \
+            f'expected shape {gan.imageShape}, but found shape {xTrain.shape}.')
+        dataSpec = ('dataset', xTrain)
+    else:
+        assert (xTrain.shape[1:] == gan.imageShape), (f'xTrain expected ' \
+            f'shape {gan.imageShape}, but found shape {xTrain.shape}.')
+        sharedArray = context.RawArray('f', int(xTrain.size))
+        np.frombuffer(sharedArray, dtype='float32')[:] = xTrain.ravel()
+        dataSpec = ('shared', (sharedArray, xTrain.shape))
+    # compiled optimizers must hold their slots to be snapshotted
+    gan.discriminatorCompiled._make_train_function()
+    gan.adversarialCompiled._make_train_function()
+    disConfig = gan.discriminatorCompiled.optimizer.get_config()
+    advConfig = gan.adversarialCompiled.optimizer.get_config()
+    config = {'state' : snapshot_state(gan, 0),
+            'optimizerParams' : {'disLr' : disConfig.get('lr',
+                                        disConfig.get('learning_rate')),
+                                'disDecay' : disConfig.get('decay', 0.),
+                                'advLr' : advConfig.get('lr',
+                                        advConfig.get('learning_rate')),
+                                'advDecay' : advConfig.get('decay', 0.)},
+            'data' : dataSpec, 'shardSize' : (batchSize // workerNum),
+            'trainSteps' : trainSteps, 'syncInterval' : syncInterval,
+            'threadsPerWorker' : threadsPerWorker, 'seed' : seed}
+    allReduce = SharedAllReduce(workerNum, reduce_size(gan), context)
+    resultQueue = context.Queue()
+    workers = [context.Process(target=_train_worker,
+                                args=(rank, config, allReduce, resultQueue),
+                                name=f'gan_worker_{rank}', daemon=True)
+                for rank in range(workerNum)]
+    for worker in workers:
+        worker.start()
+    print(f'Training for {trainSteps} steps on {workerNum} workers with ' \
+        f'{threadsPerWorker} threads each and batch size of {batchSize}.')
+    result, disData, advData = None, None, None
+    try:
+        while result is None:
+            try:
+                message = resultQueue.get(timeout=1.0)
+            except queue.Empty:
+                deadWorkers = [worker.name for worker in workers
+                                if (worker.exitcode not in (None, 0))]
+                assert not deadWorkers, f'Workers {deadWorkers} died.'
+                continue
+            kind = message[0]
+            if (kind == 'error'):
+                raise RuntimeError(f'Worker {message[1]} failed:\n' \
+                                    f'{message[2]}')
+            elif (kind == 'step'):
+                curStep, (disData, advData) = message[1], message[2]
+                if verbose:
+                    disLoss, disAcc = round(disData[0], 3), round(disData[1], 3)
+                    advLoss, advAcc = round(advData[0], 3), round(advData[1], 3)
+                    print(f'Step: {curStep}\n' \
+                        f'\tD [train loss: {disLoss} train acc: {disAcc}]\n' \
+                        f'\tA [loss: {advLoss} acc: {advAcc}]')
+            elif (kind == 'done'):
+                result = message
+    except BaseException:
+        allReduce.abort()
+        for worker in workers:
+            worker.terminate()
+        raise
+    for worker in workers:
+        worker.join()
+    _, trainTime, state = result
+    # this process keeps its own np.random state, not rank 0's
+    restore_state(gan, state, restoreRng=False)
+    stepsPerSec = (trainSteps / trainTime)
+    print(f'Data-parallel training complete: {round(stepsPerSec, 2)} ' \
+        f'steps/sec on {workerNum} workers.')
+    return {'steps' : trainSteps, 'workerNum' : workerNum,
+            'stepsPerSec' : stepsPerSec,
+            'imagesPerSec' : (stepsPerSec * batchSize),
+            'disData' : disData, 'advData' : advData}
@@ -0,0 +1,318 @@
+"""
+Implements input pipeline for preparing DC_GAN training batches off of the
+training thread
+"""
+
+
+import queue
+import threading
+import time
+import numpy as np
+from datasets import StreamDataset
+
+
+class BatchPrefetcher(object):
+    """
+    Prepares training batches on background worker threads and hands them to
+    the trainer through a bounded queue. Each worker owns its own RandomState
+    so that sampling never contends on the global numpy generator.
+    Args:
+        sampleFunc:             Function of a RandomState returning a single
+                                    batch (any object, usually a tuple of
+                                    arrays). Workers are threads, so batches
+                                    are handed over as-is, never pickled.
+        bufferSize (Opt):       Maximum number of prepared batches held in
+                                    the queue. Defaults to 4.
+        workerNum (Opt):        Number of worker threads. Defaults to 2.
+        seed (Opt):             Seed from which worker RandomStates are
+                                    derived. Defaults to None (random).
+    """
+
+    def __init__(self, sampleFunc, bufferSize=4, workerNum=2, seed=None):
+        assert isinstance(bufferSize, int), ('bufferSize expected type int, ' \
+                                        f'but found type {type(bufferSize)}')
+        assert (bufferSize > 0), 'bufferSize must be positive'
+        assert isinstance(workerNum, int), ('workerNum expected type int, ' \
+                                        f'but found type {type(workerNum)}')
+        assert (workerNum > 0), 'workerNum must be positive'
+        self.sampleFunc     =   sampleFunc
+        self.bufferSize     =   bufferSize
+        self.workerNum      =   workerNum
+        # bookkeeping on how often the trainer had to wait for data
+        self.batchNum       =   0
+        self.stallNum       =   0
+        self.stallTime      =   0.0
+        self._queue         =   queue.Queue(maxsize=bufferSize)
+        self._stopEvent     =   threading.Event()
+        self._error         =   None
+        seedSequence = np.random.RandomState(seed).randint(0, (2 ** 31) - 1,
+                                                        size=workerNum)
+        self._workers = [threading.Thread(target=self._work,
+                                        args=(np.random.RandomState(s),),
+                                        name=f'batch_prefetch_{i}',
+                                        daemon=True)
+                        for i, s in enumerate(seedSequence)]
+        for worker in self._workers:
+            worker.start()
+
+    def __str__(self):
+        return (f'< BatchPrefetcher WORKERS={self.workerNum} ' \
+                f'BUFFER={self.bufferSize} | {self.stall_report()} >')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _work(self, randomState):
+        """ Worker loop: samples batches until stopped """
+        while not self._stopEvent.is_set():
+            try:
+                batch = self.sampleFunc(randomState)
+            except Exception as error:
+                self._error = error
+                self._stopEvent.set()
+                return
+            # put with timeout so that close() is never blocked by full queue
+            while not self._stopEvent.is_set():
+                try:
+                    self._queue.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def get(self):
+        """
+        Returns the next prepared batch, blocking if none is ready. Each
+        blocking wait is counted as a stall.
+        """
+        try:
+            batch = self._queue.get_nowait()
+        except queue.Empty:
+            self.stallNum += 1
+            waitStart = time.perf_counter()
+            batch = None
+            while batch is None:
+                if self._error is not None:
+                    raise self._error
+                try:
+                    batch = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            self.stallTime += (time.perf_counter() - waitStart)
+        self.batchNum += 1
+        return batch
+
+    def stall_rate(self):
+        """ Fraction of batch requests that had to wait on workers """
+        return (self.stallNum / self.batchNum) if self.batchNum else 0.0
+
+    def stall_report(self):
+        """ Returns a one-line summary of trainer stalls """
+        return (f'stalled on {self.stallNum}/{self.batchNum} batches ' \
+                f'({round(100 * self.stall_rate(), 1)}%) for ' \
+                f'{round(self.stallTime, 3)}s')
+
+    def close(self):
+        """ Stops workers and releases any queued batches """
+        self._stopEvent.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        for worker in self._workers:
+            worker.join()
+        return True
+
+
+class BatchBuffers(object):
+    """
+    Owns persistent float32 buffers for assembling training batches so that
+    no per-step arrays are allocated: valid examples are gathered straight
+    into the first half of the discriminator features, generator output is
+    copied into the second half, noise is drawn in place and target vectors
+    are built once and marked read-only.
+    Args:
+        batchSize:          Number of valid (and invalid) examples per batch.
+        imageShape:         Shape of a single image.
+        latentDims:         Dimensions of generator latent space.
+        seed (Opt):         Seed of the noise generator. Defaults to None.
+    """
+
+    def __init__(self, batchSize, imageShape, latentDims, seed=None):
+        self.batchSize      =   batchSize
+        self.imageShape     =   tuple(imageShape)
+        self.latentDims     =   latentDims
+        self.disFeatures    =   np.empty(((2 * batchSize,) + self.imageShape),
+                                        dtype='float32')
+        self.validExamples  =   self.disFeatures[:batchSize]
+        self.invalidExamples =  self.disFeatures[batchSize:]
+        self.disNoise       =   np.empty((batchSize, latentDims), dtype='float32')
+        self.advNoise       =   np.empty((batchSize, latentDims), dtype='float32')
+        self.selectionIndex =   np.empty(batchSize, dtype='int64')
+        self.disTargets     =   np.concatenate([np.ones(batchSize),
+                                    np.zeros(batchSize)]).astype('float32')
+        self.advTargets     =   np.ones(batchSize, dtype='float32')
+        for target in (self.disTargets, self.advTargets):
+            target.setflags(write=False)
+        self._generator     =   np.random.default_rng(seed)
+
+    def _fill_noise(self, noise):
+        """ Draws uniform noise in [-1, 1) into noise in place """
+        self._generator.random(out=noise, dtype=np.float32)
+        noise *= 2.0
+        noise -= 1.0
+        return noise
+
+    def sample(self, dataset):
+        """
+        Samples one step of inputs into the buffers.
+        Args:
+            dataset:        Array of training examples to gather from,
+                                dataset object with a take(index, out)
+                                method, or StreamDataset to read from.
+        Returns:
+            Tuple of form (validExamples, disNoise, advNoise) of buffer views.
+        """
+        if isinstance(dataset, StreamDataset):
+            dataset.sample(self.batchSize, out=self.validExamples)
+            self._fill_noise(self.disNoise)
+            self._fill_noise(self.advNoise)
+            return (self.validExamples, self.disNoise, self.advNoise)
+        self.selectionIndex[:] = self._generator.integers(0, dataset.shape[0],
+                                                        size=self.batchSize)
+        if not isinstance(dataset, np.ndarray):
+            # out-of-core datasets gather into the buffer themselves
+            dataset.take(self.selectionIndex, out=self.validExamples)
+        elif (dataset.dtype == self.disFeatures.dtype):
+            np.take(dataset, self.selectionIndex, axis=0,
+                    out=self.validExamples)
+        else:
+            np.copyto(self.validExamples,
+                        np.take(dataset, self.selectionIndex, axis=0))
+        self._fill_noise(self.disNoise)
+        self._fill_noise(self.advNoise)
+        return (self.validExamples, self.disNoise, self.advNoise)
+
+    def assemble_discriminator(self, validExamples, invalidExamples):
+        """
+        Writes valid and invalid examples into the discriminator features
+        buffer; valid examples already gathered by sample() are not copied.
+        Returns:
+            Tuple of form (features, targets) of buffers.
+        """
+        if validExamples is not self.validExamples:
+            np.copyto(self.validExamples, validExamples)
+        np.copyto(self.invalidExamples, invalidExamples)
+        return (self.disFeatures, self.disTargets)
+
+
+class ReplayBuffer(object):
+    """
+    Fixed-size, preallocated ring buffer of past generator outputs from which
+    the invalid half of discriminator batches is partly drawn. Only a
+    refreshRatio share of each batch comes from a fresh generator forward
+    pass, and fresh images are only generated on every refreshInterval-th
+    discriminator step; other fakes are replayed from the buffer. Until the
+    buffer holds a full batch every fake is fresh.
+    Args:
+        capacity:           Number of images kept.
+        batchSize:          Number of fakes per discriminator batch.
+        imageShape:         Shape of a single image.
+        refreshRatio (Opt): Fraction of fakes freshly generated on refresh
+                                steps. Defaults to 0.5.
+        refreshInterval (Opt): Discriminator steps per generator refresh.
+                                Defaults to 1.
+        seed (Opt):         Seed of replay sampling. Defaults to None.
+    """
+
+    def __init__(self, capacity, batchSize, imageShape, refreshRatio=0.5,
+                refreshInterval=1, seed=None):
+        assert (capacity >= batchSize), ('capacity must hold at least one ' \
+                                        'batch.')
+        assert (0 < refreshRatio <= 1), 'refreshRatio must be in (0, 1].'
+        assert (isinstance(refreshInterval, int) and (refreshInterval > 0)), \
+            'refreshInterval must be a positive int.'
+        self.capacity           =   capacity
+        self.batchSize          =   batchSize
+        self.refreshRatio       =   refreshRatio
+        self.refreshInterval    =   refreshInterval
+        self.images             =   np.empty(((capacity,) + tuple(imageShape)),
+                                            dtype='float32')
+        self.fakes              =   np.empty(((batchSize,) + tuple(imageShape)),
+                                            dtype='float32')
+        self.size               =   0
+        self.cursor             =   0
+        # counts for reporting forward passes saved
+        self.stepNum            =   0
+        self.generateCalls      =   0
+        self.generatedNum       =   0
+        self.replayedNum        =   0
+        self._generator         =   np.random.default_rng(seed)
+
+    def __str__(self):
+        return (f'< ReplayBuffer SIZE={self.size}/{self.capacity} ' \
+                f'RATIO={self.refreshRatio} INTERVAL={self.refreshInterval} >')
+
+    def add(self, images):
+        """ Writes images into the ring, overwriting the oldest """
+        for start in range(0, len(images), self.capacity):
+            chunk = images[start:(start + self.capacity)]
+            stop = self.cursor + len(chunk)
+            firstNum = min(len(chunk), (self.capacity - self.cursor))
+            self.images[self.cursor:(self.cursor + firstNum)] = chunk[:firstNum]
+            if (stop > self.capacity):
+                self.images[:(stop - self.capacity)] = chunk[firstNum:]
+            self.cursor = stop % self.capacity
+            self.size = min((self.size + len(chunk)), self.capacity)
+        return True
+
+    def draw(self, disNoise, generate):
+        """
+        Returns the invalid examples of one discriminator batch as a view of
+        a persistent buffer, valid until the next call.
+        Args:
+            disNoise:       Noise of shape (batchSize, latentDims); its first
+                                rows seed the fresh images.
+            generate:       Function of (n, noiseVector) returning n images.
+        """
+        if (self.size < self.batchSize):
+            freshNum = self.batchSize
+        elif ((self.stepNum % self.refreshInterval) == 0):
+            freshNum = max(1, int(round(self.refreshRatio * self.batchSize)))
+        else:
+            freshNum = 0
+        self.stepNum += 1
+        replayNum = self.batchSize - freshNum
+        # replays are sampled before fresh images enter the buffer
+        if replayNum:
+            replayIndex = self._generator.integers(0, self.size, size=replayNum)
+            np.take(self.images[:self.size], replayIndex, axis=0,
+                    out=self.fakes[freshNum:])
+            self.replayedNum += replayNum
+        if freshNum:
+            self.fakes[:freshNum] = generate(freshNum,
+                                            noiseVector=disNoise[:freshNum])
+            self.add(self.fakes[:freshNum])
+            self.generateCalls += 1
+            self.generatedNum += freshNum
+        return self.fakes
+
+    def report(self, generateTime=None):
+        """
+        Returns a one-line summary of generator use. Given the total seconds
+        spent generating fakes, also estimates wall time saved.
+        """
+        if not self.stepNum:
+            return 'no steps recorded'
+        replayShare = self.replayedNum / (self.replayedNum + self.generatedNum)
+        summary = (f'{round(self.generateCalls / self.stepNum, 3)} D ' \
+                    f'generator passes/step, ' \
+                    f'{round(self.generatedNum / self.stepNum, 1)} fresh ' \
+                    f'images/step, {round(100 * replayShare, 1)}% replayed')
+        if generateTime and self.generatedNum:
+            savedTime = generateTime * (self.replayedNum / self.generatedNum)
+            summary += f', ~{round(savedTime, 2)}s saved'
+        return summary
@@ -0,0 +1,179 @@
+"""
+Implements an offline, FID-style sample quality metric for DC_GAN training:
+real and generated images are embedded by a fixed feature extractor (such
+as a trained discriminator up to its 'flat' layer, frozen and saved with
+save_feature_extractor()), feature means and covariances are accumulated
+batch by batch, and the Frechet distance between the two Gaussians is
+reported
+"""
+
+
+import numpy as np
+from latent import seeded_latents
+
+
+class StreamingMoments(object):
+    """
+    Running mean and covariance of feature vectors, merged batch by batch in
+    float64 with Chan's parallel update so no batch is kept.
+    Args:
+        dims:               Feature dimensions.
+    """
+
+    def __init__(self, dims):
+        self.dims   =   dims
+        self.count  =   0
+        self.mean   =   np.zeros(dims, dtype='float64')
+        self._m2    =   np.zeros((dims, dims), dtype='float64')
+
+    def add(self, features):
+        """ Merges a batch of shape (n, dims) """
+        features = np.asarray(features, dtype='float64')
+        batchCount = len(features)
+        if not batchCount:
+            return self
+        batchMean = features.mean(axis=0)
+        centered = features - batchMean
+        delta = batchMean - self.mean
+        totalCount = self.count + batchCount
+        self._m2 += (centered.T @ centered) + (np.outer(delta, delta) * \
+                    (self.count * batchCount / totalCount))
+        self.mean += delta * (batchCount / totalCount)
+        self.count = totalCount
+        return self
+
+    def covariance(self):
+        """ Returns the unbiased covariance matrix """
+        return self._m2 / max((self.count - 1), 1)
+
+
+def frechet_distance(mean1, cov1, mean2, cov2):
+    """
+    Frechet distance between Gaussians N(mean1, cov1) and N(mean2, cov2).
+    The trace of sqrtm(cov1 @ cov2) is taken from the eigenvalues of the
+    symmetric sqrt(cov1) @ cov2 @ sqrt(cov1), so only numpy is needed.
+    """
+    diff = mean1 - mean2
+    eigvals, eigvecs = np.linalg.eigh(cov1)
+    sqrtCov1 = (eigvecs * np.sqrt(np.clip(eigvals, 0.0, None))) @ eigvecs.T
+    productEigvals = np.linalg.eigvalsh(sqrtCov1 @ cov2 @ sqrtCov1)
+    traceSqrt = np.sum(np.sqrt(np.clip(productEigvals, 0.0, None)))
+    return float((diff @ diff) + np.trace(cov1) + np.trace(cov2) - \
+                (2.0 * traceSqrt))
+
+
+def build_feature_extractor(discriminator, layerName='flat'):
+    """
+    Returns a frozen copy of discriminator truncated at layerName, so
+    features stay fixed while the discriminator trains.
+    """
+    from keras.models import Model, clone_model
+    frozen = clone_model(discriminator)
+    frozen.set_weights(discriminator.get_weights())
+    frozen.trainable = False
+    return Model(inputs=frozen.input, outputs=frozen.get_layer(layerName).output)
+
+
+def save_feature_extractor(discriminator, path, layerName='flat'):
+    """
+    Freezes discriminator (usually a trained one) up to layerName and saves
+    it to path (.h5), so runs and resumed runs share one fixed extractor.
+    Returns:
+        path.
+    """
+    build_feature_extractor(discriminator, layerName).save(path,
+                                                    include_optimizer=False)
+    return path
+
+
+def load_feature_extractor(extractor):
+    """ Returns extractor, loading it first if it is a saved path """
+    if isinstance(extractor, str):
+        from keras.models import load_model
+        extractor = load_model(extractor, compile=False)
+        extractor.trainable = False
+    return extractor
+
+
+class QualityMetric(object):
+    """
+    FID-style distance between a fixed sample of real images and images
+    generated from fixed seeds. Real statistics are computed once; each
+    score() regenerates the fake sample with the current generator. Scores
+    are comparable across runs (and resumes) sharing an extractor, so one
+    must be given rather than derived from the model being trained.
+    Args:
+        gan:                DC_GAN whose generator to score.
+        referenceData:      Real images (array or dataset object).
+        extractor:          Keras model mapping images to features, or path
+                                of one saved by save_feature_extractor().
+        sampleNum (Opt):    Real and generated images per score. Defaults to
+                                1000.
+        batchSize (Opt):    Images per forward pass. Defaults to 200.
+        projectDims (Opt):  Features are reduced to projectDims by a fixed
+                                random projection, keeping covariance math
+                                cheap. Defaults to 256; None keeps all.
+        seed (Opt):         Seed of the real sample and projection. Defaults
+                                to 0.
+    """
+
+    def __init__(self, gan, referenceData, extractor, sampleNum=1000,
+                batchSize=200, projectDims=256, seed=0):
+        assert (extractor is not None), ('QualityMetric requires a fixed ' \
+                                        'feature extractor.')
+        self.gan        =   gan
+        self.batchSize  =   batchSize
+        self.extractor  =   load_feature_extractor(extractor)
+        featureDims = int(np.prod(self.extractor.output_shape[1:]))
+        randomState = np.random.RandomState(seed)
+        if projectDims and (projectDims < featureDims):
+            self.projection = (randomState.normal(size=(featureDims,
+                                                        projectDims)) / \
+                                np.sqrt(projectDims)).astype('float32')
+        else:
+            self.projection = None
+        self.dims       =   projectDims if (self.projection is not None) \
+                                else featureDims
+        self.seeds      =   np.arange(sampleNum)
+        self.history    =   []
+        # sorted gathers read memory-mapped data front to back
+        referenceIndex = np.sort(randomState.choice(len(referenceData),
+                                    size=min(sampleNum, len(referenceData)),
+                                    replace=False))
+        realMoments = StreamingMoments(self.dims)
+        for start in range(0, len(referenceIndex), batchSize):
+            realMoments.add(self.embed(
+                    referenceData[referenceIndex[start:(start + batchSize)]]))
+        self.realMean   =   realMoments.mean
+        self.realCov    =   realMoments.covariance()
+
+    def __str__(self):
+        lastScore = round(self.history[-1][1], 3) if self.history else None
+        return (f'< QualityMetric SAMPLES={len(self.seeds)} DIMS={self.dims} ' \
+                f'| LAST={lastScore} >')
+
+    def embed(self, images):
+        """ Returns features of shape (n, dims) for a batch of images """
+        features = self.extractor.predict(np.asarray(images, dtype='float32'),
+                                        batch_size=self.batchSize)
+        features = features.reshape(len(features), -1)
+        if self.projection is not None:
+            features = features @ self.projection
+        return features
+
+    def score(self, step=None):
+        """
+        Generates the fixed-seed sample in batches and returns its distance
+        to the real statistics, recording it in self.history.
+        """
+        fakeMoments = StreamingMoments(self.dims)
+        for start in range(0, len(self.seeds), self.batchSize):
+            seeds = self.seeds[start:(start + self.batchSize)]
+            latents = seeded_latents(seeds, self.gan.LATENT_DIMS)
+            fakeMoments.add(self.embed(self.gan.generate_images(len(seeds),
+                                        noiseVector=latents,
+                                        batchSize=self.batchSize)))
+        distance = frechet_distance(self.realMean, self.realCov,
+                                    fakeMoments.mean, fakeMoments.covariance())
+        self.history.append((step, distance))
+        return distance
@@ -1,27 +1,40 @@
+import os
 from model import DC_GAN
+from datasets import CompactDataset
 from tensorflow.examples.tutorials.mnist import input_data
 
-# read mnist data from tensorflow database
-mnistObj = input_data.read_data_sets("MNIST_data/", one_hot=True)
+# guarded since autotune probes spawn processes that re-import this module
+if __name__ == '__main__':
+    # read mnist data from tensorflow database
+    mnistObj = input_data.read_data_sets("MNIST_data/", one_hot=True)
 
-# pull out data and reshape images into proper shape
-# training
-xTrain = mnistObj.train.images
-xTrain = xTrain.reshape(xTrain.shape[0], 28, 28, 1)
-yTrain = mnistObj.train.labels
-# validation
-xVal = mnistObj.validation.images
-xVal = xVal.reshape(xVal.shape[0], 28, 28, 1)
-yVal = mnistObj.validation.labels
-# testing
-xTest = mnistObj.test.images
-xTest = xTest.reshape(xTest.shape[0], 28, 28, 1)
-yTest = mnistObj.test.labels
+    # pull out data and reshape images into proper shape
+    # training
+    xTrain = mnistObj.train.images
+    xTrain = xTrain.reshape(xTrain.shape[0], 28, 28, 1)
+    yTrain = mnistObj.train.labels
+    # validation
+    xVal = mnistObj.validation.images
+    xVal = xVal.reshape(xVal.shape[0], 28, 28, 1)
+    yVal = mnistObj.validation.labels
+    # testing
+    xTest = mnistObj.test.images
+    xTest = xTest.reshape(xTest.shape[0], 28, 28, 1)
+    yTest = mnistObj.test.labels
+    # store pixels as uint8, expanding only sampled batches to float32
+    xTrain = CompactDataset.from_float(xTrain)
+    xVal = CompactDataset.from_float(xVal)
+    xTest = CompactDataset.from_float(xTest)
 
-# initialize deep convolutional gan
-mnistGAN = DC_GAN(name='mnist_gan', rowNum=28, columnNum=28, channelNum=1)
-mnistGAN.initialize_models(disLr=0.0002, advLr=0.00009, verbose=True)
-mnistGAN.train_models(xTrain=xTrain, yTrain=yTrain, xVal=xVal, yVal=yVal,
-    xTest=xTest, yTest=yTest, trainSteps=80, preSteps=8, batchSize=200,
-    saveInterval=5, outPath='outs')
-mnistGAN.interpolate(5)
+    # initialize deep convolutional gan
+    mnistGAN = DC_GAN(name='mnist_gan', rowNum=28, columnNum=28, channelNum=1)
+    # set DCGAN_AUTOTUNE=1 to tune batch size and thread pools for this
+    # machine (cached after the first run); otherwise batches are 200
+    batchSize = 200
+    if os.environ.get('DCGAN_AUTOTUNE', '0') not in ('', '0'):
+        batchSize = mnistGAN.autotune()['batchSize']
+    mnistGAN.initialize_models(disLr=0.0002, advLr=0.00009, verbose=True)
+    mnistGAN.train_models(xTrain=xTrain, yTrain=yTrain, xVal=xVal, yVal=yVal,
+        xTest=xTest, yTest=yTest, trainSteps=80, preSteps=8,
+        batchSize=batchSize, saveInterval=5, outPath='outs')
+    mnistGAN.interpolate(5)
@@ -0,0 +1,238 @@
+"""
+Implements an asyncio generation service that serves concurrent image
+requests from a DC_GAN generator in micro-batches, and a local load test
+comparing it against running the generator once per request
+"""
+
+
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from keras import backend as K
+
+
+class GenerationServer(object):
+    """
+    Collects concurrent generate() calls into micro-batches bounded by
+    maxBatchSize images and maxWait seconds, runs one generator forward per
+    batch on a dedicated thread, and scatters the images back to callers.
+    Args:
+        gan:                DC_GAN whose generator to serve.
+        maxBatchSize (Opt): Max images per generator call. Defaults to 64.
+        maxWait (Opt):      Max seconds the first request of a batch waits
+                                for others to join. Defaults to 0.005.
+    """
+
+    def __init__(self, gan, maxBatchSize=64, maxWait=0.005):
+        assert gan.generatorStructure, ('Generator has not been built. Try ' \
+                                        "running 'gan.initialize_models()'.")
+        self.gan            =   gan
+        self.maxBatchSize   =   maxBatchSize
+        self.maxWait        =   maxWait
+        # batching statistics
+        self.batchNum       =   0
+        self.imageNum       =   0
+        self._queue         =   None
+        self._batchTask     =   None
+        # request that overflowed a batch, starting the next one
+        self._overflow      =   None
+        # generator runs on one thread in the graph it was built in, from
+        # start() until stop()
+        self._executor      =   None
+        self._graph         =   K.get_session().graph
+        gan.generatorStructure._make_predict_function()
+
+    def __str__(self):
+        meanBatch = (self.imageNum / self.batchNum) if self.batchNum else 0
+        return (f'< GenerationServer MAX_BATCH={self.maxBatchSize} ' \
+                f'MAX_WAIT={self.maxWait} | BATCHES={self.batchNum} ' \
+                f'MEAN_BATCH={round(meanBatch, 2)} >')
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def start(self):
+        """ Starts the batching loop on the running event loop """
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._batchTask = asyncio.ensure_future(self._batch_loop())
+        return True
+
+    async def stop(self):
+        """ Stops the batching loop; pending requests are cancelled """
+        self._batchTask.cancel()
+        try:
+            await self._batchTask
+        except asyncio.CancelledError:
+            pass
+        if self._overflow:
+            self._overflow[1].cancel()
+            self._overflow = None
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        return True
+
+    async def generate(self, n=1):
+        """
+        Requests n generated images. Requests of more than maxBatchSize
+        images are split into maxBatchSize parts served as separate requests.
+        Returns:
+            imageTensor of shape (n, rowNum, columnNum, channelNum).
+        """
+        assert (n > 0), 'n must be positive'
+        if (n > self.maxBatchSize):
+            parts = [self.generate(min(self.maxBatchSize, (n - start)))
+                    for start in range(0, n, self.maxBatchSize)]
+            return np.concatenate(await asyncio.gather(*parts))
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((n, future))
+        return await future
+
+    def _run_generator(self, noiseVector):
+        """ Runs the generator on noiseVector from the executor thread """
+        with self._graph.as_default():
+            return self.gan.generatorStructure.predict(noiseVector,
+                                            batch_size=len(noiseVector))
+
+    async def _batch_loop(self):
+        """ Forms micro-batches from queued requests and serves them """
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [self._overflow or (await self._queue.get())]
+            self._overflow = None
+            batchSize = requests[0][0]
+            deadline = loop.time() + self.maxWait
+            while (batchSize < self.maxBatchSize):
+                timeout = deadline - loop.time()
+                if (timeout <= 0):
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(),
+                                                    timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if ((batchSize + request[0]) > self.maxBatchSize):
+                    self._overflow = request
+                    break
+                requests.append(request)
+                batchSize += request[0]
+            await self._serve(requests, batchSize, loop)
+
+    async def _serve(self, requests, batchSize, loop):
+        """ Runs one generator forward for requests and scatters results """
+        noiseVector = np.random.uniform(-1.0, 1.0,
+                                        size=(batchSize, self.gan.LATENT_DIMS))
+        try:
+            imageTensor = await loop.run_in_executor(self._executor,
+                                                    self._run_generator,
+                                                    noiseVector)
+        except Exception as error:
+            for _, future in requests:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        self.batchNum += 1
+        self.imageNum += batchSize
+        splitPoints = np.cumsum([n for n, _ in requests])[:-1]
+        for (_, future), images in zip(requests,
+                                        np.split(imageTensor, splitPoints)):
+            if not future.done():
+                future.set_result(images)
+
+
+async def _run_clients(request_func, clientNum, requestsPerClient,
+                        imageRange, seed):
+    """
+    Runs clientNum concurrent clients, each awaiting requestsPerClient
+    sequential requests of a random number of images in imageRange.
+    Returns:
+        Tuple of form (latencies, imageNum, wallTime).
+    """
+    randomState = np.random.RandomState(seed)
+    requestSizes = randomState.randint(imageRange[0], (imageRange[1] + 1),
+                                    size=(clientNum, requestsPerClient))
+    latencies = []
+
+    async def client(sizes):
+        for n in sizes:
+            requestStart = time.perf_counter()
+            await request_func(int(n))
+            latencies.append(time.perf_counter() - requestStart)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(sizes) for sizes in requestSizes])
+    return latencies, int(requestSizes.sum()), (time.perf_counter() - start)
+
+
+def _summarize(name, latencies, imageNum, wallTime):
+    """ Prints and returns latency percentiles and throughput """
+    summary = {'p50' : float(np.percentile(latencies, 50)),
+                'p99' : float(np.percentile(latencies, 99)),
+                'imagesPerSec' : (imageNum / wallTime)}
+    print(f'{name}: p50 {round(1000 * summary["p50"], 2)}ms | ' \
+        f'p99 {round(1000 * summary["p99"], 2)}ms | ' \
+        f'{round(summary["imagesPerSec"], 1)} images/sec')
+    return summary
+
+
+def load_test(gan, clientNum=64, requestsPerClient=20, imageRange=(1, 4),
+            maxBatchSize=64, maxWait=0.005, seed=0):
+    """
+    Compares micro-batched serving against the naive path, where each request
+    runs generate_images() on its own, under identical concurrent load.
+    Args:
+        gan:                    DC_GAN with a built generator.
+        clientNum (Opt):        Concurrent clients. Defaults to 64.
+        requestsPerClient (Opt): Sequential requests per client. Defaults to
+                                    20.
+        imageRange (Opt):       Inclusive range of images per request.
+                                    Defaults to (1, 4).
+        maxBatchSize (Opt):     Server max batch size. Defaults to 64.
+        maxWait (Opt):          Server max wait in seconds. Defaults to 0.005.
+    Returns:
+        Dict mapping 'naive' and 'batched' to dicts of p50 and p99 latency in
+        seconds and images/sec.
+    """
+    graph = K.get_session().graph
+    gan.generatorStructure._make_predict_function()
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    def naive_generate(n):
+        with graph.as_default():
+            return gan.generate_images(n)
+
+    async def run_naive():
+        loop = asyncio.get_running_loop()
+        request_func = lambda n : loop.run_in_executor(executor,
+                                                    naive_generate, n)
+        return await _run_clients(request_func, clientNum, requestsPerClient,
+                                imageRange, seed)
+
+    async def run_batched():
+        async with GenerationServer(gan, maxBatchSize=maxBatchSize,
+                                    maxWait=maxWait) as server:
+            results = await _run_clients(server.generate, clientNum,
+                                        requestsPerClient, imageRange, seed)
+            print(server)
+            return results
+
+    results = {'naive' : _summarize('naive', *asyncio.run(run_naive())),
+            'batched' : _summarize('batched', *asyncio.run(run_batched()))}
+    executor.shutdown()
+    return results
+
+
+if __name__ == '__main__':
+    from model import DC_GAN
+    loadGAN = DC_GAN(name='load_test_gan', rowNum=28, columnNum=28,
+                    channelNum=1)
+    loadGAN.initialize_models(verbose=False)
+    load_test(loadGAN)
@@ -0,0 +1,156 @@
+"""
+Implements fast training snapshots: generator batches are tiled into a single
+mosaic with numpy reshapes and encoded straight to PNG on a background
+thread. Only numpy and the standard library are imported here so spawned
+processes that write images, like those of bulkgen.py, start quickly.
+"""
+
+
+import os
+import zlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def tile_mosaic(imageTensor, columns=None, padding=1, padValue=1.0):
+    """
+    Tiles a batch of images into one image grid without python loops.
+    Args:
+        imageTensor:        Array of shape (n, rows, cols, channels).
+        columns (Opt):      Images per grid row. Defaults to ceil(sqrt(n)).
+        padding (Opt):      Pixels of border around each image. Defaults to 1.
+        padValue (Opt):     Value of border and empty cells. Defaults to 1.0.
+    Returns:
+        Array of shape (gridRows * (rows + padding), gridCols * (cols +
+        padding), channels).
+    """
+    imageTensor = np.asarray(imageTensor)
+    imageNum, rowNum, columnNum, channelNum = imageTensor.shape
+    columns = columns or int(np.ceil(np.sqrt(imageNum)))
+    gridRows = int(np.ceil(imageNum / columns))
+    cells = np.full(((gridRows * columns), (rowNum + padding),
+                    (columnNum + padding), channelNum), padValue,
+                    dtype=imageTensor.dtype)
+    cells[:imageNum, :rowNum, :columnNum] = imageTensor
+    mosaic = cells.reshape(gridRows, columns, (rowNum + padding),
+                            (columnNum + padding), channelNum)
+    mosaic = mosaic.transpose(0, 2, 1, 3, 4)
+    return mosaic.reshape((gridRows * (rowNum + padding)),
+                        (columns * (columnNum + padding)), channelNum)
+
+
+def _png_chunk(chunkType, data):
+    """ Returns a length-prefixed, CRC-suffixed PNG chunk """
+    chunk = chunkType + data
+    return (struct.pack('>I', len(data)) + chunk +
+            struct.pack('>I', (zlib.crc32(chunk) & 0xFFFFFFFF)))
+
+
+def encode_png(image, compression=6):
+    """
+    Encodes an image in [0, 1] as PNG bytes.
+    Args:
+        image:              Array of shape (height, width, channels) with 1
+                                (grayscale) or 3 (RGB) channels.
+        compression (Opt):  zlib compression level. Defaults to 6.
+    Returns:
+        PNG file contents as bytes.
+    """
+    height, width, channelNum = image.shape
+    assert (channelNum in (1, 3)), ('encode_png expected 1 or 3 channels, ' \
+                                    f'but found {channelNum}.')
+    pixels = np.rint(np.clip(image, 0.0, 1.0) * 255.0).astype(np.uint8)
+    # each scanline is prefixed with filter type 0 (none)
+    scanlines = np.zeros((height, ((width * channelNum) + 1)), dtype=np.uint8)
+    scanlines[:, 1:] = pixels.reshape(height, (width * channelNum))
+    colorType = 0 if (channelNum == 1) else 2
+    header = struct.pack('>IIBBBBB', width, height, 8, colorType, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header) +
+            _png_chunk(b'IDAT', zlib.compress(scanlines.tobytes(),
+                                            compression)) +
+            _png_chunk(b'IEND', b''))
+
+
+def write_snapshot(imageTensor, outPath, columns=None, invert=False):
+    """
+    Tiles imageTensor and writes it to outPath as a PNG.
+    Args:
+        imageTensor:        Array of shape (n, rows, cols, channels).
+        outPath:            Path of PNG to write.
+        columns (Opt):      Images per grid row. Defaults to ceil(sqrt(n)).
+        invert (Opt):       Whether to invert intensities, matching the
+                                'Greys' colormap of plot_image_tensor().
+                                Defaults to False.
+    Returns:
+        outPath.
+    """
+    mosaic = tile_mosaic(imageTensor, columns=columns,
+                        padValue=(0.0 if invert else 1.0))
+    if invert:
+        mosaic = 1.0 - mosaic
+    tempPath = f'{outPath}.tmp'
+    with open(tempPath, 'wb') as pngFile:
+        pngFile.write(encode_png(mosaic))
+    os.replace(tempPath, outPath)
+    return outPath
+
+
+class SnapshotWriter(object):
+    """
+    Renders training snapshots on a background thread, so neither tiling,
+    encoding nor file IO run on the training thread. zlib and numpy release
+    the GIL for the heavy work, and a thread needs no child process, so
+    scripts calling train_models need no __main__ guard.
+    Args:
+        outFolder:          Folder to write snapshots under.
+        invert (Opt):       Whether to invert grayscale intensities. Defaults
+                                to False.
+        workerNum (Opt):    Number of writer threads. Defaults to 1.
+    """
+
+    def __init__(self, outFolder, invert=False, workerNum=1):
+        os.makedirs(outFolder, exist_ok=True)
+        self.outFolder  =   outFolder
+        self.invert     =   invert
+        self._pending   =   []
+        self._executor  =   ThreadPoolExecutor(max_workers=workerNum,
+                                            thread_name_prefix='snapshot')
+
+    def __str__(self):
+        return (f'< SnapshotWriter FOLDER={self.outFolder} ' \
+                f'PENDING={len(self._pending)} >')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _collect(self, wait=False):
+        """ Drops finished writes, raising any error they hit """
+        for future in list(self._pending):
+            if wait or future.done():
+                future.result()
+                self._pending.remove(future)
+
+    def submit(self, imageTensor, name):
+        """
+        Queues imageTensor to be written as {outFolder}/{name}.png.
+        Returns:
+            Path the snapshot will be written to.
+        """
+        self._collect()
+        outPath = os.path.join(self.outFolder, f'{name}.png')
+        # copied since the writer thread shares memory with the caller
+        self._pending.append(self._executor.submit(write_snapshot,
+                                                    np.array(imageTensor),
+                                                    outPath,
+                                                    invert=self.invert))
+        return outPath
+
+    def close(self):
+        """ Waits for pending snapshots and stops the writer threads """
+        self._collect(wait=True)
+        self._executor.shutdown()
+        return True
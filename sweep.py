@@ -0,0 +1,309 @@
+"""
+Runs hyperparameter sweeps over DC_GAN configurations on a local process
+pool. Every worker is pinned to its own set of cores with a matching thread
+budget, the training set is written once as .npy and memory-mapped read-only
+by all runs, and the final metrics of every run are collected into one table.
+
+    python sweep.py DATA.npy --space space.json --mode random --trials 16
+"""
+
+
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import itertools
+import traceback
+import multiprocessing
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+
+# DC_GAN attributes set before models are built
+MODEL_PARAMS    =   ('DIS_DEPTH', 'GEN_DEPTH', 'DROPOUT', 'KERNEL_SIZE',
+                    'STRIDE', 'LEAKY_ALPHA', 'LATENT_DIMS', 'NORM_MOMENTUM')
+# keyword arguments of initialize_models()
+COMPILE_PARAMS  =   ('disLr', 'disDecay', 'advLr', 'advDecay')
+RESULT_METRICS  =   ('disLoss', 'disAcc', 'advLoss', 'advAcc', 'valLoss',
+                    'valAcc', 'fid', 'imagesPerSec', 'seconds')
+
+
+def grid_configs(space):
+    """
+    Returns every combination of a grid search space, a dict of param name
+    to list of values.
+    """
+    names = sorted(space)
+    return [dict(zip(names, values))
+            for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_configs(space, n, seed=0):
+    """
+    Samples n configurations from a random search space: a dict of param
+    name to either a list of values to choose from or a list of form
+    ['uniform' | 'log' | 'int', low, high].
+    """
+    randomState = np.random.RandomState(seed)
+    configs = []
+    for _ in range(n):
+        config = {}
+        for name in sorted(space):
+            values = space[name]
+            if values and (values[0] in ('uniform', 'log', 'int')):
+                kind, low, high = values
+                if (kind == 'uniform'):
+                    config[name] = float(randomState.uniform(low, high))
+                elif (kind == 'log'):
+                    config[name] = float(np.exp(randomState.uniform(
+                                                np.log(low), np.log(high))))
+                else:
+                    config[name] = int(randomState.randint(low, (high + 1)))
+            else:
+                value = values[randomState.randint(len(values))]
+                config[name] = value.item() if hasattr(value, 'item') else value
+        configs.append(config)
+    return configs
+
+
+def core_sets(workerNum, threadsPerWorker):
+    """
+    Splits the cores available to this process into workerNum disjoint sets
+    of threadsPerWorker cores, or None where affinity is unsupported.
+    """
+    if not hasattr(os, 'sched_getaffinity'):
+        return [None] * workerNum
+    cores = sorted(os.sched_getaffinity(0))
+    assert ((workerNum * threadsPerWorker) <= len(cores)), (f'{workerNum} ' \
+        f'workers of {threadsPerWorker} threads need more than the ' \
+        f'{len(cores)} available cores.')
+    return [cores[(i * threadsPerWorker):((i + 1) * threadsPerWorker)]
+            for i in range(workerNum)]
+
+
+_WORKER_THREADS = None
+
+
+@contextmanager
+def worker_environment(threadsPerWorker):
+    """
+    Sets the thread limits and device visibility that spawned workers
+    inherit, restoring this process's environment on exit. They have to be in
+    place before a worker starts, since numpy reads them when the worker first
+    imports it, before any initializer runs.
+    """
+    settings = {'OMP_NUM_THREADS' : str(threadsPerWorker),
+                'MKL_NUM_THREADS' : str(threadsPerWorker),
+                'OPENBLAS_NUM_THREADS' : str(threadsPerWorker),
+                'CUDA_VISIBLE_DEVICES' : ''}
+    previous = {variable : os.environ.get(variable) for variable in settings}
+    os.environ.update(settings)
+    try:
+        yield settings
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+
+def _init_worker(coreQueue, threadsPerWorker):
+    """ Pins a new worker to the next free core set """
+    global _WORKER_THREADS
+    cores = coreQueue.get()
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+    _WORKER_THREADS = threadsPerWorker
+
+
+def run_config(runId, config, dataPath, imageShape, trainParams, outDir):
+    """
+    Trains one configuration in a worker process, logging to
+    {outDir}/run_{runId}.log.
+    Returns:
+        Result row of form {'run', params..., metrics..., 'error'}.
+    """
+    row = {'run' : runId, **config, 'error' : ''}
+    logPath = os.path.join(outDir, f'run_{runId:04d}.log')
+    try:
+        with open(logPath, 'w') as logFile, redirect_stdout(logFile):
+            import tensorflow as tf
+            from keras import backend as K
+            from model import DC_GAN
+            K.clear_session()
+            K.set_session(tf.Session(config=tf.ConfigProto(
+                                intra_op_parallelism_threads=_WORKER_THREADS,
+                                inter_op_parallelism_threads=1)))
+            gan = DC_GAN(f'sweep_{runId}', *imageShape)
+            for name in MODEL_PARAMS:
+                if name in config:
+                    setattr(gan, name, config[name])
+            gan.initialize_models(verbose=False,
+                                **{name : config[name] for name in
+                                    COMPILE_PARAMS if (name in config)})
+            records = []
+            start = time.perf_counter()
+            gan.train_models(dataPath, None, callbacks=[records.append],
+                            snapshotDir=None, **trainParams)
+            row['seconds'] = time.perf_counter() - start
+            # metrics of the last step, with throughput over the run
+            lastRecord = records[-1]
+            for name in RESULT_METRICS:
+                if name in lastRecord:
+                    row[name] = lastRecord[name]
+            row['imagesPerSec'] = float(np.mean([record['imagesPerSec']
+                                                for record in records]))
+    except Exception:
+        row['error'] = traceback.format_exc().strip().splitlines()[-1]
+    return row
+
+
+def prepare_dataset(xTrain, outDir):
+    """
+    Returns path of a .npy file holding xTrain that workers memory-map
+    read-only, writing arrays to outDir once.
+    """
+    if isinstance(xTrain, str):
+        return xTrain
+    dataPath = os.path.join(outDir, 'train.npy')
+    np.save(dataPath, np.ascontiguousarray(xTrain, dtype='float32'))
+    return dataPath
+
+
+def run_sweep(xTrain, configs, imageShape, outDir='sweeps', workerNum=2,
+            threadsPerWorker=None, trainParams=None, sortBy='advLoss'):
+    """
+    Trains every configuration on a pool of workerNum processes.
+    Args:
+        xTrain:             Training features as an array, written once to
+                                outDir, or a path to memory-map.
+        configs:            List of dicts of params from MODEL_PARAMS and
+                                COMPILE_PARAMS.
+        imageShape:         Shape of a single image.
+        outDir (Opt):       Directory of run logs and results.csv. Defaults to
+                                'sweeps'.
+        workerNum (Opt):    Number of concurrent runs. Defaults to 2.
+        threadsPerWorker (Opt): Cores and TF threads given to each run.
+                                Defaults to an even split of available cores.
+        trainParams (Opt):  Keyword arguments of train_models() shared by all
+                                runs. Defaults to 500 steps at batch size 200.
+        sortBy (Opt):       Metric by which to sort the table, ascending.
+                                Defaults to 'advLoss'.
+    Returns:
+        List of result rows sorted by sortBy.
+    """
+    os.makedirs(outDir, exist_ok=True)
+    availableCores = (len(os.sched_getaffinity(0))
+                    if hasattr(os, 'sched_getaffinity') else os.cpu_count())
+    threadsPerWorker = (threadsPerWorker or
+                        max(1, (availableCores // workerNum)))
+    trainParams = {'trainSteps' : 500, 'batchSize' : 200,
+                    **(trainParams or {})}
+    dataPath = prepare_dataset(xTrain, outDir)
+    context = multiprocessing.get_context('spawn')
+    coreQueue = context.Queue()
+    for cores in core_sets(workerNum, threadsPerWorker):
+        coreQueue.put(cores)
+    print(f'Sweeping {len(configs)} configurations on {workerNum} workers ' \
+        f'with {threadsPerWorker} threads each.')
+    rows = []
+    # workers are started on demand, so the environment stays set throughout
+    with worker_environment(threadsPerWorker), \
+        ProcessPoolExecutor(max_workers=workerNum, mp_context=context,
+                            initializer=_init_worker,
+                            initargs=(coreQueue, threadsPerWorker)) as executor:
+        futures = [executor.submit(run_config, runId, config, dataPath,
+                                    tuple(imageShape), trainParams, outDir)
+                    for runId, config in enumerate(configs)]
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            status = row['error'] or f'{sortBy}={row.get(sortBy)}'
+            print(f'[{len(rows)}/{len(configs)}] run {row["run"]}: {status}')
+    rows.sort(key=(lambda row : sort_key(row, sortBy)))
+    write_table(rows, os.path.join(outDir, 'results.csv'))
+    print(format_table(rows))
+    return rows
+
+
+def sort_key(row, sortBy):
+    """
+    Orders result rows by sortBy ascending, with rows missing it or holding
+    NaN after all scored rows and failed runs last.
+    """
+    value = row.get(sortBy)
+    scored = isinstance(value, (int, float)) and np.isfinite(value)
+    return (bool(row['error']), not scored, (value if scored else 0.0))
+
+
+def _columns(rows):
+    columns = ['run']
+    for row in rows:
+        columns += [name for name in row if (name not in columns)]
+    # errors read best at the end
+    columns.remove('error')
+    return columns + ['error']
+
+
+def write_table(rows, path):
+    """ Writes result rows to a CSV file """
+    with open(path, 'w', newline='') as tableFile:
+        writer = csv.DictWriter(tableFile, fieldnames=_columns(rows))
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def format_table(rows):
+    """ Returns result rows as an aligned text table """
+    columns = _columns(rows)
+
+    def format_value(value):
+        if isinstance(value, float):
+            return f'{value:.4g}'
+        return '' if (value is None) else str(value)
+
+    cells = [columns] + [[format_value(row.get(name)) for name in columns]
+                        for row in rows]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in
+                                zip(line, widths)) for line in cells)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=('Run a DC_GAN ' \
+                                                'hyperparameter sweep'))
+    parser.add_argument('data', help='Training features as .npy.')
+    parser.add_argument('--space', required=True,
+                        help='JSON search space of param name to values.')
+    parser.add_argument('--mode', choices=['grid', 'random'], default='grid')
+    parser.add_argument('--trials', type=int, default=16,
+                        help='Configurations sampled in random mode.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Cores and threads per worker.')
+    parser.add_argument('--steps', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--sort-by', default='advLoss')
+    parser.add_argument('--out', default='sweeps')
+    args = parser.parse_args(args)
+    with open(args.space) as spaceFile:
+        space = json.load(spaceFile)
+    configs = (grid_configs(space) if (args.mode == 'grid') else
+                random_configs(space, args.trials, seed=args.seed))
+    imageShape = np.load(args.data, mmap_mode='r').shape[1:]
+    run_sweep(args.data, configs, imageShape, outDir=args.out,
+            workerNum=args.workers, threadsPerWorker=args.threads,
+            trainParams={'trainSteps' : args.steps,
+                        'batchSize' : args.batch_size},
+            sortBy=args.sort_by)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
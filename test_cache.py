@@ -0,0 +1,38 @@
+"""
+Tests of the seeded image cache in cache.py
+"""
+
+
+import numpy as np
+from cache import LatentImageCache
+
+
+def test_cache_evicts_least_recently_used():
+    cache = LatentImageCache(maxSize=2)
+    for seed in range(3):
+        cache.put('v1', seed, np.full(2, seed, dtype='float32'))
+    assert (cache.get('v1', 0) is None)
+    assert (cache.get('v1', 1) is not None)
+    cache.put('v1', 3, np.zeros(2, dtype='float32'))
+    # seed 1 was used more recently than seed 2
+    assert (cache.get('v1', 2) is None)
+    assert (cache.get('v1', 1) is not None)
+
+
+def test_cache_drops_other_versions():
+    cache = LatentImageCache()
+    cache.put('v1', 0, np.ones(2, dtype='float32'))
+    assert (cache.get('v2', 0) is None)
+    assert (len(cache) == 0)
+    assert (cache.get('v1', 0) is None)
+
+
+def test_cached_images_are_read_only_copies():
+    cache = LatentImageCache()
+    image = np.ones(2, dtype='float32')
+    cache.put('v1', 0, image)
+    image[0] = 5.0
+    cached = cache.get('v1', 0)
+    np.testing.assert_array_equal(cached, [1.0, 1.0])
+    assert not cached.flags.writeable
+    assert (cache.hit_rate() == 1.0)
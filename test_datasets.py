@@ -0,0 +1,189 @@
+"""
+Tests of the dataset wrappers in datasets.py
+"""
+
+
+import os
+import pickle
+import numpy as np
+import pytest
+from datasets import (MappedDataset, CompactDataset, StreamDataset,
+                        StreamExhausted)
+
+
+IMAGE_SHAPE = (4, 3, 1)
+
+
+def make_images(n, seed=0):
+    return np.random.RandomState(seed).uniform(size=((n,) + IMAGE_SHAPE)
+                                                ).astype('float32')
+
+
+def write_shards(directory, images, shardSize, extension='.npy'):
+    """ Splits images into shards under directory """
+    os.makedirs(directory, exist_ok=True)
+    for i, start in enumerate(range(0, len(images), shardSize)):
+        shard = images[start:(start + shardSize)]
+        shardPath = os.path.join(directory, f'shard_{i:03d}{extension}')
+        if (extension == '.npy'):
+            np.save(shardPath, shard)
+        else:
+            shard.tofile(shardPath)
+
+
+def test_mapped_single_file(tmp_path):
+    images = make_images(10)
+    path = str(tmp_path / 'images.npy')
+    np.save(path, images)
+    dataset = MappedDataset(path)
+    assert (dataset.shape == images.shape)
+    assert (len(dataset) == 10)
+    np.testing.assert_array_equal(dataset[3], images[3])
+    np.testing.assert_array_equal(dataset[2:7], images[2:7])
+
+
+@pytest.mark.parametrize('extension', ['.npy', '.raw'])
+def test_mapped_take_across_shards(tmp_path, extension):
+    images = make_images(23)
+    write_shards(str(tmp_path), images, shardSize=5, extension=extension)
+    dataset = MappedDataset(str(tmp_path), imageShape=IMAGE_SHAPE)
+    assert (len(dataset.shards) == 5)
+    assert (dataset.shape == images.shape)
+    # unsorted, repeated indices spanning every shard keep their order
+    index = np.array([22, 0, 7, 7, 14, 3, 19, 5])
+    np.testing.assert_array_equal(dataset.take(index), images[index])
+    out = np.empty(((len(index),) + IMAGE_SHAPE), dtype='float32')
+    assert (dataset.take(index, out=out) is out)
+    np.testing.assert_array_equal(out, images[index])
+
+
+def test_mapped_boolean_and_tuple_keys(tmp_path):
+    images = make_images(12)
+    write_shards(str(tmp_path), images, shardSize=4)
+    dataset = MappedDataset(str(tmp_path))
+    mask = (np.arange(12) % 3 == 0)
+    np.testing.assert_array_equal(dataset[mask], images[mask])
+    np.testing.assert_array_equal(dataset[[1, 9], :, :, :], images[[1, 9]])
+
+
+def test_mapped_release_pages_keeps_data(tmp_path):
+    images = make_images(8)
+    write_shards(str(tmp_path), images, shardSize=3)
+    dataset = MappedDataset(str(tmp_path), releaseInterval=1)
+    for _ in range(3):
+        np.testing.assert_array_equal(dataset.take(np.arange(8)), images)
+
+
+def test_mapped_rejects_mismatched_shards(tmp_path):
+    np.save(str(tmp_path / 'a.npy'), make_images(3))
+    np.save(str(tmp_path / 'b.npy'), np.zeros((3, 2, 2, 1), dtype='float32'))
+    with pytest.raises(AssertionError):
+        MappedDataset(str(tmp_path))
+
+
+def test_compact_uint8_round_trip():
+    images = make_images(9)
+    dataset = CompactDataset.from_float(images, chunkSize=4)
+    assert (dataset.storage.dtype == np.uint8)
+    assert (dataset.nbytes == images.nbytes // 4)
+    index = np.array([8, 0, 4, 4])
+    taken = dataset.take(index)
+    assert (taken.dtype == np.float32)
+    # quantization error is at most half a level
+    np.testing.assert_allclose(taken, images[index], atol=(0.5 / 255) + 1e-7)
+
+
+def test_compact_binary_packbits_round_trip():
+    # 12 pixels per image pack into 2 bytes with a padded tail
+    images = (make_images(7) >= 0.5).astype('float32')
+    dataset = CompactDataset.from_float(images, binary=True, chunkSize=3)
+    assert (dataset.storage.shape == (7, 2))
+    np.testing.assert_array_equal(dataset.take(np.arange(7)), images)
+    out = np.empty(((2,) + IMAGE_SHAPE), dtype='float32')
+    dataset.take(np.array([6, 1]), out=out)
+    np.testing.assert_array_equal(out, images[[6, 1]])
+
+
+def test_compact_over_mapped_storage(tmp_path):
+    images = make_images(10)
+    storage = np.rint(images * 255.0).astype(np.uint8)
+    write_shards(str(tmp_path), storage, shardSize=4)
+    dataset = CompactDataset(MappedDataset(str(tmp_path)))
+    np.testing.assert_allclose(dataset[[3, 9]], (storage[[3, 9]] / 255.0),
+                                rtol=1e-6)
+
+
+def test_datasets_pickle_for_worker_processes(tmp_path):
+    images = make_images(9)
+    write_shards(str(tmp_path), images, shardSize=4)
+    mapped = pickle.loads(pickle.dumps(MappedDataset(str(tmp_path))))
+    np.testing.assert_array_equal(mapped.take(np.array([8, 2])),
+                                images[[8, 2]])
+    compact = CompactDataset.from_float(images)
+    compact.take(np.arange(3))
+    restored = pickle.loads(pickle.dumps(compact))
+    np.testing.assert_array_equal(restored.take(np.arange(9)),
+                                compact.take(np.arange(9)))
+
+
+def numbered_batches(n, batchSize):
+    """ Yields n images, each filled with its number, in batches """
+    # one array is reused for every batch, as decoding sources often do
+    batch = np.empty(((batchSize,) + IMAGE_SHAPE), dtype='float32')
+    for start in range(0, n, batchSize):
+        numbers = np.arange(start, min((start + batchSize), n))
+        batch[:len(numbers)] = numbers.reshape(-1, 1, 1, 1)
+        yield batch[:len(numbers)]
+
+
+def drain(dataset, batchSize):
+    """ Returns image numbers of every batch sampled until exhaustion """
+    numbers = []
+    while True:
+        try:
+            batch = dataset.sample(batchSize)
+        except StreamExhausted:
+            return numbers
+        assert (batch.shape == ((batchSize,) + IMAGE_SHAPE))
+        numbers.append(batch[:, 0, 0, 0].astype(int))
+
+
+@pytest.mark.parametrize('bufferSize', [None, 8, 13, 40])
+def test_stream_uses_each_image_exactly_once(bufferSize):
+    dataset = StreamDataset(numbered_batches(47, 5), IMAGE_SHAPE,
+                            bufferSize=bufferSize, seed=0)
+    numbers = np.concatenate(drain(dataset, 6))
+    # every whole batch the stream held, with the remainder dropped
+    assert (len(numbers) == 42)
+    assert (len(set(numbers)) == 42)
+    assert set(numbers) <= set(range(47))
+    if bufferSize is None:
+        np.testing.assert_array_equal(numbers, np.arange(42))
+    else:
+        assert not np.array_equal(numbers, np.arange(42))
+    assert dataset.exhausted
+
+
+def test_stream_callable_source():
+    batches = numbered_batches(20, 4)
+    dataset = StreamDataset(lambda : next(batches, None), IMAGE_SHAPE,
+                            bufferSize=10, seed=1)
+    out = np.empty(((5,) + IMAGE_SHAPE), dtype='float32')
+    assert (dataset.sample(5, out=out) is out)
+    numbers = np.concatenate(([out[:, 0, 0, 0].astype(int)] + \
+                            drain(dataset, 5)))
+    np.testing.assert_array_equal(np.sort(numbers), np.arange(20))
+
+
+def test_stream_single_images_and_shape_check():
+    images = make_images(3)
+    dataset = StreamDataset(iter(images), IMAGE_SHAPE)
+    np.testing.assert_array_equal(dataset.sample(3), images)
+    with pytest.raises(StreamExhausted):
+        dataset.sample(1)
+    wrongShape = StreamDataset([np.zeros((2, 5, 5, 1))], IMAGE_SHAPE)
+    with pytest.raises(AssertionError):
+        wrongShape.sample(2)
+    with pytest.raises(AssertionError):
+        StreamDataset(numbered_batches(10, 2), IMAGE_SHAPE,
+                    bufferSize=3).sample(4)
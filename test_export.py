@@ -0,0 +1,74 @@
+"""
+Tests of batch norm folding and weight quantization in export.py
+"""
+
+
+import numpy as np
+import pytest
+from export import fold_batch_norm, quantize_weight, dequantize_weight
+from infer import conv2d_transpose_same
+
+
+EPSILON = 1e-3
+
+
+def make_norm_weights(channelNum, randomState):
+    return [randomState.uniform(0.5, 1.5, size=channelNum),
+            randomState.normal(size=channelNum),
+            randomState.normal(size=channelNum),
+            randomState.uniform(0.1, 2.0, size=channelNum)]
+
+
+def batch_norm(x, normWeights):
+    gamma, beta, movingMean, movingVariance = normWeights
+    return ((gamma * (x - movingMean) / np.sqrt(movingVariance + EPSILON)) + \
+            beta)
+
+
+@pytest.mark.parametrize('useBias', [True, False])
+def test_fold_dense_matches_dense_then_norm(useBias):
+    randomState = np.random.RandomState(0)
+    x = randomState.normal(size=(8, 5)).astype('float32')
+    kernel = randomState.normal(size=(5, 6)).astype('float32')
+    bias = randomState.normal(size=6).astype('float32') if useBias else None
+    normWeights = make_norm_weights(6, randomState)
+    expected = batch_norm((x @ kernel) + (0.0 if (bias is None) else bias),
+                        normWeights)
+    foldedKernel, foldedBias = fold_batch_norm(kernel, bias, normWeights,
+                                                EPSILON, outAxis=-1)
+    np.testing.assert_allclose(((x @ foldedKernel) + foldedBias), expected,
+                                rtol=1e-4, atol=1e-4)
+
+
+def test_fold_transpose_conv_matches_conv_then_norm():
+    randomState = np.random.RandomState(1)
+    x = randomState.normal(size=(2, 6, 6, 3)).astype('float32')
+    # keras Conv2DTranspose kernels are (rows, cols, out, in)
+    kernel = randomState.normal(size=(5, 5, 4, 3)).astype('float32')
+    bias = randomState.normal(size=4).astype('float32')
+    normWeights = make_norm_weights(4, randomState)
+    expected = batch_norm(conv2d_transpose_same(x, kernel, bias), normWeights)
+    foldedKernel, foldedBias = fold_batch_norm(kernel, bias, normWeights,
+                                                EPSILON, outAxis=2)
+    np.testing.assert_allclose(conv2d_transpose_same(x, foldedKernel,
+                                                    foldedBias),
+                                expected, rtol=1e-4, atol=1e-4)
+
+
+def test_quantize_round_trip():
+    randomState = np.random.RandomState(2)
+    weight = randomState.normal(size=(3, 3, 8, 4)).astype('float32')
+    weight[:, :, 5] = 0.0
+    full, = quantize_weight(weight, None)
+    np.testing.assert_array_equal(dequantize_weight([full]), weight)
+    half = quantize_weight(weight, 'float16')
+    assert (half[0].dtype == np.float16)
+    np.testing.assert_allclose(dequantize_weight(half), weight, atol=1e-2)
+    values, scales = quantize_weight(weight, 'int8', outAxis=2)
+    assert (values.dtype == np.int8) and (scales.shape == (1, 1, 8, 1))
+    # per channel error is at most half a step of that channel's scale
+    error = np.abs(dequantize_weight([values, scales]) - weight)
+    assert np.all(error <= ((scales / 2) + 1e-6))
+    # all-zero channels keep a unit scale and stay exactly zero
+    assert (scales[0, 0, 5, 0] == 1.0)
+    assert not np.any(dequantize_weight([values, scales])[:, :, 5])
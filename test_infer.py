@@ -0,0 +1,52 @@
+"""
+Tests of the numpy forward pass in infer.py
+"""
+
+
+import numpy as np
+import pytest
+from infer import conv2d_transpose_same, NumpyGenerator
+
+
+def naive_conv2d_transpose_same(x, kernel, bias):
+    """ Scatters each input pixel through the kernel, then crops to same """
+    kernelRows, kernelCols, outChannels, _ = kernel.shape
+    imageNum, rowNum, columnNum, _ = x.shape
+    full = np.zeros((imageNum, (rowNum + kernelRows - 1),
+                    (columnNum + kernelCols - 1), outChannels))
+    for i in range(rowNum):
+        for j in range(columnNum):
+            for row in range(kernelRows):
+                for col in range(kernelCols):
+                    full[:, (i + row), (j + col)] += np.dot(x[:, i, j],
+                                                    kernel[row, col].T)
+    padTop, padLeft = ((kernelRows - 1) // 2), ((kernelCols - 1) // 2)
+    return (full[:, padTop:(padTop + rowNum), padLeft:(padLeft + columnNum)] + \
+            bias)
+
+
+@pytest.mark.parametrize('kernelSize', [(1, 1), (3, 3), (4, 4), (5, 2)])
+def test_conv2d_transpose_same_matches_reference(kernelSize):
+    randomState = np.random.RandomState(0)
+    x = randomState.normal(size=(2, 5, 6, 3)).astype('float32')
+    kernel = randomState.normal(size=(kernelSize + (4, 3))).astype('float32')
+    bias = randomState.normal(size=4).astype('float32')
+    out = conv2d_transpose_same(x, kernel, bias)
+    assert (out.shape == (2, 5, 6, 4))
+    np.testing.assert_allclose(out, naive_conv2d_transpose_same(x, kernel,
+                                bias), rtol=1e-4, atol=1e-4)
+
+
+def test_relu_layer_applies_relu():
+    x = np.linspace(-3.0, 3.0, 13).astype('float32')
+    layer = NumpyGenerator._build_layer('ReLU', {'max_value' : None,
+                            'negative_slope' : 0.0, 'threshold' : 0.0}, [])
+    np.testing.assert_array_equal(layer(x), np.maximum(x, 0.0))
+
+
+def test_relu_layer_honors_parameters():
+    x = np.linspace(-3.0, 3.0, 13).astype('float32')
+    layer = NumpyGenerator._build_layer('ReLU', {'max_value' : 2.0,
+                            'negative_slope' : 0.1, 'threshold' : 0.5}, [])
+    expected = np.where((x >= 0.5), np.minimum(x, 2.0), (0.1 * (x - 0.5)))
+    np.testing.assert_allclose(layer(x), expected, rtol=1e-6)
@@ -0,0 +1,55 @@
+"""
+Tests of step timing and export in instrument.py
+"""
+
+
+import csv
+import json
+from instrument import StepRecorder, PhaseTimer
+
+
+def test_csv_header_extends_for_late_phases(tmp_path):
+    path = str(tmp_path / 'steps.csv')
+    recorder = StepRecorder(path)
+    recorder.write({'step' : 0, 'time_sample' : 0.1, 'fid' : float('nan')})
+    recorder.write({'step' : 1, 'time_sample' : 0.2, 'time_snapshot' : 0.5,
+                    'fid' : 3.0})
+    recorder.write({'step' : 2, 'time_sample' : 0.3, 'fid' : 2.5})
+    recorder.close()
+    with open(path, newline='') as csvFile:
+        rows = list(csv.DictReader(csvFile))
+    assert (list(rows[0]) == ['step', 'time_sample', 'fid', 'time_snapshot'])
+    assert ([row['time_snapshot'] for row in rows] == ['', '0.5', ''])
+    assert ([row['fid'] for row in rows] == ['', '3.0', '2.5'])
+
+
+def test_jsonl_writes_null_for_missing_metrics(tmp_path):
+    path = str(tmp_path / 'steps.jsonl')
+    recorder = StepRecorder(path)
+    recorder.write({'step' : 0, 'fid' : float('nan'), 'advLoss' : 0.7})
+    recorder.close()
+    with open(path) as jsonFile:
+        lines = jsonFile.read().splitlines()
+    assert ('NaN' not in lines[0])
+    assert (json.loads(lines[0]) == {'step' : 0, 'fid' : None,
+                                    'advLoss' : 0.7})
+
+
+def test_phase_timer_records_and_exports(tmp_path):
+    path = str(tmp_path / 'steps.csv')
+    records = []
+    timer = PhaseTimer(outPath=path, callbacks=[records.append])
+    for step in range(3):
+        with timer.phase('sample'):
+            pass
+        if (step == 2):
+            with timer.phase('checkpoint'):
+                pass
+        timer.end_step(step, 10, advLoss=0.5)
+    timer.close()
+    assert (len(records) == 3)
+    assert ('time_checkpoint' in records[2])
+    assert (timer.summary()['steps'] == 3)
+    with open(path, newline='') as csvFile:
+        rows = list(csv.DictReader(csvFile))
+    assert (len(rows) == 3) and (rows[2]['time_checkpoint'] != '')
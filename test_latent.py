@@ -0,0 +1,42 @@
+"""
+Tests of latent construction in latent.py
+"""
+
+
+import numpy as np
+from latent import _splitmix64, seeded_latents
+
+
+def test_splitmix64_reference_values():
+    # first outputs of the reference SplitMix64 generator seeded with 0
+    outputs = _splitmix64(np.array([0, 1], dtype='uint64') * \
+                        np.uint64(0x9E3779B97F4A7C15))
+    assert (int(outputs[0]) == 0xE220A8397B1DCDAF)
+    assert (int(outputs[1]) == 0x6E789E6AA1B965F4)
+
+
+def test_seeded_latents_reproducible_per_seed():
+    together = seeded_latents([5, 0, 123456789], 16)
+    assert (together.shape == (3, 16))
+    assert (together.dtype == np.float32)
+    # a seed's latent does not depend on the other seeds requested with it
+    np.testing.assert_array_equal(together[0], seeded_latents([5], 16)[0])
+    np.testing.assert_array_equal(together[2],
+                                seeded_latents([123456789], 16)[0])
+    np.testing.assert_array_equal(seeded_latents([7, 7], 8)[0],
+                                seeded_latents([7, 7], 8)[1])
+
+
+def test_seeded_latents_range_and_spread():
+    latents = seeded_latents(np.arange(2000), 100, low=-1.0, high=1.0)
+    assert (latents.min() >= -1.0) and (latents.max() < 1.0)
+    assert (abs(float(latents.mean())) < 0.01)
+    # uniform on [-1, 1) has variance 1/3
+    assert (abs(float(latents.var()) - (1.0 / 3.0)) < 0.01)
+    # neighbouring seeds are not shifted copies of each other
+    assert not np.allclose(latents[0, 1:], latents[1, :-1])
+
+
+def test_seeded_latents_custom_range():
+    latents = seeded_latents(np.arange(50), 10, low=2.0, high=3.0)
+    assert (latents.min() >= 2.0) and (latents.max() <= 3.0)
@@ -0,0 +1,99 @@
+"""
+Tests of the single-file model format in modelfile.py
+"""
+
+
+import numpy as np
+import pytest
+from modelfile import (write_model_file, read_model_file, model_file_size,
+                        ALIGNMENT)
+
+
+class FakeStructure(object):
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def get_weights(self):
+        return [np.array(weight) for weight in self.weights]
+
+
+class FakeOptimizer(object):
+
+    def __init__(self, lr, decay):
+        self.config = {'lr' : lr, 'decay' : decay}
+
+    def get_config(self):
+        return dict(self.config)
+
+
+class FakeCompiled(object):
+
+    def __init__(self, lr, decay):
+        self.optimizer = FakeOptimizer(lr, decay)
+
+
+class FakeGAN(object):
+    """ Stands in for a built and compiled DC_GAN """
+
+    def __init__(self, seed=0):
+        randomState = np.random.RandomState(seed)
+        self.generatorStructure = FakeStructure([
+                    randomState.normal(size=(10, 49)).astype('float32'),
+                    randomState.normal(size=49).astype('float32'),
+                    randomState.normal(size=(5, 5, 3, 7)).astype('float32')])
+        self.discriminatorStructure = FakeStructure([
+                    randomState.normal(size=(3, 3, 1, 5)).astype('float32'),
+                    np.arange(5, dtype='int64')])
+        self.discriminatorCompiled = FakeCompiled(0.0002, 6e-8)
+        self.adversarialCompiled = FakeCompiled(0.0001, 3e-8)
+        self.weightVersion = 7
+
+    def get_params(self):
+        return {'name' : 'fake', 'rowNum' : 28, 'columnNum' : 28,
+                'channelNum' : 1, 'LATENT_DIMS' : 10}
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip_float32(tmp_path, mmap):
+    gan = FakeGAN()
+    path = str(tmp_path / 'model.dcgan')
+    size = write_model_file(gan, path)
+    assert (size == model_file_size(path))
+    header, groups = read_model_file(path, mmap=mmap)
+    assert (header['params'] == gan.get_params())
+    assert (header['weightVersion'] == 7)
+    assert (header['optimizerParams'] == {'disLr' : 0.0002, 'disDecay' : 6e-8,
+                                        'advLr' : 0.0001, 'advDecay' : 3e-8})
+    assert (set(groups) == {'generator', 'discriminator'})
+    for name, structure in (('generator', gan.generatorStructure),
+                            ('discriminator', gan.discriminatorStructure)):
+        assert (len(groups[name]) == len(structure.weights))
+        for read, weight in zip(groups[name], structure.weights):
+            assert (read.dtype == weight.dtype)
+            np.testing.assert_array_equal(read, weight)
+    assert all((entry['offset'] % ALIGNMENT == 0)
+                for entry in header['arrays'])
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip_float16(tmp_path, mmap):
+    gan = FakeGAN()
+    path = str(tmp_path / 'model.dcgan')
+    write_model_file(gan, path, dtype='float16')
+    _, groups = read_model_file(path, mmap=mmap)
+    for read, weight in zip(groups['generator'],
+                            gan.generatorStructure.weights):
+        assert (read.dtype == np.float16)
+        np.testing.assert_allclose(read, weight, rtol=1e-3, atol=1e-3)
+    # non-float weights are stored as they are
+    np.testing.assert_array_equal(groups['discriminator'][1], np.arange(5))
+    assert (groups['discriminator'][1].dtype == np.int64)
+
+
+def test_rejects_other_files(tmp_path):
+    path = str(tmp_path / 'other.bin')
+    with open(path, 'wb') as otherFile:
+        otherFile.write(b'\x00' * 64)
+    with pytest.raises(AssertionError):
+        read_model_file(path)
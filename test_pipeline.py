@@ -0,0 +1,66 @@
+"""
+Tests of the replay buffer in pipeline.py
+"""
+
+
+import numpy as np
+from pipeline import ReplayBuffer
+
+
+IMAGE_SHAPE = (2, 2, 1)
+
+
+def numbered(start, n):
+    """ Returns n images each filled with its number """
+    return (np.arange(start, (start + n), dtype='float32').reshape(
+            (-1, 1, 1, 1)) * np.ones(((1,) + IMAGE_SHAPE), dtype='float32'))
+
+
+def test_add_wraps_around_ring():
+    replay = ReplayBuffer(capacity=5, batchSize=2, imageShape=IMAGE_SHAPE)
+    replay.add(numbered(0, 3))
+    assert (replay.size == 3) and (replay.cursor == 3)
+    # 3, 4 fill the tail and 5, 6 overwrite the oldest slots
+    replay.add(numbered(3, 4))
+    assert (replay.size == 5) and (replay.cursor == 2)
+    np.testing.assert_array_equal(replay.images[:, 0, 0, 0], [5, 6, 2, 3, 4])
+    # adding exactly up to the end leaves the cursor at the start
+    replay.add(numbered(7, 3))
+    assert (replay.cursor == 0)
+    np.testing.assert_array_equal(replay.images[:, 0, 0, 0], [5, 6, 7, 8, 9])
+
+
+def test_add_more_than_capacity_keeps_newest():
+    replay = ReplayBuffer(capacity=4, batchSize=2, imageShape=IMAGE_SHAPE)
+    replay.add(numbered(0, 1))
+    replay.add(numbered(1, 10))
+    assert (replay.size == 4) and (replay.cursor == 3)
+    assert (sorted(replay.images[:, 0, 0, 0]) == [7, 8, 9, 10])
+
+
+def test_draw_refreshes_and_replays():
+    batchSize = 4
+    replay = ReplayBuffer(capacity=8, batchSize=batchSize,
+                        imageShape=IMAGE_SHAPE, refreshRatio=0.5,
+                        refreshInterval=2, seed=0)
+    counter = [100]
+
+    def generate(n, noiseVector):
+        assert (len(noiseVector) == n)
+        images = numbered(counter[0], n)
+        counter[0] += n
+        return images
+
+    noise = np.zeros((batchSize, 3), dtype='float32')
+    # every fake is fresh until the buffer holds a batch
+    fakes = replay.draw(noise, generate)
+    np.testing.assert_array_equal(fakes[:, 0, 0, 0], [100, 101, 102, 103])
+    # off step: everything replayed
+    fakes = replay.draw(noise, generate)
+    assert set(fakes[:, 0, 0, 0]) <= {100, 101, 102, 103}
+    # refresh step: half fresh, half replayed from what was buffered before
+    fakes = replay.draw(noise, generate)
+    np.testing.assert_array_equal(fakes[:2, 0, 0, 0], [104, 105])
+    assert set(fakes[2:, 0, 0, 0]) <= {100, 101, 102, 103}
+    assert (replay.generateCalls == 2) and (replay.generatedNum == 6)
+    assert (replay.replayedNum == 6)
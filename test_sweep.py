@@ -0,0 +1,21 @@
+"""
+Tests of result ordering in sweep.py
+"""
+
+
+from sweep import sort_key
+
+
+def test_sort_places_unscored_and_failed_runs_last():
+    rows = [{'run' : 0, 'fid' : float('nan'), 'error' : ''},
+            {'run' : 1, 'fid' : 3.0, 'error' : ''},
+            {'run' : 2, 'error' : ''},
+            {'run' : 3, 'fid' : 1.0, 'error' : ''},
+            {'run' : 4, 'fid' : 0.5, 'error' : 'ValueError: bad config'}]
+    # the order holds whatever order the runs finished in
+    for _ in range(2):
+        rows.sort(key=(lambda row : sort_key(row, 'fid')))
+        assert ([row['run'] for row in rows[:2]] == [3, 1])
+        assert ({row['run'] for row in rows[2:4]} == {0, 2})
+        assert (rows[-1]['run'] == 4)
+        rows.reverse()
@@ -0,0 +1,198 @@
+"""
+Implements amortized discriminator validation for DC_GAN training: small
+rotating slices of the validation set are evaluated on a schedule that keeps
+validation cost a bounded fraction of training time
+"""
+
+
+import time
+import numpy as np
+
+
+def stratified_order(exampleNum, labels=None, seed=0):
+    """
+    Returns a permutation of range(exampleNum) in which classes are
+    interleaved round-robin, so every contiguous slice is close to the class
+    balance of the whole set. Without labels, a plain random permutation.
+    Args:
+        exampleNum:         Number of examples.
+        labels (Opt):       Int labels of shape (exampleNum,) or one-hot
+                                labels of shape (exampleNum, classNum).
+        seed (Opt):         Seed of the shuffle. Defaults to 0.
+    """
+    randomState = np.random.RandomState(seed)
+    if labels is None:
+        return randomState.permutation(exampleNum)
+    labels = np.asarray(labels)
+    if (labels.ndim > 1):
+        labels = np.argmax(labels, axis=1)
+    shuffled = randomState.permutation(exampleNum)
+    shuffledLabels = labels[shuffled]
+    # rank of each example within its class, scaled by class frequency,
+    # spreads every class evenly across the order
+    classOrder = np.argsort(shuffledLabels, kind='stable')
+    _, classCounts = np.unique(shuffledLabels, return_counts=True)
+    classStarts = np.concatenate([[0], np.cumsum(classCounts)[:-1]])
+    classRank = np.empty(exampleNum, dtype='float64')
+    for start, count in zip(classStarts, classCounts):
+        members = classOrder[start:(start + count)]
+        classRank[members] = (np.arange(count) + 0.5) / count
+    return shuffled[np.argsort(classRank, kind='stable')]
+
+
+class RunningMetrics(object):
+    """ Example-weighted running means of [loss, acc] """
+
+    def __init__(self):
+        self.exampleNum =   0
+        self.totals     =   np.zeros(2)
+
+    def add(self, metrics, exampleNum):
+        self.totals += (np.asarray(metrics[:2], dtype='float64') * exampleNum)
+        self.exampleNum += exampleNum
+
+    def result(self):
+        """ Returns [loss, acc] means, or [0, 0] if nothing was added """
+        if not self.exampleNum:
+            return [0.0, 0.0]
+        return list(self.totals / self.exampleNum)
+
+
+def evaluate_discriminator(gan, features, batchSize):
+    """
+    Evaluates the discriminator on features as real examples mixed with an
+    equal number of generated fakes, streaming in batches of batchSize.
+    Returns:
+        [loss, acc] over all real and fake examples.
+    """
+    metrics = RunningMetrics()
+    for start in range(0, len(features), batchSize):
+        validExamples = features[start:(start + batchSize)]
+        exampleNum = len(validExamples)
+        invalidExamples = gan.generate_images(exampleNum)
+        batchData = gan.discriminatorCompiled.test_on_batch(
+                        x=np.concatenate([validExamples, invalidExamples]),
+                        y=np.concatenate([np.ones(exampleNum),
+                                        np.zeros(exampleNum)]))
+        metrics.add(batchData, (2 * exampleNum))
+    return metrics.result()
+
+
+def evaluate_dataset(gan, dataset, batchSize=500):
+    """
+    Streams an entire dataset (array or dataset object) through
+    evaluate_discriminator() batch by batch without materializing it.
+    Returns:
+        [loss, acc] over the whole dataset and as many fakes.
+    """
+    metrics = RunningMetrics()
+    for start in range(0, len(dataset), batchSize):
+        validExamples = dataset[start:(start + batchSize)]
+        metrics.add(evaluate_discriminator(gan, validExamples, batchSize),
+                    (2 * len(validExamples)))
+    return metrics.result()
+
+
+class RotatingValidator(object):
+    """
+    Evaluates the discriminator on a rotating, stratified chunk of the
+    validation set mixed with generated fakes. Every full pass over the
+    validation set (a window) yields a full-coverage result; between passes
+    the running result of the current window is reported. Validation runs at
+    most every interval steps, and the interval is stretched whenever needed
+    to keep validation time under maxFraction of training time.
+    Args:
+        gan:                DC_GAN whose discriminator to validate.
+        xVal:               Validation features (array or dataset object).
+        yVal (Opt):         Validation labels used to stratify chunks.
+        chunkSize (Opt):    Real examples evaluated per validation. Defaults
+                                to 200.
+        interval (Opt):     Minimum steps between validations. Defaults to 10.
+        maxFraction (Opt):  Max fraction of training time spent validating.
+                                Defaults to 0.1.
+        seed (Opt):         Seed of the stratified order. Defaults to 0.
+    """
+
+    def __init__(self, gan, xVal, yVal=None, chunkSize=200, interval=10,
+                maxFraction=0.1, seed=0):
+        assert (chunkSize > 0), 'chunkSize must be positive'
+        assert (interval > 0), 'interval must be positive'
+        assert (0 < maxFraction <= 1), 'maxFraction must be in (0, 1]'
+        self.gan            =   gan
+        self.xVal           =   xVal
+        self.chunkSize      =   min(chunkSize, len(xVal))
+        self.interval       =   interval
+        self.maxFraction    =   maxFraction
+        self.order          =   stratified_order(len(xVal), yVal, seed=seed)
+        self.cursor         =   0
+        self.window         =   RunningMetrics()
+        self.lastWindow     =   None
+        self.windowNum      =   0
+        # time accounting for the validation budget
+        self.trainTime      =   0.0
+        self.stepNum        =   0
+        self.valTime        =   0.0
+        self.valNum         =   0
+        self._nextStep      =   interval
+
+    def __str__(self):
+        return (f'< RotatingValidator CHUNK={self.chunkSize} ' \
+                f'INTERVAL={self.interval} | WINDOWS={self.windowNum} ' \
+                f'COST={round(100 * self.cost_fraction(), 1)}% >')
+
+    def cost_fraction(self):
+        """ Fraction of total time spent validating so far """
+        totalTime = self.trainTime + self.valTime
+        return (self.valTime / totalTime) if totalTime else 0.0
+
+    def result(self):
+        """
+        Returns the latest full-window [loss, acc], or the running result of
+        the first window until it completes.
+        """
+        return self.lastWindow if self.lastWindow else self.window.result()
+
+    def run(self):
+        """ Evaluates the next chunk and advances the rotation """
+        start = time.perf_counter()
+        chunkIndex = self.order[self.cursor:(self.cursor + self.chunkSize)]
+        # sorted gathers read memory-mapped data front to back
+        validExamples = self.xVal[np.sort(chunkIndex)]
+        self.window.add(evaluate_discriminator(self.gan, validExamples,
+                                                self.chunkSize),
+                        (2 * len(chunkIndex)))
+        self.cursor += len(chunkIndex)
+        if (self.cursor >= len(self.order)):
+            self.lastWindow = self.window.result()
+            self.window = RunningMetrics()
+            self.windowNum += 1
+            self.cursor = 0
+        self.valTime += (time.perf_counter() - start)
+        self.valNum += 1
+        return self.result()
+
+    def step(self, curStep, stepTime, stepNum=1):
+        """
+        Records stepTime seconds spent on stepNum training steps ending at
+        curStep, and validates if scheduled.
+        Args:
+            curStep:            Last training step completed.
+            stepTime:           Seconds of training since the last call.
+            stepNum (Opt):      Training steps those seconds covered, as when
+                                    several run in one fused call. Defaults
+                                    to 1.
+        Returns:
+            [loss, acc] of self.result().
+        """
+        self.trainTime += stepTime
+        self.stepNum += stepNum
+        if (curStep >= self._nextStep):
+            self.run()
+            # stretch the interval so validation stays within budget
+            meanStepTime = self.trainTime / self.stepNum
+            meanValTime = self.valTime / self.valNum
+            budgetSteps = meanValTime / max((self.maxFraction * meanStepTime),
+                                            1e-12)
+            self._nextStep = curStep + max(self.interval,
+                                            int(np.ceil(budgetSteps)))
+        return self.result()